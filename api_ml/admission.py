@@ -0,0 +1,143 @@
+import contextvars
+import heapq
+import itertools
+import math
+import threading
+import time
+from collections import defaultdict, deque
+from concurrent.futures import Future
+from contextlib import contextmanager
+
+# Deadline (time.monotonic) of the request being processed, None when the client did not give one
+request_deadline = contextvars.ContextVar("request_deadline", default=None)
+
+
+class DeadlineExceeded(Exception):
+    pass
+
+
+class Overloaded(Exception):
+    def __init__(self, retry_after):
+        Exception.__init__(self, "Retry after {} seconds".format(retry_after))
+        self.retry_after = retry_after
+
+
+def remaining(deadline):
+    return None if deadline is None else deadline - time.monotonic()
+
+
+# Requests processed at the same time by a service (or by a worker) and requests waiting for their turn.
+# A request is rejected at once when the queue is full, a waiting request gives up when its deadline passes.
+# Waiters are futures so that the same object works for threads and for the event loop of the asgi app.
+class AdmissionControl(object):
+    def __init__(self, max_concurrency=None, max_queue=0):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.lock = threading.Lock()
+        self.running = 0
+        self.waiters = deque()
+        self.rejected = defaultdict(int)
+        # Moving average of the time a request holds its slot, used to tell clients when to come back
+        self.mean_duration = 1.
+
+    def retry_after(self):
+        return max(1, math.ceil(self.mean_duration * (len(self.waiters) + 1) / (self.max_concurrency or 1)))
+
+    def try_acquire(self):
+        # None when the request is admitted, otherwise a future set when a slot is handed over to it
+        with self.lock:
+            if self.max_concurrency is None or self.running < self.max_concurrency:
+                self.running += 1
+                return None
+            if len(self.waiters) >= self.max_queue:
+                self.rejected["overloaded"] += 1
+                raise Overloaded(self.retry_after())
+            waiter = Future()
+            self.waiters.append(waiter)
+            return waiter
+
+    def give_up(self, waiter):
+        with self.lock:
+            if waiter in self.waiters:
+                self.waiters.remove(waiter)
+                self.rejected["deadline"] += 1
+                return
+        # The slot was handed over while the deadline passed
+        self.release()
+
+    def release(self, duration=None):
+        with self.lock:
+            if duration is not None:
+                self.mean_duration = 0.9 * self.mean_duration + 0.1 * duration
+            while self.waiters:
+                waiter = self.waiters.popleft()
+                if waiter.set_running_or_notify_cancel():
+                    waiter.set_result(None)
+                    return
+            self.running -= 1
+
+    @contextmanager
+    def slot(self, deadline=None):
+        waiter = self.try_acquire()
+        if waiter is not None:
+            try:
+                waiter.result(timeout=remaining(deadline))
+            except TimeoutError:
+                self.give_up(waiter)
+                raise DeadlineExceeded()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.release(time.perf_counter() - start)
+
+    def stats(self):
+        with self.lock:
+            return {
+                "max_concurrency": self.max_concurrency,
+                "max_queue": self.max_queue,
+                "running": self.running,
+                "waiting": len(self.waiters),
+                "rejected": dict(self.rejected)
+            }
+
+
+# Forward passes of the services of a worker share a few slots (the cores are already used by the intra-op threads).
+# Waiting batches get a slot in weighted fair order: each service has a virtual time growing with the time its
+# batches computed divided by its priority, the batch of the service with the smallest virtual time goes first.
+class ComputeGate(object):
+    def __init__(self, slots=1):
+        self.slots = slots
+        self.lock = threading.Lock()
+        self.busy = 0
+        self.waiting = []
+        self.counter = itertools.count()
+        self.virtual_times = defaultdict(float)
+        # Virtual time of the last batch started, a service idle for a while does not get credit for it
+        self.clock = 0.
+
+    @contextmanager
+    def slot(self, name, priority=1):
+        with self.lock:
+            virtual_time = max(self.virtual_times[name], self.clock)
+            event = None
+            if self.busy < self.slots:
+                self.busy += 1
+            else:
+                event = threading.Event()
+                heapq.heappush(self.waiting, (virtual_time, next(self.counter), event))
+        if event is not None:
+            event.wait()
+
+        with self.lock:
+            self.clock = max(self.clock, virtual_time)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            with self.lock:
+                self.virtual_times[name] = virtual_time + (time.perf_counter() - start) / priority
+                if self.waiting:
+                    heapq.heappop(self.waiting)[2].set()
+                else:
+                    self.busy -= 1
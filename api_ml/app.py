@@ -1,24 +1,97 @@
+import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
 import falcon
 
-from api_ml import models_utils
+from api_ml import models_utils, parameters
+from api_ml.fetching import ImageFetcher
+from api_ml.jobs import JobManager
 from .services import Services
-from api_ml.utils import DefaultRoute
+from api_ml.utils import AsyncDefaultRoute, DefaultRoute
+
+
+def create_jobs(services):
+    jobs_dir = os.environ.get("API_ML_JOBS_DIR", parameters.jobs_dir)
+    if jobs_dir is None:
+        # Private to this server (or to this worker without --preload), its jobs are not resumed by the next one
+        jobs_dir = tempfile.mkdtemp(prefix="api_ml_jobs_")
+    return JobManager(models_utils.Predict(services, ImageFetcher(max_workers=parameters.jobs_fetch_workers)), jobs_dir)
 
 
 def create_app():
     api = falcon.API()
     services = Services()
-    api.add_route("/create", models_utils.LoadModel(services))
+    load_model = models_utils.LoadModel(services)
+    # Services created by the other workers are applied before each request (shared_dir)
+    if services.shared is not None:
+        api.add_middleware(models_utils.SyncServices(load_model))
+    api.add_route("/create", load_model)
     api.add_route("/delete", models_utils.DeleteModel(services))
     api.add_route("/predict", models_utils.Predict(services))
     api.add_route("/available", models_utils.ListAvailableModels(services))
     api.add_route("/online", models_utils.ListOnlineModels(services))
+    api.add_route("/metrics", models_utils.ExportMetrics(services))
+
+    # Jobs have their own fetcher so that they do not take the threads downloading the images of /predict
+    jobs = create_jobs(services)
+    api.add_middleware(models_utils.StartJobs(jobs))
+    api.add_route("/jobs", models_utils.SubmitJob(services, jobs))
+    api.add_route("/jobs/{job_id}", models_utils.ManageJob(jobs))
+    api.add_route("/jobs/{job_id}/results", models_utils.JobResults(jobs))
 
     default_route = DefaultRoute(api)
     api.add_sink(default_route.on_get, '')
 
+    # Services of a restarted worker are restored before it accepts traffic
+    manifest = os.environ.get("API_ML_MANIFEST", parameters.manifest)
+    if manifest is not None:
+        load_model.restore(manifest)
+
     return api
 
 
 def get_app():
     return create_app()
+
+
+# Asyncio version of the app, served by an asgi server (uvicorn --factory api_ml.app:get_asgi_app)
+def create_asgi_app():
+    # Only imported by the asgi app, the wsgi one does not need aiohttp
+    import falcon.asgi
+    from api_ml import async_models_utils
+    from api_ml.fetching import AsyncImageFetcher
+
+    fetcher = AsyncImageFetcher()
+    executor = ThreadPoolExecutor(max_workers=parameters.services_max_workers, thread_name_prefix="services")
+    api = falcon.asgi.App(middleware=[async_models_utils.FetcherLifespan(fetcher)])
+    services = Services()
+    load_model = async_models_utils.AsyncLoadModel(services, executor)
+    if services.shared is not None:
+        api.add_middleware(async_models_utils.AsyncSyncServices(load_model, executor))
+    api.add_route("/create", load_model)
+    api.add_route("/delete", async_models_utils.AsyncDeleteModel(services, executor))
+    api.add_route("/predict", async_models_utils.AsyncPredict(services, fetcher))
+    api.add_route("/available", async_models_utils.AsyncListAvailableModels(services))
+    api.add_route("/online", async_models_utils.AsyncListOnlineModels(services))
+    api.add_route("/metrics", async_models_utils.AsyncExportMetrics(services))
+
+    # Jobs are run by threads with the blocking fetcher, out of the event loop
+    jobs = create_jobs(services)
+    api.add_middleware(async_models_utils.AsyncStartJobs(jobs))
+    api.add_route("/jobs", async_models_utils.AsyncSubmitJob(services, jobs, executor))
+    api.add_route("/jobs/{job_id}", async_models_utils.AsyncManageJob(jobs, executor))
+    api.add_route("/jobs/{job_id}/results", async_models_utils.AsyncJobResults(jobs))
+
+    default_route = AsyncDefaultRoute(api)
+    api.add_sink(default_route.on_get, '')
+
+    manifest = os.environ.get("API_ML_MANIFEST", parameters.manifest)
+    if manifest is not None:
+        load_model.restore(manifest)
+
+    return api
+
+
+def get_asgi_app():
+    return create_asgi_app()
@@ -0,0 +1,70 @@
+import json
+import logging
+import os
+import tempfile
+
+import torch
+
+logger = logging.getLogger(__name__)
+
+
+# Cache on disk of the ready to serve modules (quantized and compiled) of the store
+# Artifacts are unpickled: the directory must only be writable by the api
+class ArtifactCache(object):
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, key, extension):
+        return os.path.join(self.directory, key.replace(":", "__") + extension)
+
+    def contains(self, key):
+        return os.path.exists(self.path(key, ".json"))
+
+    def load(self, key):
+        infos_path = self.path(key, ".json")
+        if not os.path.exists(infos_path):
+            return None, None
+
+        try:
+            with open(infos_path) as f:
+                infos = json.load(f)
+            if os.path.exists(self.path(key, ".ts")):
+                module = torch.jit.load(self.path(key, ".ts"))
+            else:
+                # Storages are memory mapped instead of being copied in memory
+                module = torch.load(self.path(key, ".pt"), mmap=True, weights_only=False)
+        except Exception:
+            # The model is built again (and its artifact replaced)
+            logger.exception("Loading the artifact of %s failed", key)
+            return None, None
+
+        return module, infos
+
+    def write(self, path, save):
+        # Write in a temporary file first so that a crash never leaves a partial artifact
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory)
+        os.close(fd)
+        try:
+            save(tmp_path)
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def save(self, key, module, infos):
+        from torch.fx import GraphModule
+
+        # Pickles of fx modules (int8-static) cannot be loaded back, they are saved as TorchScript
+        if isinstance(module, GraphModule):
+            module = torch.jit.script(module)
+
+        if isinstance(module, torch.jit.ScriptModule):
+            self.write(self.path(key, ".ts"), lambda x: torch.jit.save(module, x))
+        else:
+            self.write(self.path(key, ".pt"), lambda x: torch.save(module, x))
+
+        def save_infos(path):
+            with open(path, "w") as f:
+                json.dump(infos, f)
+        self.write(self.path(key, ".json"), save_infos)
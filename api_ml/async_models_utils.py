@@ -0,0 +1,362 @@
+import asyncio
+import collections
+import contextlib
+import json
+import logging
+import os
+import time
+
+import falcon
+
+from api_ml.admission import DeadlineExceeded, Overloaded, remaining, request_deadline
+from api_ml.fetching import AsyncImageFetcher
+from api_ml.models_utils import DeleteModel, ExportMetrics, JobResults, ListAvailableModels, ListOnlineModels, LoadModel, ManageJob, Predict, SubmitJob, raw_prediction
+from api_ml.parameters import loading_wait, max_body_size, stream_lookahead
+from api_ml.serialization import dumps_json, serialize
+
+logger = logging.getLogger(__name__)
+
+
+# Responders of the asgi app must be coroutines, the routes are the ones of the wsgi app
+class AsyncOrigin(object):
+    async def on_get(self, req, resp, **kwargs):
+        raise falcon.HTTPMethodNotAllowed(self.methods_allowed, description="GET method is not allowed. Methods allowed are {}".format(self.methods_allowed))
+
+    async def on_delete(self, req, resp, **kwargs):
+        raise falcon.HTTPMethodNotAllowed(self.methods_allowed, description="DELETE method is not allowed. Methods allowed are {}".format(self.methods_allowed))
+
+    async def on_put(self, req, resp, **kwargs):
+        raise falcon.HTTPMethodNotAllowed(self.methods_allowed, description="PUT method is not allowed. Methods allowed are {}".format(self.methods_allowed))
+
+    async def on_post(self, req, resp, **kwargs):
+        raise falcon.HTTPMethodNotAllowed(self.methods_allowed, description="POST method is not allowed. Methods allowed are {}".format(self.methods_allowed))
+
+    async def on_options(self, req, resp, **kwargs):
+        raise falcon.HTTPMethodNotAllowed(self.methods_allowed, description="OPTIONS method is not allowed. Methods allowed are {}".format(self.methods_allowed))
+
+
+async def read_json(req):
+    try:
+        return json.loads(await req.stream.read())
+    except json.decoder.JSONDecodeError:
+        raise falcon.HTTPBadRequest({"code": 400, "name": "Bad request"}, "Json seems malformed")
+
+
+class AsyncListAvailableModels(AsyncOrigin, ListAvailableModels):
+    async def on_get(self, req, resp):
+        self.check_input(await req.stream.read())
+        resp.body = json.dumps({"title": {"code": 200, "name": "Success"}, "description": self.services.models_available}, ensure_ascii=False)
+        resp.content_type = falcon.MEDIA_JSON
+        resp.status = falcon.HTTP_200
+
+
+class AsyncListOnlineModels(AsyncOrigin, ListOnlineModels):
+    async def on_get(self, req, resp):
+        self.check_input(await req.stream.read())
+        online_models = self.services.describe_services()
+        resp.body = json.dumps({"title": {"code": 200, "name": "Success"}, "description": online_models if online_models != {} else "no models are online", "models_loaded": self.services.store.stats(), "threads": self.services.threads, "admission": self.services.admission.stats(), "residency": self.services.residency_stats()}, ensure_ascii=False)
+        resp.content_type = falcon.MEDIA_JSON
+        resp.status = falcon.HTTP_200
+
+
+class AsyncExportMetrics(AsyncOrigin, ExportMetrics):
+    async def on_get(self, req, resp):
+        ExportMetrics.on_get(self, req, resp)
+
+
+# Creating (the models are then loaded by the loader threads) and deleting services block, they run in a bounded pool of threads out of the event loop
+class AsyncLoadModel(AsyncOrigin, LoadModel):
+    def __init__(self, services, executor):
+        LoadModel.__init__(self, services)
+        self.executor = executor
+
+    async def on_put(self, req, resp):
+        json_input = self.check_input(await read_json(req))
+        await asyncio.get_running_loop().run_in_executor(self.executor, self.create, json_input)
+        service_name = json_input["service_name"]
+
+        resp.body = json.dumps({"title": {"code": 202, "name": "Accepted"}, "description": "service '{}' is loading".format(service_name), "state": "loading"}, ensure_ascii=False)
+        resp.status = falcon.HTTP_202
+
+
+class AsyncDeleteModel(AsyncOrigin, DeleteModel):
+    def __init__(self, services, executor):
+        DeleteModel.__init__(self, services)
+        self.executor = executor
+
+    async def on_delete(self, req, resp):
+        json_input = self.check_input(await read_json(req))
+        service_name = json_input["service_name"]
+
+        # Check if service exists
+        success = await asyncio.get_running_loop().run_in_executor(self.executor, self.delete, service_name)
+        if not success:
+            raise falcon.HTTPNotFound(description="Service does not seem to exist")
+
+        resp.body = json.dumps({"title": {"code": 200, "name": "Success"}, "description": "service '{}' sucessfully deleted".format(service_name)})
+        resp.status = falcon.HTTP_201
+
+
+# Images are downloaded on the event loop, decoded and preprocessed in the threads of the fetcher
+# and predicted by the batch scheduler of the service, the event loop only awaits them
+class AsyncPredict(AsyncOrigin, Predict):
+    def __init__(self, services, fetcher=None):
+        Predict.__init__(self, services, fetcher if fetcher is not None else AsyncImageFetcher())
+
+    async def read_multipart(self, req):
+        json_input = {"data": []}
+        names = []
+        try:
+            form = await req.get_media()
+            async for part in form:
+                if part.name == "data" and part.filename is not None:
+                    # Images too large are answered as incorrect inputs by the fetcher like the urls
+                    content = await part.stream.read(self.fetcher.max_size + 1)
+                    json_input["data"].append(content)
+                    names.append(part.filename)
+                elif part.name == "data":
+                    json_input["data"].append(await part.get_text())
+                    names.append(json_input["data"][-1])
+                else:
+                    json_input[part.name] = await part.get_text()
+        except falcon.MediaMalformedError:
+            raise falcon.HTTPBadRequest({"code": 400, "name": "Bad request"}, "Multipart seems malformed")
+
+        return json_input, names
+
+    async def validate_json_input(self, req):
+        body_type = self.body_type(req)
+        if body_type == "multipart":
+            json_input, names = await self.read_multipart(req)
+        elif body_type == "msgpack":
+            json_input, names = self.read_msgpack(self.check_body(await req.stream.read(max_body_size + 1)))
+        else:
+            json_input, names = self.read_json(self.check_body(await req.stream.read(max_body_size + 1)))
+
+        return self.check_input(json_input, names, binary=body_type != "json")
+
+    async def wait_images(self, services, images):
+        loaded = []
+        for image in images:
+            try:
+                loaded.append(await image if image is not None else None)
+            except Exception as e:
+                logger.exception("Loading an input image failed")
+                for service in services:
+                    service["metrics"].failure(e)
+                loaded.append(None)
+        return loaded
+
+    async def submit_batch(self, service, scheduler, format_output, batch, cached, images, flights):
+        return self.submit_images(service, scheduler, format_output, batch, cached, await self.wait_images([service], images), flights)
+
+    async def submit_targets(self, targets, batch, cached, images, flights):
+        return self.submit_loaded(targets, batch, cached, await self.wait_images([x[1] for x in targets], images), flights)
+
+    async def wait_flight(self, service, flight):
+        # The flight is shielded, it is never cancelled by a request giving up on it
+        try:
+            return await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(flight)), remaining(request_deadline.get()))
+        except Exception as e:
+            if not flight.done():
+                raise falcon.HTTPGatewayTimeout(description="Deadline exceeded before the images were predicted")
+            service["metrics"].failure(e)
+            return None
+
+    async def collect_batch(self, service, scheduler, format_output, res, id_pred_to_res, futures, waiting):
+        try:
+            predictions = await asyncio.gather(*[asyncio.wrap_future(x) for x in futures])
+        except DeadlineExceeded:
+            raise falcon.HTTPGatewayTimeout(description="Deadline exceeded before the images were predicted")
+        flights = [await self.wait_flight(service, x) for _, x in waiting]
+        return self.collect_predictions(service, scheduler, format_output, res, id_pred_to_res, predictions, waiting, flights)
+
+    async def collect_targets(self, targets, ensemble, *submitted):
+        results = [await self.collect_batch(service, scheduler, raw_prediction, *x) for (_, service, scheduler, _), x in zip(targets, submitted)]
+        return self.merge_targets(targets, ensemble, results)
+
+    async def iter_pipeline(self, batches, fetch, submit, collect, lookahead=None):
+        fetching = collections.deque()
+        predicting = collections.deque()
+        for batch in batches:
+            fetching.append(fetch(batch))
+            if lookahead is not None and len(fetching) > lookahead:
+                predicting.append(await submit(*fetching.popleft()))
+            if lookahead is not None and len(predicting) > lookahead:
+                yield await collect(*predicting.popleft())
+
+        while fetching:
+            predicting.append(await submit(*fetching.popleft()))
+        while predicting:
+            yield await collect(*predicting.popleft())
+
+    @contextlib.asynccontextmanager
+    async def admit(self, targets, deadline=None):
+        # Same admission as the wsgi app, waiting for a slot without blocking the event loop
+        acquired = []
+        start = None
+        try:
+            for control, name in self.admission_controls(targets):
+                waiter = None
+                try:
+                    waiter = control.try_acquire()
+                    if waiter is not None:
+                        # The waiter is shielded, a slot handed over while the deadline passes is given back by give_up
+                        await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(waiter)), remaining(deadline))
+                except Overloaded as e:
+                    self.reject(control, name, e)
+                except asyncio.TimeoutError:
+                    control.give_up(waiter)
+                    self.reject(control, name, DeadlineExceeded())
+                acquired.append(control)
+            start = time.perf_counter()
+            yield
+        finally:
+            for control in acquired:
+                control.release(time.perf_counter() - start if start is not None else None)
+
+    async def wait_ready(self, service_names, deadline=None, wait=loading_wait):
+        # Same as the wsgi app without blocking the event loop
+        for service_name in service_names:
+            service = self.loading_service(service_name)
+            if service is not None:
+                try:
+                    await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(service["loaded"])), remaining(deadline) if deadline is not None else wait)
+                except asyncio.TimeoutError:
+                    pass
+            self.check_ready(service_name, deadline)
+
+    async def stream(self, targets, predictions, mode, deadline=None):
+        with self.request([x[1] for x in targets]):
+            try:
+                async with self.admit(targets, deadline):
+                    i = 0
+                    async for res in predictions:
+                        if mode == "batch":
+                            yield dumps_json({"batch": i, "predictions": res}) + b"\n"
+                        else:
+                            for j, prediction in res.items():
+                                yield dumps_json({"batch": i, "index": j, **prediction}) + b"\n"
+                        i += 1
+            except falcon.HTTPError as e:
+                yield dumps_json({"title": e.title, "description": e.description}) + b"\n"
+
+    async def on_post(self, req, resp):
+        deadline = self.get_deadline(req)
+        json_input, names = await self.validate_json_input(req)
+        # Parse json (data are urls, local paths or raw images)
+        service_names = json_input["service_name"] if isinstance(json_input["service_name"], list) else [json_input["service_name"]]
+        stream = json_input.get("stream")
+
+        await self.wait_ready(service_names, deadline)
+        targets = self.get_targets(service_names, json_input.get("output", "dict"), json_input.get("ensemble", False))
+        services = [x[1] for x in targets]
+        request_deadline.set(deadline)
+
+        if stream is not None:
+            self.check_admission(targets)
+            predictions = self.iter_request(json_input, names, targets, lookahead=stream_lookahead)
+            resp.stream = self.stream(targets, predictions, stream, deadline)
+            resp.content_type = "application/x-ndjson"
+            resp.status = falcon.HTTP_201
+            return
+
+        with self.request(services):
+            async with self.admit(targets, deadline):
+                predictions = [x async for x in self.iter_request(json_input, names, targets)]
+                # Serializing large responses is cpu bound as well
+                body = {"title": {"code": 200, "name": "Success"}, "description": predictions}
+                start = time.perf_counter()
+                await asyncio.get_running_loop().run_in_executor(self.fetcher.executor, serialize, req, resp, body)
+                for service in services:
+                    service["metrics"].observe("serialization", time.perf_counter() - start)
+        resp.status = falcon.HTTP_201
+
+
+# Listing the inputs of a job and reading or writing its files block, they run out of the event loop
+class AsyncSubmitJob(AsyncOrigin, SubmitJob):
+    def __init__(self, services, jobs, executor):
+        SubmitJob.__init__(self, services, jobs)
+        self.executor = executor
+
+    async def on_get(self, req, resp):
+        jobs = await asyncio.get_running_loop().run_in_executor(self.executor, self.jobs.list)
+        resp.body = json.dumps({"title": {"code": 200, "name": "Success"}, "description": jobs}, ensure_ascii=False)
+        resp.content_type = falcon.MEDIA_JSON
+        resp.status = falcon.HTTP_200
+
+    async def on_post(self, req, resp):
+        json_input = self.check_input(await read_json(req))
+        job = await asyncio.get_running_loop().run_in_executor(self.executor, self.submit, json_input)
+        resp.body = json.dumps({"title": {"code": 202, "name": "Accepted"}, "description": job}, ensure_ascii=False)
+        resp.content_type = falcon.MEDIA_JSON
+        resp.status = falcon.HTTP_202
+
+
+class AsyncManageJob(AsyncOrigin, ManageJob):
+    def __init__(self, jobs, executor):
+        ManageJob.__init__(self, jobs)
+        self.executor = executor
+
+    async def on_get(self, req, resp, job_id):
+        ManageJob.on_get(self, req, resp, job_id)
+
+    async def on_put(self, req, resp, job_id):
+        ManageJob.on_put(self, req, resp, job_id)
+
+    async def on_delete(self, req, resp, job_id):
+        self.get_job(job_id)
+        job = await asyncio.get_running_loop().run_in_executor(self.executor, self.jobs.cancel, job_id)
+        resp.body = json.dumps({"title": {"code": 200, "name": "Success"}, "description": job}, ensure_ascii=False)
+        resp.content_type = falcon.MEDIA_JSON
+        resp.status = falcon.HTTP_200
+
+
+class AsyncJobResults(AsyncOrigin, JobResults):
+    async def read_results(self, path):
+        with open(path, "rb") as f:
+            while True:
+                chunk = f.read(64 * 1024)
+                if not chunk:
+                    break
+                yield chunk
+
+    async def on_get(self, req, resp, job_id):
+        if not self.jobs.exists(job_id):
+            raise falcon.HTTPNotFound(description="Job does not seem to exist")
+        path = self.jobs.path(job_id, "results.jsonl")
+        if os.path.exists(path):
+            resp.stream = self.read_results(path)
+        else:
+            resp.body = ""
+        resp.content_type = "application/x-ndjson"
+        resp.status = falcon.HTTP_200
+
+
+class AsyncStartJobs(object):
+    def __init__(self, jobs):
+        self.jobs = jobs
+
+    async def process_request(self, req, resp):
+        self.jobs.start()
+
+
+class AsyncSyncServices(object):
+    def __init__(self, load_model, executor):
+        self.load_model = load_model
+        self.executor = executor
+
+    async def process_request(self, req, resp):
+        # Loading the services of the other workers blocks, it is only run out of the loop when needed
+        shared = self.load_model.services.shared
+        if shared is not None and shared.changed():
+            await asyncio.get_running_loop().run_in_executor(self.executor, self.load_model.sync)
+
+
+# Close the connections of the fetcher when the server shuts down
+class FetcherLifespan(object):
+    def __init__(self, fetcher):
+        self.fetcher = fetcher
+
+    async def process_shutdown(self, scope, event):
+        await self.fetcher.close()
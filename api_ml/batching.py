@@ -0,0 +1,160 @@
+import threading
+import time
+import torch
+from collections import defaultdict
+from concurrent.futures import Future
+from contextlib import nullcontext
+from queue import Queue, Empty
+
+from api_ml.admission import DeadlineExceeded
+
+
+# Gather images coming from concurrent requests of one service into a single forward pass.
+# A batch is run as soon as it holds batch_size images or max_wait seconds after its first image was queued.
+class BatchScheduler(object):
+    def __init__(self, model, predict, batch_size=1, top_k=-1, max_wait=0.005, num_threads=None, observe=None, gate=None, loader=None):
+        self.model = model
+        self.predict = predict
+        self.batch_size = batch_size
+        self.top_k = top_k
+        self.max_wait = max_wait
+        self.num_threads = num_threads
+        # Time spent in each stage is given to observe(stage, seconds)
+        self.observe = observe
+        # Context manager taken around each forward pass (the slot of the compute gate of the services)
+        self.gate = gate
+        # Gives back the model of a parked service (weights offloaded, model["model"] is None) before its next batch
+        self.loader = loader
+        # Held during each batch, the weights are only parked between two batches
+        self.model_lock = threading.Lock()
+        self.last_used = time.monotonic()
+
+        self.queue = Queue()
+        self.lock = threading.Lock()
+        self.stopped = False
+        self.nb_batches = 0
+        self.nb_images = 0
+        self.batch_sizes = defaultdict(int)
+        self.nb_expired = 0
+
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def submit(self, imgs, deadline=None):
+        # Images still queued when their deadline (time.monotonic) passes are not predicted
+        futures = [Future() for _ in imgs]
+        with self.lock:
+            if self.stopped:
+                raise RuntimeError("The batch scheduler has been stopped")
+            submitted = time.perf_counter()
+            for img, future in zip(imgs, futures):
+                self.queue.put((img, future, submitted, deadline))
+        return futures
+
+    def stop(self):
+        with self.lock:
+            if self.stopped:
+                return
+            self.stopped = True
+            self.queue.put(None)
+
+        # Images already queued are still predicted before the thread exits
+        self.thread.join()
+
+    def gather(self):
+        item = self.queue.get()
+        if item is None:
+            return [], True
+
+        batch = [item]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                # Once the deadline is reached only take what is already queued
+                item = self.queue.get(timeout=remaining) if remaining > 0 else self.queue.get_nowait()
+            except Empty:
+                break
+            if item is None:
+                return batch, True
+            batch.append(item)
+
+        return batch, False
+
+    def drop_expired(self, batch):
+        now = time.monotonic()
+        kept = []
+        for item in batch:
+            if item[3] is not None and item[3] <= now:
+                item[1].set_exception(DeadlineExceeded())
+            else:
+                kept.append(item)
+        with self.lock:
+            self.nb_expired += len(batch) - len(kept)
+        return kept
+
+    def process(self, batch):
+        batch = [x for x in batch if x[1].set_running_or_notify_cancel()]
+        batch = self.drop_expired(batch)
+        if len(batch) == 0:
+            return
+
+        with self.model_lock:
+            try:
+                if self.model["model"] is None:
+                    self.model = self.loader()
+            except Exception as e:
+                for _, future, _, _ in batch:
+                    future.set_exception(e)
+                return
+
+            with self.gate() if self.gate is not None else nullcontext():
+                # Deadlines may have passed while waiting for the other services
+                batch = self.drop_expired(batch)
+                if len(batch) == 0:
+                    return
+
+                # Intra-op threads of torch are global to the process, the ones of the service are set before each of its batches
+                if self.num_threads is not None and torch.get_num_threads() != self.num_threads:
+                    torch.set_num_threads(self.num_threads)
+
+                if self.observe is not None:
+                    start = time.perf_counter()
+                    for _, _, submitted, _ in batch:
+                        self.observe("queue", start - submitted)
+
+                try:
+                    results = self.predict(self.model, [x[0] for x in batch], top_k=self.top_k, observe=self.observe)
+                except Exception as e:
+                    for _, future, _, _ in batch:
+                        future.set_exception(e)
+                else:
+                    for (_, future, _, _), result in zip(batch, results):
+                        future.set_result(result)
+
+        with self.lock:
+            self.nb_batches += 1
+            self.nb_images += len(batch)
+            self.batch_sizes[len(batch)] += 1
+            self.last_used = time.monotonic()
+
+    def run(self):
+        while True:
+            batch, stop = self.gather()
+            if batch:
+                self.process(batch)
+            if stop:
+                return
+
+    def stats(self):
+        with self.lock:
+            return {
+                "max_wait_ms": self.max_wait * 1000,
+                "intra_op_threads": self.num_threads,
+                "queue_depth": self.queue.qsize(),
+                "batches": self.nb_batches,
+                "images": self.nb_images,
+                "expired": self.nb_expired,
+                "mean_batch_fill": self.nb_images / (self.nb_batches * self.batch_size) if self.nb_batches else 0.,
+                "batch_sizes": {str(size): count for size, count in sorted(self.batch_sizes.items())}
+            }
@@ -0,0 +1,73 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+
+# LRU cache of predictions with an optional time to live (in seconds)
+class PredictionCache(object):
+    def __init__(self, max_size, ttl=None, cache_urls=False):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.cache_urls = cache_urls
+
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    @staticmethod
+    def image_key(model_name, top_k, img):
+        digest = hashlib.blake2b(digest_size=16)
+        digest.update("{}:{}".format(img.mode, img.size).encode())
+        digest.update(img.tobytes())
+        return (model_name, top_k, "image", digest.hexdigest())
+
+    @staticmethod
+    def url_key(model_name, top_k, url_image):
+        return (model_name, top_k, "url", url_image)
+
+    def get(self, key, count_miss=True):
+        # A lookup followed by another one for the same input (url then image) does not count its miss
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                if count_miss:
+                    self.misses += 1
+                return None
+
+            value, expiration = entry
+            if expiration is not None and expiration < time.monotonic():
+                del self.entries[key]
+                self.expirations += 1
+                if count_miss:
+                    self.misses += 1
+                return None
+
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        expiration = time.monotonic() + self.ttl if self.ttl is not None else None
+        with self.lock:
+            self.entries[key] = (value, expiration)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def stats(self):
+        with self.lock:
+            return {
+                "size": len(self.entries),
+                "max_size": self.max_size,
+                "ttl": self.ttl,
+                "cache_urls": self.cache_urls,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations
+            }
@@ -0,0 +1,48 @@
+import threading
+from concurrent.futures import Future
+
+
+# Predictions in flight of the inputs (urls and paths) of a service. Concurrent requests, or duplicates of a request,
+# with the same input wait for the prediction started by the first one instead of downloading and predicting it again.
+class SingleFlight(object):
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.flights = {}
+        self.started = 0
+        self.coalesced = 0
+
+    def join(self, key):
+        # (future of the prediction, True if the caller started it and must resolve it)
+        with self.lock:
+            future = self.flights.get(key)
+            if future is not None:
+                self.coalesced += 1
+                return future, False
+            future = self.flights[key] = Future()
+            self.started += 1
+        # Running futures cannot be cancelled by a waiter giving up
+        future.set_running_or_notify_cancel()
+        future.add_done_callback(lambda x: self.forget(key, x))
+        return future, True
+
+    def find(self, key):
+        # Flight of the input if there is one, the caller does not start any
+        with self.lock:
+            future = self.flights.get(key)
+            if future is None:
+                return None
+            self.coalesced += 1
+            return future, False
+
+    def forget(self, key, future):
+        with self.lock:
+            if self.flights.get(key) is future:
+                del self.flights[key]
+
+    def stats(self):
+        with self.lock:
+            return {
+                "in_flight": len(self.flights),
+                "started": self.started,
+                "coalesced": self.coalesced
+            }
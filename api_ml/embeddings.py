@@ -0,0 +1,73 @@
+import argparse
+import os
+from glob import glob
+
+import torch
+from PIL import Image
+
+from api_ml.models.utils import embedding_model, load_model
+
+
+def load_pca(path):
+    # Torch file holding the mean (D) and the components (K x D) fitted by fit_pca
+    pca = torch.load(path, weights_only=True)
+    mean, components = pca["mean"].float(), pca["components"].float()
+    if mean.dim() != 1 or components.dim() != 2 or components.shape[1] != mean.shape[0]:
+        raise ValueError("{} must hold a mean of size D and components of size K x D".format(path))
+    return mean, components
+
+
+def fit_pca(features, dim):
+    mean = features.mean(0)
+    _, _, v = torch.linalg.svd(features - mean, full_matrices=False)
+    return {"mean": mean, "components": v[:dim].contiguous()}
+
+
+# Postprocessing of the pooled features of an embedding service (applied on the whole batch)
+class EmbeddingPostprocessing(object):
+    def __init__(self, normalize=False, pca=None):
+        self.normalize = normalize
+        self.mean, self.components = load_pca(pca) if pca is not None else (None, None)
+
+    def __call__(self, x):
+        x = torch.flatten(x, 1)
+        if self.components is not None:
+            x = torch.mm(x - self.mean, self.components.t())
+        # L2 normalization after the reduction so that dot products are cosine similarities
+        if self.normalize:
+            x = torch.nn.functional.normalize(x, dim=1)
+        return x
+
+
+# Fit the PCA of an embedding service on a directory of images
+# Usage: python -m api_ml.embeddings --model resnet50 --images images/ --dim 128 --output pca.pt
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model", required=True)
+    parser.add_argument("--images", required=True)
+    parser.add_argument("--dim", type=int, default=128)
+    parser.add_argument("--batch_size", type=int, default=32)
+    parser.add_argument("--output", required=True)
+    args = parser.parse_args()
+
+    model = load_model(args.model)
+    if model is False:
+        raise ValueError("{} is not an available model".format(args.model))
+    model = embedding_model(args.model, model)
+
+    paths = sorted(x for x in glob(os.path.join(args.images, "*")) if os.path.isfile(x))
+    features = []
+    with torch.inference_mode():
+        for i in range(0, len(paths), args.batch_size):
+            imgs = [model["preprocessing"](Image.open(x)) for x in paths[i:i + args.batch_size]]
+            features.append(model["postprocessing"](model["model"](model["preprocessing"].batch(imgs))).clone())
+    features = torch.cat(features)
+    if args.dim > min(features.shape):
+        raise ValueError("dim must be at most {} with {} images".format(min(features.shape), features.shape[0]))
+
+    torch.save(fit_pca(features, args.dim), args.output)
+    print("PCA of {} features of {} images saved in {}".format(features.shape[1], features.shape[0], args.output))
+
+
+if __name__ == "__main__":
+    main()
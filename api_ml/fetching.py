@@ -0,0 +1,130 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from PIL import Image
+import requests
+from requests.adapters import HTTPAdapter
+
+from api_ml.parameters import fetch_max_workers, fetch_timeout, fetch_max_size, fetch_max_connections
+
+
+class ImageTooLarge(ValueError):
+    pass
+
+
+# Download, decode and preprocess images in a bounded pool of threads sharing keep-alive connections
+class ImageFetcher(object):
+    def __init__(self, max_workers=fetch_max_workers, timeout=fetch_timeout, max_size=fetch_max_size):
+        self.timeout = timeout
+        self.max_size = max_size
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=max_workers, pool_maxsize=max_workers)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="fetch")
+
+    def download(self, url_image):
+        deadline = time.monotonic() + self.timeout
+        with self.session.get(url_image, stream=True, timeout=self.timeout) as response:
+            response.raise_for_status()
+
+            length = response.headers.get("Content-Length")
+            if length is not None and int(length) > self.max_size:
+                raise ImageTooLarge("{} is larger than {} bytes".format(url_image, self.max_size))
+
+            content = bytearray()
+            for chunk in response.iter_content(64 * 1024):
+                content += chunk
+                if len(content) > self.max_size:
+                    raise ImageTooLarge("{} is larger than {} bytes".format(url_image, self.max_size))
+                if time.monotonic() > deadline:
+                    raise TimeoutError("{} took more than {} seconds to download".format(url_image, self.timeout))
+
+        return content
+
+    def load(self, url_image, preprocessing=None, draft_size=None, observe=None):
+        # Time spent in each stage is given to observe(stage, seconds)
+        start = time.perf_counter()
+        # External url
+        if isinstance(url_image, str) and url_image[0] != '/':
+            url_image = self.download(url_image)
+            if observe is not None:
+                observe("download", time.perf_counter() - start)
+                start = time.perf_counter()
+
+        # Raw image given in the body of the request (or downloaded)
+        if isinstance(url_image, (bytes, bytearray)):
+            if len(url_image) > self.max_size:
+                raise ImageTooLarge("Image given is larger than {} bytes".format(self.max_size))
+            img = Image.open(BytesIO(url_image))
+        # Local url
+        else:
+            img = Image.open(url_image)
+
+        # JPEG images are downscaled while being decoded when they are larger than needed
+        if draft_size is not None:
+            img.draft("RGB", draft_size)
+        img.load()
+        if observe is not None:
+            observe("decode", time.perf_counter() - start)
+
+        if preprocessing is not None:
+            start = time.perf_counter()
+            img = preprocessing(img)
+            if observe is not None:
+                observe("preprocessing", time.perf_counter() - start)
+        return img
+
+    def fetch(self, urls_image, preprocessing=None, draft_size=None, observe=None):
+        return [self.executor.submit(self.load, url_image, preprocessing, draft_size, observe) for url_image in urls_image]
+
+
+# Download images with asyncio on the event loop of the asgi app, decoding and preprocessing
+# still run in the bounded pool of threads
+class AsyncImageFetcher(ImageFetcher):
+    def __init__(self, max_workers=fetch_max_workers, timeout=fetch_timeout, max_size=fetch_max_size, max_connections=fetch_max_connections):
+        ImageFetcher.__init__(self, max_workers, timeout, max_size)
+        self.max_connections = max_connections
+        self.client = None
+
+    def get_client(self):
+        # The session is bound to the running event loop, it is created by the first download
+        if self.client is None:
+            import aiohttp
+            self.client = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=self.max_connections), timeout=aiohttp.ClientTimeout(total=self.timeout))
+        return self.client
+
+    async def download_async(self, url_image):
+        async with self.get_client().get(url_image) as response:
+            response.raise_for_status()
+
+            if response.content_length is not None and response.content_length > self.max_size:
+                raise ImageTooLarge("{} is larger than {} bytes".format(url_image, self.max_size))
+
+            content = bytearray()
+            async for chunk in response.content.iter_chunked(64 * 1024):
+                content += chunk
+                if len(content) > self.max_size:
+                    raise ImageTooLarge("{} is larger than {} bytes".format(url_image, self.max_size))
+
+        return content
+
+    async def load_async(self, url_image, preprocessing=None, draft_size=None, observe=None):
+        # External url
+        if isinstance(url_image, str) and url_image[0] != '/':
+            start = time.perf_counter()
+            url_image = await self.download_async(url_image)
+            if observe is not None:
+                observe("download", time.perf_counter() - start)
+        return await asyncio.wrap_future(self.executor.submit(self.load, url_image, preprocessing, draft_size, observe))
+
+    def fetch(self, urls_image, preprocessing=None, draft_size=None, observe=None):
+        return [asyncio.ensure_future(self.load_async(url_image, preprocessing, draft_size, observe)) for url_image in urls_image]
+
+    async def close(self):
+        if self.client is not None:
+            await self.client.close()
+            self.client = None
@@ -0,0 +1,198 @@
+import fcntl
+import functools
+import json
+import os
+import re
+import tempfile
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import falcon
+
+from api_ml.parameters import jobs_checkpoint_interval, jobs_lookahead, jobs_max_workers
+from api_ml.serialization import dumps_json, format_embedding, format_prediction
+
+
+# Bulk scoring jobs run in the background by the batch schedulers of the services, their state is
+# queued, running, done, failed or cancelled.
+# A job is a directory of jobs_dir holding its description (job.json), its inputs (inputs.jsonl, one per line)
+# and its results (results.jsonl, one line per input in the order of the inputs). The results are the checkpoint:
+# a job interrupted by a crash is resumed after the last complete line. A job is run by the worker holding the lock
+# of its directory, so that the workers of a server sharing jobs_dir never run it twice.
+class JobManager(object):
+    def __init__(self, predict, directory, max_workers=jobs_max_workers):
+        self.predict = predict
+        self.directory = directory
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="jobs")
+        self.pid = None
+
+    def path(self, job_id, name):
+        return os.path.join(self.directory, job_id, name)
+
+    def exists(self, job_id):
+        return re.fullmatch("[0-9a-f]{32}", job_id) is not None and os.path.exists(self.path(job_id, "job.json"))
+
+    def read(self, job_id):
+        with open(self.path(job_id, "job.json")) as f:
+            return json.load(f)
+
+    def write(self, job):
+        # Replaced atomically, the status can be read by any worker at any time
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.join(self.directory, job["job_id"]))
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump(job, f)
+            os.replace(tmp_path, self.path(job["job_id"], "job.json"))
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def list(self):
+        if not os.path.isdir(self.directory):
+            return []
+        jobs = [self.read(x) for x in os.listdir(self.directory) if self.exists(x)]
+        return sorted(jobs, key=lambda x: x["created"])
+
+    def submit(self, service_name, inputs, output="dict"):
+        job_id = uuid.uuid4().hex
+        os.makedirs(os.path.join(self.directory, job_id))
+        with open(self.path(job_id, "inputs.jsonl"), "w") as f:
+            for x in inputs:
+                f.write(json.dumps(x) + "\n")
+
+        job = {
+            "job_id": job_id,
+            "service_name": service_name,
+            "output": output,
+            "state": "queued",
+            "total": len(inputs),
+            "done": 0,
+            "failed": 0,
+            "created": time.time(),
+            "updated": time.time()
+        }
+        self.write(job)
+        self.executor.submit(self.run, job_id)
+        return job
+
+    def start(self):
+        # Run on the first request of each worker: no thread is started by the master of gunicorn --preload
+        if self.pid != os.getpid():
+            self.pid = os.getpid()
+            self.resume()
+
+    def resume(self, job_id=None):
+        # Jobs left queued or running by a crashed worker (or the given one) are run again from their checkpoint
+        if job_id is not None:
+            if os.path.exists(self.path(job_id, "cancel")):
+                os.remove(self.path(job_id, "cancel"))
+            job = self.read(job_id)
+            job.pop("error", None)
+            job.update({"state": "queued", "updated": time.time()})
+            self.write(job)
+            self.executor.submit(self.run, job_id)
+            return job
+        for job in self.list():
+            if job["state"] in ["queued", "running"]:
+                self.executor.submit(self.run, job["job_id"])
+
+    def cancel(self, job_id):
+        # The worker running the job stops after its current batch, a job run by nobody is cancelled here
+        open(self.path(job_id, "cancel"), "a").close()
+        with open(self.path(job_id, "lock"), "a") as lock:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return self.read(job_id)
+            try:
+                job = self.read(job_id)
+                if job["state"] in ["queued", "running", "failed"]:
+                    job.update({"state": "cancelled", "updated": time.time()})
+                    self.write(job)
+                return job
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def checkpoint(self, job_id):
+        # Number of complete lines of the results (and of failed inputs among them), a partly written line is removed
+        done, failed, offset = 0, 0, 0
+        path = self.path(job_id, "results.jsonl")
+        if not os.path.exists(path):
+            return done, failed
+        with open(path, "rb+") as f:
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break
+                done += 1
+                failed += b"\"Input is not correct\"" in line
+                offset += len(line)
+            f.truncate(offset)
+        return done, failed
+
+    def run(self, job_id):
+        with open(self.path(job_id, "lock"), "a") as lock:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                # Already run by another worker
+                return
+            try:
+                job = self.read(job_id)
+                if job["state"] not in ["queued", "running"]:
+                    return
+                try:
+                    self.execute(job)
+                except falcon.HTTPError as e:
+                    job.update({"state": "failed", "error": e.description, "updated": time.time()})
+                    self.write(job)
+                except Exception as e:
+                    job.update({"state": "failed", "error": "{}: {}".format(type(e).__name__, e), "updated": time.time()})
+                    self.write(job)
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def execute(self, job):
+        job_id = job["job_id"]
+        done, failed = self.checkpoint(job_id)
+        job.update({"state": "running", "done": done, "failed": failed, "updated": time.time()})
+        job.pop("error", None)
+        if os.path.exists(self.path(job_id, "cancel")):
+            job["state"] = "cancelled"
+            self.write(job)
+            return
+
+        # A job submitted while its service is loading waits for it
+        self.predict.wait_ready([job["service_name"]], wait=None)
+        service, scheduler = self.predict.get_service(job["service_name"])
+        formatter = format_embedding if service.get("mode") == "embedding" else format_prediction
+        format_output = functools.partial(formatter, output=job["output"], mapping=scheduler.model["mapping"])
+        self.write(job)
+
+        with open(self.path(job_id, "inputs.jsonl")) as f:
+            inputs = [json.loads(x) for x in f][done:]
+
+        # Only lookahead batches are fetched and predicted ahead of the one written
+        last_write = time.monotonic()
+        with open(self.path(job_id, "results.jsonl"), "ab") as results:
+            for res in self.predict.iter_predictions(service, scheduler, format_output, inputs, inputs, lookahead=jobs_lookahead):
+                lines = []
+                for prediction in res.values():
+                    lines.append(dumps_json({"index": done, **prediction}) + b"\n")
+                    failed += prediction["predictions"] == "Input is not correct"
+                    done += 1
+                results.write(b"".join(lines))
+                results.flush()
+
+                if os.path.exists(self.path(job_id, "cancel")):
+                    job.update({"state": "cancelled", "done": done, "failed": failed, "updated": time.time()})
+                    self.write(job)
+                    return
+                # Progress is written at most every jobs_checkpoint_interval seconds
+                if time.monotonic() - last_write > jobs_checkpoint_interval:
+                    job.update({"done": done, "failed": failed, "updated": time.time()})
+                    self.write(job)
+                    last_write = time.monotonic()
+
+        job.update({"state": "done", "done": done, "failed": failed, "updated": time.time()})
+        self.write(job)
@@ -0,0 +1,171 @@
+import asyncio
+import bisect
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+import requests
+from PIL import UnidentifiedImageError
+
+from api_ml.fetching import ImageTooLarge
+
+# Upper bounds (in seconds) of the buckets of the latency histograms
+latency_buckets = [0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1., 2.5, 5., 10.]
+
+
+def failure_cause(exception):
+    if isinstance(exception, ImageTooLarge):
+        return "too_large"
+    if isinstance(exception, (TimeoutError, asyncio.TimeoutError, requests.Timeout)):
+        return "timeout"
+    if isinstance(exception, UnidentifiedImageError):
+        return "decode"
+    if isinstance(exception, (FileNotFoundError, IsADirectoryError, PermissionError)):
+        return "not_found"
+    # Malformed urls (requests and aiohttp raise ValueErrors for them)
+    if isinstance(exception, ValueError):
+        return "invalid_url"
+    if isinstance(exception, requests.RequestException) or type(exception).__module__.startswith("aiohttp"):
+        return "download"
+    if isinstance(exception, OSError):
+        return "decode"
+    return "other"
+
+
+# Time spent in each stage of the predictions of a service, failed inputs and requests in flight.
+# Recording is only a few additions under a lock, the exposition format is built when /metrics is scraped.
+class ServiceMetrics(object):
+    def __init__(self, buckets=latency_buckets):
+        self.buckets = buckets
+        self.lock = threading.Lock()
+        self.histograms = {}
+        self.failures = defaultdict(int)
+        self.in_flight = 0
+
+    def observe(self, stage, seconds):
+        index = bisect.bisect_left(self.buckets, seconds)
+        with self.lock:
+            histogram = self.histograms.get(stage)
+            if histogram is None:
+                histogram = self.histograms[stage] = {"buckets": [0] * (len(self.buckets) + 1), "sum": 0., "count": 0}
+            histogram["buckets"][index] += 1
+            histogram["sum"] += seconds
+            histogram["count"] += 1
+
+    def failure(self, exception):
+        cause = failure_cause(exception)
+        with self.lock:
+            self.failures[cause] += 1
+
+    @contextmanager
+    def request(self):
+        with self.lock:
+            self.in_flight += 1
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe("request", time.perf_counter() - start)
+            with self.lock:
+                self.in_flight -= 1
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                "histograms": {x: {"buckets": list(y["buckets"]), "sum": y["sum"], "count": y["count"]} for x, y in self.histograms.items()},
+                "failures": dict(self.failures),
+                "in_flight": self.in_flight
+            }
+
+
+def escape(value):
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def labels(**kwargs):
+    return "{" + ",".join("{}=\"{}\"".format(x, escape(y)) for x, y in kwargs.items()) + "}"
+
+
+# Prometheus text exposition format (version 0.0.4) of the metrics of all the services
+def render_metrics(services):
+    families = {
+        "api_ml_stage_seconds": ("histogram", "Time spent in each stage of /predict (batch, forward and postprocessing are per batch)"),
+        "api_ml_failed_inputs_total": ("counter", "Inputs that could not be predicted by cause"),
+        "api_ml_requests_in_flight": ("gauge", "Requests being processed"),
+        "api_ml_batches_total": ("counter", "Batches predicted"),
+        "api_ml_batch_images_total": ("counter", "Images predicted in batches"),
+        "api_ml_batch_size_total": ("counter", "Batches predicted by number of images"),
+        "api_ml_batch_fill_ratio": ("gauge", "Mean number of images of the batches divided by the batch size"),
+        "api_ml_queue_depth": ("gauge", "Images waiting for the batch scheduler"),
+        "api_ml_expired_images_total": ("counter", "Images not predicted because the deadline of their request had passed"),
+        "api_ml_requests_waiting": ("gauge", "Requests waiting for a slot of the service (max_concurrency)"),
+        "api_ml_rejected_requests_total": ("counter", "Requests rejected by the admission control of the service by reason"),
+        "api_ml_worker_rejected_requests_total": ("counter", "Requests rejected by the admission control of the worker by reason"),
+        "api_ml_coalesced_inputs_total": ("counter", "Inputs predicted once for concurrent requests (or duplicates) with the same url or path"),
+        "api_ml_cache_hits_total": ("counter", "Predictions found in the cache"),
+        "api_ml_cache_misses_total": ("counter", "Predictions missing from the cache"),
+        "api_ml_service_resident": ("gauge", "1 if the weights of the service are loaded, 0 if it is parked"),
+        "api_ml_service_parks_total": ("counter", "Times the service was parked"),
+        "api_ml_service_reloads_total": ("counter", "Times the service was reloaded after being parked (latency in the reload stage)"),
+        "api_ml_model_memory_bytes": ("gauge", "Memory used by the weights of the loaded models"),
+        "api_ml_model_services": ("gauge", "Services using each loaded model")
+    }
+    samples = defaultdict(list)
+
+    for name, service in list(services.models_online.items()):
+        metrics = service["metrics"].snapshot()
+        for stage, histogram in metrics["histograms"].items():
+            cumulated = 0
+            for bound, count in zip(service["metrics"].buckets + ["+Inf"], histogram["buckets"]):
+                cumulated += count
+                samples["api_ml_stage_seconds"].append(("_bucket", labels(service=name, stage=stage, le=bound), cumulated))
+            samples["api_ml_stage_seconds"].append(("_sum", labels(service=name, stage=stage), histogram["sum"]))
+            samples["api_ml_stage_seconds"].append(("_count", labels(service=name, stage=stage), histogram["count"]))
+        for cause, count in metrics["failures"].items():
+            samples["api_ml_failed_inputs_total"].append(("", labels(service=name, cause=cause), count))
+        samples["api_ml_requests_in_flight"].append(("", labels(service=name), metrics["in_flight"]))
+        samples["api_ml_service_resident"].append(("", labels(service=name), int(service["residency"]["state"] == "resident")))
+        samples["api_ml_service_parks_total"].append(("", labels(service=name), service["residency"]["parks"]))
+        samples["api_ml_service_reloads_total"].append(("", labels(service=name), service["residency"]["reloads"]))
+
+        if "scheduler" in service:
+            batching = service["scheduler"].stats()
+            samples["api_ml_batches_total"].append(("", labels(service=name), batching["batches"]))
+            samples["api_ml_batch_images_total"].append(("", labels(service=name), batching["images"]))
+            for size, count in batching["batch_sizes"].items():
+                samples["api_ml_batch_size_total"].append(("", labels(service=name, size=size), count))
+            samples["api_ml_batch_fill_ratio"].append(("", labels(service=name), batching["mean_batch_fill"]))
+            samples["api_ml_queue_depth"].append(("", labels(service=name), batching["queue_depth"]))
+            samples["api_ml_expired_images_total"].append(("", labels(service=name), batching["expired"]))
+
+        if "admission" in service:
+            admission = service["admission"].stats()
+            samples["api_ml_requests_waiting"].append(("", labels(service=name), admission["waiting"]))
+            for reason, count in admission["rejected"].items():
+                samples["api_ml_rejected_requests_total"].append(("", labels(service=name, reason=reason), count))
+
+        if "flights" in service:
+            samples["api_ml_coalesced_inputs_total"].append(("", labels(service=name), service["flights"].stats()["coalesced"]))
+
+        if "cache" in service:
+            cache = service["cache"].stats()
+            samples["api_ml_cache_hits_total"].append(("", labels(service=name), cache["hits"]))
+            samples["api_ml_cache_misses_total"].append(("", labels(service=name), cache["misses"]))
+
+    for reason, count in services.admission.stats()["rejected"].items():
+        samples["api_ml_worker_rejected_requests_total"].append(("", labels(reason=reason), count))
+
+    for key, infos in services.store.stats().items():
+        if "memory" in infos:
+            samples["api_ml_model_memory_bytes"].append(("", labels(model=key), infos["memory"]))
+        samples["api_ml_model_services"].append(("", labels(model=key), infos["services"]))
+
+    lines = []
+    for family, (kind, description) in families.items():
+        if len(samples[family]) == 0:
+            continue
+        lines.append("# HELP {} {}".format(family, description))
+        lines.append("# TYPE {} {}".format(family, kind))
+        lines.extend("{}{}{} {}".format(family, suffix, label, value) for suffix, label, value in samples[family])
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,50 @@
+import threading
+from PIL import Image
+import torch
+
+
+# Images are resized and cropped as uint8 pixels when they are decoded,
+# then the whole batch is normalized at once in buffers reused by each scheduler thread
+class ImagePreprocessing(object):
+    def __init__(self, resize, crop, mean, std):
+        self.resize = resize
+        self.crop = crop
+        self.draft_size = (resize, resize)
+        # The uint8 pixels only depend on the resize and the crop, they can be shared by the models with the same ones
+        self.key = (resize, crop)
+
+        # (x / 255 - mean) / std computed as x * scale - shift
+        self.scale = (1 / (255 * torch.tensor(std))).view(1, 3, 1, 1)
+        self.shift = (torch.tensor(mean) / torch.tensor(std)).view(1, 3, 1, 1)
+        self.buffers = threading.local()
+
+    def __call__(self, img):
+        if img.mode != "RGB":
+            img = img.convert("RGB")
+
+        # Same sizes and rounding as transforms.Resize and transforms.CenterCrop
+        width, height = img.size
+        if width <= height:
+            size = (self.resize, int(self.resize * height / width))
+        else:
+            size = (int(self.resize * width / height), self.resize)
+        if size != img.size:
+            img = img.resize(size, Image.BILINEAR)
+
+        left = int(round((size[0] - self.crop) / 2.0))
+        top = int(round((size[1] - self.crop) / 2.0))
+        img = img.crop((left, top, left + self.crop, top + self.crop))
+
+        return torch.frombuffer(bytearray(img.tobytes()), dtype=torch.uint8).view(self.crop, self.crop, 3)
+
+    def batch(self, images):
+        nb_images = len(images)
+        if getattr(self.buffers, "size", 0) < nb_images:
+            self.buffers.pixels = torch.empty(nb_images, self.crop, self.crop, 3, dtype=torch.uint8)
+            self.buffers.input = torch.empty(nb_images, 3, self.crop, self.crop)
+            self.buffers.size = nb_images
+
+        pixels = torch.stack(images, 0, out=self.buffers.pixels[:nb_images])
+        input_batch = self.buffers.input[:nb_images]
+        input_batch.copy_(pixels.permute(0, 3, 1, 2))
+        return input_batch.mul_(self.scale).sub_(self.shift)
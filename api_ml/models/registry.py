@@ -0,0 +1,61 @@
+import torch
+
+
+def softmax(x):
+    return torch.nn.functional.softmax(x, dim=1)
+
+
+def flatten(x):
+    return torch.flatten(x, 1)
+
+
+# Postprocessings are applied on the whole output batch
+postprocessings = {
+    "softmax": softmax,
+    "flatten": flatten
+}
+
+preprocessings = {
+    "imagenet": {"resize": 256, "crop": 224, "mean": [0.485, 0.456, 0.406], "std": [0.229, 0.224, 0.225]}
+}
+
+# Declarative description of the architectures served by the api
+# The module of the constructor is only imported when the architecture is loaded for the first time
+# head is the path of the classification layer, it is removed to serve the pooled features (embeddings)
+architectures = {
+    "densenet121": {"constructor": "torchvision.models:densenet121", "preprocessing": "imagenet", "input_size": 224, "postprocessing": "softmax", "head": "classifier"},
+    "densenet169": {"constructor": "torchvision.models:densenet169", "preprocessing": "imagenet", "input_size": 224, "postprocessing": "softmax", "head": "classifier"},
+    "densenet201": {"constructor": "torchvision.models:densenet201", "preprocessing": "imagenet", "input_size": 224, "postprocessing": "softmax", "head": "classifier"},
+    "densenet161": {"constructor": "torchvision.models:densenet161", "preprocessing": "imagenet", "input_size": 224, "postprocessing": "softmax", "head": "classifier"},
+    "googlenet": {"constructor": "torchvision.models:googlenet", "preprocessing": "imagenet", "input_size": 224, "postprocessing": "softmax", "head": "fc"},
+    "alexnet": {"constructor": "torchvision.models:alexnet", "preprocessing": "imagenet", "input_size": 224, "postprocessing": "softmax", "head": "classifier.6"},
+    "inception_v3": {"constructor": "torchvision.models:inception_v3", "preprocessing": "imagenet", "input_size": 224, "postprocessing": "softmax", "head": "fc"},
+    "mnasnet0_5": {"constructor": "torchvision.models:mnasnet0_5", "preprocessing": "imagenet", "input_size": 224, "postprocessing": "softmax", "head": "classifier.1"},
+    "mnasnet0_75": {"constructor": "torchvision.models:mnasnet0_75", "preprocessing": "imagenet", "input_size": 224, "postprocessing": "softmax", "head": "classifier.1"},
+    "mnasnet1_0": {"constructor": "torchvision.models:mnasnet1_0", "preprocessing": "imagenet", "input_size": 224, "postprocessing": "softmax", "head": "classifier.1"},
+    "mnasnet1_3": {"constructor": "torchvision.models:mnasnet1_3", "preprocessing": "imagenet", "input_size": 224, "postprocessing": "softmax", "head": "classifier.1"},
+    "mobilenet_v2": {"constructor": "torchvision.models:mobilenet_v2", "preprocessing": "imagenet", "input_size": 224, "postprocessing": "softmax", "head": "classifier.1"},
+    "resnet18": {"constructor": "torchvision.models:resnet18", "preprocessing": "imagenet", "input_size": 224, "postprocessing": "softmax", "head": "fc"},
+    "resnet34": {"constructor": "torchvision.models:resnet34", "preprocessing": "imagenet", "input_size": 224, "postprocessing": "softmax", "head": "fc"},
+    "resnet50": {"constructor": "torchvision.models:resnet50", "preprocessing": "imagenet", "input_size": 224, "postprocessing": "softmax", "head": "fc"},
+    "resnet101": {"constructor": "torchvision.models:resnet101", "preprocessing": "imagenet", "input_size": 224, "postprocessing": "softmax", "head": "fc"},
+    "resnet152": {"constructor": "torchvision.models:resnet152", "preprocessing": "imagenet", "input_size": 224, "postprocessing": "softmax", "head": "fc"},
+    "resnext50_32x4d": {"constructor": "torchvision.models:resnext50_32x4d", "preprocessing": "imagenet", "input_size": 224, "postprocessing": "softmax", "head": "fc"},
+    "resnext101_32x8d": {"constructor": "torchvision.models:resnext101_32x8d", "preprocessing": "imagenet", "input_size": 224, "postprocessing": "softmax", "head": "fc"},
+    "wide_resnet50_2": {"constructor": "torchvision.models:wide_resnet50_2", "preprocessing": "imagenet", "input_size": 224, "postprocessing": "softmax", "head": "fc"},
+    "wide_resnet101_2": {"constructor": "torchvision.models:wide_resnet101_2", "preprocessing": "imagenet", "input_size": 224, "postprocessing": "softmax", "head": "fc"},
+    "shufflenetv2_x2.0": {"constructor": "torchvision.models:shufflenet_v2_x2_0", "preprocessing": "imagenet", "input_size": 224, "postprocessing": "softmax", "head": "fc"},
+    "shufflenetv2_x1.5": {"constructor": "torchvision.models:shufflenet_v2_x1_5", "preprocessing": "imagenet", "input_size": 224, "postprocessing": "softmax", "head": "fc"},
+    "shufflenet_v2_x1_0": {"constructor": "torchvision.models:shufflenet_v2_x1_0", "preprocessing": "imagenet", "input_size": 224, "postprocessing": "softmax", "head": "fc"},
+    "shufflenetv2_x0.5": {"constructor": "torchvision.models:shufflenet_v2_x0_5", "preprocessing": "imagenet", "input_size": 224, "postprocessing": "softmax", "head": "fc"},
+    "squeezenet1_0": {"constructor": "torchvision.models:squeezenet1_0", "preprocessing": "imagenet", "input_size": 224, "postprocessing": "softmax", "head": "classifier.1"},
+    "squeezenet1_1": {"constructor": "torchvision.models:squeezenet1_1", "preprocessing": "imagenet", "input_size": 224, "postprocessing": "softmax", "head": "classifier.1"},
+    "vgg11": {"constructor": "torchvision.models:vgg11", "preprocessing": "imagenet", "input_size": 224, "postprocessing": "softmax", "head": "classifier.6"},
+    "vgg13": {"constructor": "torchvision.models:vgg13", "preprocessing": "imagenet", "input_size": 224, "postprocessing": "softmax", "head": "classifier.6"},
+    "vgg16": {"constructor": "torchvision.models:vgg16", "preprocessing": "imagenet", "input_size": 224, "postprocessing": "softmax", "head": "classifier.6"},
+    "vgg19": {"constructor": "torchvision.models:vgg19", "preprocessing": "imagenet", "input_size": 224, "postprocessing": "softmax", "head": "classifier.6"},
+    "vgg11_bn": {"constructor": "torchvision.models:vgg11_bn", "preprocessing": "imagenet", "input_size": 224, "postprocessing": "softmax", "head": "classifier.6"},
+    "vgg13_bn": {"constructor": "torchvision.models:vgg13_bn", "preprocessing": "imagenet", "input_size": 224, "postprocessing": "softmax", "head": "classifier.6"},
+    "vgg16_bn": {"constructor": "torchvision.models:vgg16_bn", "preprocessing": "imagenet", "input_size": 224, "postprocessing": "softmax", "head": "classifier.6"},
+    "vgg19_bn": {"constructor": "torchvision.models:vgg19_bn", "preprocessing": "imagenet", "input_size": 224, "postprocessing": "softmax", "head": "classifier.6"}
+}
@@ -1,41 +1,223 @@
-import api_ml.models as models
+import copy
+import importlib
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+from glob import glob
+from PIL import Image
+import torch
 
+from api_ml import parameters
+from api_ml.models.preprocessing import ImagePreprocessing
+from api_ml.models.registry import architectures, preprocessings, postprocessings
 
-def load_model(name_model, weights=None):
-    if name_model == "alexnet":
-        return models.alexnet.load_model()
 
-    if name_model in ["vgg11", "vgg13", "vgg16", "vgg19", "vgg11_bn", "vgg13_bn", "vgg16_bn", "vgg19_bn"]:
-        return models.vgg.load_model(name_model)
+# fx tracing (int8-static quantization) patches torch.nn.Module.__call__ for the whole process: the forward passes of
+# the other threads would run through the tracer. Forward passes run at the same time, tracing waits for them and runs
+# alone, the forward passes coming meanwhile wait for the end of the tracing.
+class ForwardLock(object):
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.forwards = 0
+        self.tracing = False
+
+    @contextmanager
+    def forward(self):
+        with self.condition:
+            while self.tracing:
+                self.condition.wait()
+            self.forwards += 1
+        try:
+            yield
+        finally:
+            with self.condition:
+                self.forwards -= 1
+                self.condition.notify_all()
+
+    @contextmanager
+    def trace(self):
+        with self.condition:
+            while self.tracing:
+                self.condition.wait()
+            self.tracing = True
+            while self.forwards > 0:
+                self.condition.wait()
+        try:
+            yield
+        finally:
+            with self.condition:
+                self.tracing = False
+                self.condition.notify_all()
+
 
-    if name_model in ["resnet18", "resnet34", "resnet50", "resnet101", "resnet152", "resnext50_32x4d", "resnext101_32x8d", "wide_resnet50_2", "wide_resnet101_2"]:
-        return models.resnet.load_model(name_model)
+forward_lock = ForwardLock()
 
-    if name_model in ["squeezenet1_0", "squeezenet1_1"]:
-        return models.squeezenet.load_model(name_model)
 
-    if name_model in ["densenet121", "densenet169", "densenet161", "densenet201"]:
-        return models.densenet.load_model(name_model)
+def build_preprocessing(name):
+    spec = preprocessings[name]
+    return ImagePreprocessing(spec["resize"], spec["crop"], spec["mean"], spec["std"])
+
+
+def load_model(name_model, weights=None):
+    if name_model not in architectures:
+        return False
+    architecture = architectures[name_model]
+
+    # weights is a ready to serve module replacing the pretrained one
+    model = weights
+    if model is None:
+        module, constructor = architecture["constructor"].split(":")
+        model = getattr(importlib.import_module(module), constructor)(pretrained=True)
+    model.eval()
 
-    if name_model == "inception_v3":
-        return models.inception_v3.load_model()
+    model = {
+        "model": model,
+        "preprocessing": build_preprocessing(architecture["preprocessing"]),
+        "postprocessing": postprocessings[architecture["postprocessing"]],
+        "input_size": architecture["input_size"],
+        "mapping": None,
+        "input_type": "image"
+    }
 
-    if name_model == "googlenet":
-        return models.googlenet.load_model()
+    return model
 
-    if name_model in ["shufflenetv2_x0.5", "shufflenet_v2_x1_0", "shufflenetv2_x1.5", "shufflenetv2_x2.0"]:
-        return models.shufflenet.load_model(name_model)
 
-    if name_model == "mobilenet_v2":
-        return models.mobilenet_v2.load_model()
+def without_head(module, path):
+    # Only the modules on the path of the head are copied, the weights stay shared with the original model
+    module = copy.copy(module)
+    module._modules = dict(module._modules)
+    name, _, rest = path.partition(".")
+    module._modules[name] = without_head(module._modules[name], rest) if rest else torch.nn.Identity()
+    return module
 
-    if name_model in ["mnasnet0_5", "mnasnet0_75", "mnasnet1_0", "mnasnet1_3"]:
-        return models.mnasnet.load_model(name_model)
 
-    return False
+def embedding_model(name_model, model):
+    # Model returning the pooled features given to the classification layer
+    model = dict(model)
+    model["model"] = without_head(model["model"], architectures[name_model]["head"])
+    model["postprocessing"] = postprocessings["flatten"]
+    return model
 
 
 def batchify(iterable, batch_size=1):
     length = len(iterable)
     for ndx in range(0, length, batch_size):
         yield iterable[ndx:min(ndx + batch_size, length)]
+
+
+def tensors_memory(values):
+    memory = 0
+    for x in values:
+        if isinstance(x, torch.Tensor):
+            memory += x.numel() * x.element_size()
+        elif isinstance(x, (list, tuple)):
+            memory += tensors_memory(x)
+    return memory
+
+
+def model_memory(model):
+    # Memory used by the weights and buffers of a torch module (in bytes)
+    values = list(model.state_dict().values())
+    # Frozen TorchScript modules keep their weights as constants of the graph
+    if len(values) == 0 and hasattr(model, "graph"):
+        nodes = model.graph.findAllNodes("prim::Constant")
+        values = [x.output().toIValue() for x in nodes if x.output().type().kind() == "TensorType"]
+    return tensors_memory(values)
+
+
+class CastModule(torch.nn.Module):
+    # Run a module in another dtype while taking and returning float32 tensors
+    def __init__(self, module, dtype):
+        super(CastModule, self).__init__()
+        self.module = module
+        self.dtype = dtype
+
+    def forward(self, x):
+        return self.module(x.to(self.dtype)).float()
+
+
+def calibration_batch(model):
+    # Fixed local image set used for the int8-static calibration and to check the accuracy drift
+    calibration_dir = os.environ.get("API_ML_CALIBRATION_DIR", parameters.calibration_dir)
+    if calibration_dir is not None:
+        paths = sorted(glob(os.path.join(calibration_dir, "*")))[:parameters.calibration_size]
+        imgs = [Image.open(x).convert("RGB") for x in paths]
+    else:
+        imgs = [Image.frombytes("RGB", (320, 320), random.Random(x).randbytes(320 * 320 * 3)) for x in range(parameters.calibration_size)]
+
+    return model["preprocessing"].batch([model["preprocessing"](x) for x in imgs]).clone()
+
+
+def quantize_model(model, precision):
+    from torch.ao.quantization import get_default_qconfig_mapping, quantize_dynamic
+    from torch.ao.quantization.quantize_fx import prepare_fx, convert_fx
+
+    # The eager model can be shared with other services: it is copied before being converted
+    module = model["model"]
+    if precision == "bf16":
+        module = CastModule(copy.deepcopy(module).to(torch.bfloat16), torch.bfloat16)
+    elif precision == "int8-dynamic":
+        module = quantize_dynamic(module, {torch.nn.Linear}, dtype=torch.qint8)
+    elif precision == "int8-static":
+        batch = calibration_batch(model)
+        with forward_lock.trace():
+            module = prepare_fx(copy.deepcopy(module), get_default_qconfig_mapping(), (batch,))
+            with torch.no_grad():
+                module(batch)
+            module = convert_fx(module)
+    elif precision != "fp32":
+        raise ValueError("{} is not a precision".format(precision))
+
+    quantized = dict(model)
+    quantized["model"] = module
+    return quantized
+
+
+def compare_models(reference, model, repeat=3):
+    # Speedup and accuracy drift of a model compared to its fp32 version on the calibration images
+    batch = calibration_batch(reference)
+    outputs, durations = [], []
+    with torch.inference_mode(), forward_lock.forward():
+        for x in [reference, model]:
+            output = x["model"](batch)
+            start = time.perf_counter()
+            for _ in range(repeat):
+                x["model"](batch)
+            durations.append((time.perf_counter() - start) / repeat)
+            outputs.append(x["postprocessing"](output.float()))
+
+    return {
+        "memory_fp32": model_memory(reference["model"]),
+        "speedup": durations[0] / durations[1],
+        "top1_agreement": (outputs[0].argmax(1) == outputs[1].argmax(1)).float().mean().item(),
+        "max_drift": (outputs[0] - outputs[1]).abs().max().item()
+    }
+
+
+def compile_model(model, mode, batch_size=1):
+    example = torch.rand(batch_size, 3, model["input_size"], model["input_size"])
+
+    with torch.no_grad(), forward_lock.forward():
+        if mode == "script":
+            module = torch.jit.script(model["model"])
+        elif mode == "trace+freeze":
+            module = torch.jit.freeze(torch.jit.trace(model["model"], example))
+        elif mode == "optimize_for_inference":
+            module = torch.jit.optimize_for_inference(torch.jit.script(model["model"]))
+        else:
+            raise ValueError("{} is not a compilation mode".format(mode))
+
+    compiled = dict(model)
+    compiled["model"] = module
+    warm_up(compiled, batch_size)
+    return compiled
+
+
+def warm_up(model, batch_size=1):
+    # The first calls of a TorchScript module are used to profile and optimize its graph
+    example = torch.rand(batch_size, 3, model["input_size"], model["input_size"])
+    with torch.inference_mode(), forward_lock.forward():
+        for _ in range(2):
+            model["model"](example)
@@ -1,33 +1,62 @@
-from io import BytesIO
-from PIL import Image
-import requests
-
+import collections
+import contextlib
 import falcon
+import functools
+import io
 import json
+import logging
+import math
+import msgpack
+import os
+import threading
+import time
 
-from api_ml.models.utils import load_model, batchify
+from api_ml.admission import DeadlineExceeded, Overloaded, remaining, request_deadline
+from api_ml.embeddings import EmbeddingPostprocessing
+from api_ml.fetching import ImageFetcher
+from api_ml.metrics import render_metrics
+from api_ml.models.utils import batchify, forward_lock, warm_up
+from api_ml.parameters import compile_modes, deadline_header, loading_wait, max_body_size, modes, precisions, stream_lookahead
+from api_ml.serialization import dumps_json, format_embedding, format_prediction, output_formats, serialize, stream_modes
 from api_ml.utils import check_json
+from glob import glob
 import torch
 
+logger = logging.getLogger(__name__)
+
+
+def raw_prediction(prediction):
+    return prediction
+
+
+def average_predictions(predictions):
+    # Mean of the scores of each class over the services, a class missing from the top_k of a service counts as 0
+    scores = collections.defaultdict(float)
+    for indices, values in predictions:
+        for index, value in zip(indices, values):
+            scores[index] += value / len(predictions)
+    ranked = sorted(scores.items(), key=lambda x: x[1], reverse=True)
+    return [x for x, _ in ranked], [x for _, x in ranked]
+
 
 # Create class Origin that raises HTTPMethodNotAllowed
 class Origin(object):
     def __init__(self):
         self.methods_allowed = []
 
-    def on_get(self, req, resp):
+    def on_get(self, req, resp, **kwargs):
         raise falcon.HTTPMethodNotAllowed(self.methods_allowed, description="GET method is not allowed. Methods allowed are {}".format(self.methods_allowed))
 
-    def on_delete(self, req, resp):
+    def on_delete(self, req, resp, **kwargs):
         raise falcon.HTTPMethodNotAllowed(self.methods_allowed, description="DELETE method is not allowed. Methods allowed are {}".format(self.methods_allowed))
 
-    def on_put(self, req, resp):
+    def on_put(self, req, resp, **kwargs):
         raise falcon.HTTPMethodNotAllowed(self.methods_allowed, description="PUT method is not allowed. Methods allowed are {}".format(self.methods_allowed))
 
-    def on_post(self, req, resp):
+    def on_post(self, req, resp, **kwargs):
         raise falcon.HTTPMethodNotAllowed(self.methods_allowed, description="POST method is not allowed. Methods allowed are {}".format(self.methods_allowed))
 
-    def on_options(self, req, resp):
+    def on_options(self, req, resp, **kwargs):
         raise falcon.HTTPMethodNotAllowed(self.methods_allowed, description="OPTIONS method is not allowed. Methods allowed are {}".format(self.methods_allowed))
 
 
@@ -38,7 +67,9 @@ class ListAvailableModels(Origin):
         self.methods_allowed = ["GET"]
 
     def validate_json_input(self, req):
-        input_read = req.bounded_stream.read()
+        return self.check_input(req.bounded_stream.read())
+
+    def check_input(self, input_read):
         if input_read == b'':
             return
 
@@ -62,7 +93,9 @@ class ListOnlineModels(Origin):
         self.methods_allowed = ["GET"]
 
     def validate_json_input(self, req):
-        input_read = req.bounded_stream.read()
+        return self.check_input(req.bounded_stream.read())
+
+    def check_input(self, input_read):
         if input_read == b'':
             return
 
@@ -74,19 +107,51 @@ class ListOnlineModels(Origin):
 
     def on_get(self, req, resp):
         _ = self.validate_json_input(req)
-        online_models = [{x: {y: self.services.models_online[x][y] for y in self.services.models_online[x] if y != "model"}} for x in self.services.models_online]
-        resp.body = json.dumps({"title": {"code": 200, "name": "Success"}, "description": online_models if online_models != {} else "no models are online"}, ensure_ascii=False)
+        online_models = self.services.describe_services()
+        resp.body = json.dumps({"title": {"code": 200, "name": "Success"}, "description": online_models if online_models != {} else "no models are online", "models_loaded": self.services.store.stats(), "threads": self.services.threads, "admission": self.services.admission.stats(), "residency": self.services.residency_stats()}, ensure_ascii=False)
         resp.content_type = falcon.MEDIA_JSON
         resp.status = falcon.HTTP_200
 
 
+# Keep the services of the workers of a server consistent (shared_dir)
+class SyncServices(object):
+    def __init__(self, load_model):
+        self.load_model = load_model
+
+    def process_request(self, req, resp):
+        self.load_model.sync()
+
+
+class ExportMetrics(Origin):
+    def __init__(self, services):
+        Origin.__init__(self)
+        self.services = services
+        self.methods_allowed = ["GET"]
+
+    def on_get(self, req, resp):
+        # Prometheus text format, built only when scraped
+        resp.body = render_metrics(self.services)
+        resp.content_type = "text/plain; version=0.0.4; charset=utf-8"
+        resp.status = falcon.HTTP_200
+
+
 class LoadModel(Origin):
     def __init__(self, services):
         Origin.__init__(self)
         self.services = services
         self.methods_allowed = ["PUT"]
+        # Creations of this worker and the application of the changes of the other workers
+        self.sync_lock = threading.Lock()
 
     def validate_json_input(self, req):
+        try:
+            json_input = json.load(req.bounded_stream)
+        except json.decoder.JSONDecodeError:
+            raise falcon.HTTPBadRequest({"code": 400, "name": "Bad request"}, "Json seems malformed")
+
+        return self.check_input(json_input)
+
+    def check_input(self, json_input):
         call_params = {
             "top_k": {
                 "name": "top_k",
@@ -102,6 +167,106 @@ class LoadModel(Origin):
                 "specific_check": {"superior": lambda x: x > 0},
                 "messages": {"none": "Please specify the batch_size to used.", "type": "batch_size must be an integer larger than 1."}
             },
+            "max_wait_ms": {
+                "name": "max_wait_ms",
+                "type": (int, float),
+                "mandatory": False,
+                "specific_check": {"positive": lambda x: x >= 0},
+                "messages": {"none": "Please specify the max_wait_ms to used.", "type": "max_wait_ms must be a positive number."}
+            },
+            "precision": {
+                "name": "precision",
+                "type": str,
+                "mandatory": False,
+                "enum": precisions,
+                "messages": {"none": "Please specify the precision.", "type": "precision must be a string between the following {}.".format(precisions)}
+            },
+            "compile": {
+                "name": "compile",
+                "type": str,
+                "mandatory": False,
+                "enum": compile_modes,
+                "messages": {"none": "Please specify the compile mode.", "type": "compile must be a string between the following {}.".format(compile_modes)}
+            },
+            "intra_op_threads": {
+                "name": "intra_op_threads",
+                "type": int,
+                "mandatory": False,
+                "specific_check": {"superior": lambda x: x > 0},
+                "messages": {"none": "Please specify the intra_op_threads to used.", "type": "intra_op_threads must be an integer larger than 1."}
+            },
+            "priority": {
+                "name": "priority",
+                "type": int,
+                "mandatory": False,
+                "specific_check": {"superior": lambda x: x > 0},
+                "messages": {"none": "Please specify the priority to used.", "type": "priority must be an integer larger than 1."}
+            },
+            "max_concurrency": {
+                "name": "max_concurrency",
+                "type": int,
+                "mandatory": False,
+                "specific_check": {"superior": lambda x: x > 0},
+                "messages": {"none": "Please specify the max_concurrency to used.", "type": "max_concurrency must be an integer larger than 1."}
+            },
+            "max_queue": {
+                "name": "max_queue",
+                "type": int,
+                "mandatory": False,
+                "specific_check": {"superior": lambda x: x >= 0},
+                "messages": {"none": "Please specify the max_queue to used.", "type": "max_queue must be a positive integer."}
+            },
+            "cache_size": {
+                "name": "cache_size",
+                "type": int,
+                "mandatory": False,
+                "specific_check": {"superior": lambda x: x > 0},
+                "messages": {"none": "Please specify the cache_size to used.", "type": "cache_size must be an integer larger than 1."}
+            },
+            "cache_ttl": {
+                "name": "cache_ttl",
+                "type": (int, float),
+                "mandatory": False,
+                "specific_check": {"superior": lambda x: x > 0},
+                "messages": {"none": "Please specify the cache_ttl to used.", "type": "cache_ttl must be a number of seconds larger than 0."}
+            },
+            "cache_urls": {
+                "name": "cache_urls",
+                "type": bool,
+                "mandatory": False,
+                "messages": {"none": "Please specify if urls must be cached.", "type": "cache_urls must be a boolean."}
+            },
+            "coalesce": {
+                "name": "coalesce",
+                "type": bool,
+                "mandatory": False,
+                "messages": {"none": "Please specify if identical inputs must be coalesced.", "type": "coalesce must be a boolean."}
+            },
+            "warm_up": {
+                "name": "warm_up",
+                "type": bool,
+                "mandatory": False,
+                "messages": {"none": "Please specify if the model must be warmed up.", "type": "warm_up must be a boolean."}
+            },
+            "mode": {
+                "name": "mode",
+                "type": str,
+                "mandatory": False,
+                "enum": modes,
+                "messages": {"none": "Please specify the mode.", "type": "mode must be a string between the following {}.".format(modes)}
+            },
+            "normalize": {
+                "name": "normalize",
+                "type": bool,
+                "mandatory": False,
+                "messages": {"none": "Please specify if embeddings must be normalized.", "type": "normalize must be a boolean."}
+            },
+            "pca": {
+                "name": "pca",
+                "type": str,
+                "mandatory": False,
+                "messages": {"none": "Please specify the path of the pca.", "type": "pca must be the path of a file saved by python -m api_ml.embeddings."}
+            },
             "service_name": {
                 "name": "service_name",
                 "type": str,
@@ -123,11 +288,6 @@ class LoadModel(Origin):
             }
         }
 
-        try:
-            json_input = json.load(req.bounded_stream)
-        except json.decoder.JSONDecodeError:
-            raise falcon.HTTPBadRequest({"code": 400, "name": "Bad request"}, "Json seems malformed")
-
         success, message = check_json(json_input, call_params)
         if not success:
             raise falcon.HTTPBadRequest({"code": 400, "name": "Bad request"}, message)
@@ -137,25 +297,147 @@ class LoadModel(Origin):
             msg = "{} are the only possible inputs.".format(fields_needed)
             raise falcon.HTTPBadRequest({"code": 400, "name": "Bad request"}, msg)
 
+        if "max_queue" in json_input and "max_concurrency" not in json_input:
+            raise falcon.HTTPBadRequest({"code": 400, "name": "Bad request"}, "max_queue is only possible with max_concurrency.")
+
+        # Options of the embedding services
+        if json_input.get("mode", "classification") != "embedding" and ("normalize" in json_input or "pca" in json_input):
+            raise falcon.HTTPBadRequest({"code": 400, "name": "Bad request"}, "normalize and pca are only possible with the embedding mode.")
+
         return json_input
 
-    def on_put(self, req, resp):
-        json_input = self.validate_json_input(req)
+    def create(self, json_input, wait=False):
+        shared = self.services.shared
+        if shared is None:
+            return self.create_local(json_input, wait)
+
+        # The name is checked and the service added in the shared file under its lock
+        # so that two workers never create the same service
+        with shared.edit() as services, self.sync_lock:
+            if json_input["service_name"] in services:
+                raise falcon.HTTPConflict({"code": 409, "name": "Bad request"}, "The service '{}' already exists".format(json_input["service_name"]))
+            service = self.create_local(json_input, wait)
+            services[json_input["service_name"]] = json_input
+        return service
+
+    def create_local(self, json_input, wait=False):
+        # The service is online at once, its model is loaded by the loader threads (or before returning with wait)
         model_name = json_input["model_name"]
         service_name = json_input["service_name"]
-
-        # Load model
-        model = load_model(model_name)
-        if model is False:
+        if model_name not in self.services.models_available:
             raise falcon.HTTPNotFound(description="model {} is not an available model in the API".format(model_name))
 
+        postprocessing = None
+        if json_input.get("mode") == "embedding":
+            try:
+                postprocessing = EmbeddingPostprocessing(json_input.get("normalize", False), json_input.get("pca"))
+            except Exception as e:
+                raise falcon.HTTPBadRequest({"code": 400, "name": "Bad request"}, "The pca cannot be loaded: {}".format(e))
+
         # Check if the service exists
-        success = self.services.create_service(json_input, model)
-        if not success:
+        service = self.services.create_service(json_input)
+        if service is False:
             raise falcon.HTTPConflict({"code": 409, "name": "Bad request"}, "The service '{}' already exists".format(service_name))
 
-        resp.body = json.dumps({"title": {"code": 201, "name": "Success"}, "description": "service '{}' sucessfully created".format(service_name)}, ensure_ascii=False)
-        resp.status = falcon.HTTP_201
+        if wait:
+            self.load(json_input, service, postprocessing)
+        else:
+            self.services.loader().submit(self.load, json_input, service, postprocessing)
+        return service
+
+    def load(self, json_input, service, postprocessing=None):
+        # loading -> warming -> ready, or failed with the error
+        model_name = json_input["model_name"]
+        service_name = json_input["service_name"]
+        mode = json_input.get("mode")
+        release = functools.partial(self.services.store.release, model_name, json_input.get("precision"), json_input.get("compile"), mode)
+
+        # Load model (weights are shared by every service using the same model)
+        start = time.perf_counter()
+        try:
+            model = self.services.store.acquire(model_name, json_input.get("precision"), json_input.get("compile"), json_input.get("batch_size", 1), mode)
+            if model is False:
+                raise ValueError("model {} is not an available model in the API".format(model_name))
+        except Exception as e:
+            self.services.set_state(service_name, service, "failed", error="The model cannot be loaded: {}".format(e))
+            return
+
+        loaded = False
+        try:
+            # Embedding services share the headless model but have their own normalization and pca
+            if postprocessing is not None:
+                if postprocessing.components is not None:
+                    with torch.inference_mode(), forward_lock.forward():
+                        dim = torch.flatten(model["model"](torch.rand(1, 3, model["input_size"], model["input_size"])), 1).shape[1]
+                    if postprocessing.components.shape[1] != dim:
+                        raise ValueError("The pca expects features of size {} but {} gives {}.".format(postprocessing.components.shape[1], model_name, dim))
+                model = dict(model, postprocessing=postprocessing)
+
+            if not self.services.set_state(service_name, service, "warming", model=model, load_s=time.perf_counter() - start):
+                # Deleted while loading
+                release()
+                return
+            loaded = True
+
+            # The first forward passes are slower (allocations, profiling of the TorchScript modules)
+            if json_input.get("warm_up", False):
+                start = time.perf_counter()
+                warm_up(model, json_input.get("batch_size", 1))
+                self.services.set_state(service_name, service, "ready", warm_up_s=time.perf_counter() - start)
+            else:
+                self.services.set_state(service_name, service, "ready")
+        except Exception as e:
+            # The model of a service deleted while warming is released by delete_service
+            if self.services.set_state(service_name, service, "failed", error=str(e)) or not loaded:
+                release()
+
+    def restore(self, path):
+        # Services of the manifest are loaded before the api accepts any request
+        with open(path) as f:
+            manifest = json.load(f)
+
+        for json_input in manifest:
+            try:
+                service = self.create(self.check_input(json_input), wait=True)
+            except falcon.HTTPConflict as e:
+                # Already created by another worker sharing the services
+                if self.services.shared is None:
+                    raise ValueError("Service {} of the manifest {} cannot be created: {}".format(json_input.get("service_name"), path, e.description))
+                continue
+            except falcon.HTTPError as e:
+                raise ValueError("Service {} of the manifest {} cannot be created: {}".format(json_input.get("service_name"), path, e.description))
+            if service["state"] == "failed":
+                raise ValueError("Service {} of the manifest {} cannot be created: {}".format(json_input.get("service_name"), path, service["error"]))
+        self.sync()
+
+    def sync(self):
+        # Apply the services created and deleted by the other workers
+        shared = self.services.shared
+        if shared is None or not shared.changed():
+            return
+
+        with self.sync_lock:
+            version, services = shared.read()
+            for name in list(self.services.models_online):
+                if name not in services:
+                    self.services.delete_service(name)
+            for name, json_input in services.items():
+                if name not in self.services.models_online:
+                    try:
+                        self.create_local(json_input)
+                    except falcon.HTTPError:
+                        # The other services are still applied, this one is tried again on the next change
+                        logger.exception("Service %s created by another worker cannot be created", name)
+            shared.version = version
+
+    def on_put(self, req, resp):
+        json_input = self.validate_json_input(req)
+        self.create(json_input)
+        service_name = json_input["service_name"]
+
+        # The service is ready once its state on /online is ready
+        resp.body = json.dumps({"title": {"code": 202, "name": "Accepted"}, "description": "service '{}' is loading".format(service_name), "state": "loading"}, ensure_ascii=False)
+        resp.status = falcon.HTTP_202
 
 
 class DeleteModel(Origin):
@@ -165,6 +447,14 @@ class DeleteModel(Origin):
         self.methods_allowed = ["DELETE"]
 
     def validate_json_input(self, req):
+        try:
+            json_input = json.load(req.bounded_stream)
+        except json.decoder.JSONDecodeError:
+            raise falcon.HTTPBadRequest({"code": 400, "name": "Bad request"}, "Json seems malformed")
+
+        return self.check_input(json_input)
+
+    def check_input(self, json_input):
         call_params = {
             "service_name": {
                 "name": "service_name",
@@ -174,11 +464,6 @@ class DeleteModel(Origin):
             }
         }
 
-        try:
-            json_input = json.load(req.bounded_stream)
-        except json.decoder.JSONDecodeError:
-            raise falcon.HTTPBadRequest({"code": 400, "name": "Bad request"}, "Json seems malformed")
-
         success, message = check_json(json_input, call_params)
         if not success:
             raise falcon.HTTPBadRequest({"code": 400, "name": "Bad request"}, message)
@@ -190,12 +475,21 @@ class DeleteModel(Origin):
 
         return json_input
 
+    def delete(self, service_name):
+        if self.services.shared is None:
+            return self.services.delete_service(service_name)
+
+        # Removed from the shared file first, the other workers delete it on their next request
+        with self.services.shared.edit() as services:
+            shared = services.pop(service_name, None) is not None
+        return self.services.delete_service(service_name) or shared
+
     def on_delete(self, req, resp):
         json_input = self.validate_json_input(req)
         service_name = json_input["service_name"]
 
         # Check if service exists
-        success = self.services.delete_service(service_name)
+        success = self.delete(service_name)
         if not success:
             raise falcon.HTTPNotFound(description="Service does not seem to exist")
 
@@ -204,33 +498,716 @@ class DeleteModel(Origin):
 
 
 class Predict(Origin):
-    def __init__(self, services):
+    def __init__(self, services, fetcher=None):
         Origin.__init__(self)
         self.services = services
+        self.fetcher = fetcher if fetcher is not None else ImageFetcher()
         self.methods_allowed = ["POST"]
 
+    def read_msgpack(self, stream):
+        # Raw images are bin items of data, they are decoded from the unpacked buffers (the images too large are
+        # answered as incorrect inputs by the fetcher)
+        unpacker = msgpack.Unpacker(stream, raw=False)
+        try:
+            json_input = unpacker.unpack()
+        except Exception:
+            raise falcon.HTTPBadRequest({"code": 400, "name": "Bad request"}, "Msgpack seems malformed")
+
+        if isinstance(json_input, dict) and isinstance(json_input.get("data"), list):
+            names = [x if isinstance(x, str) else "inline_{}".format(j) for j, x in enumerate(json_input["data"])]
+        else:
+            names = []
+        return json_input, names
+
+    def read_multipart(self, req):
+        # Parts are read one after the other from the stream, data parts are either urls or image files
+        json_input = {"data": []}
+        names = []
+        try:
+            for part in req.get_media():
+                if part.name == "data" and part.filename is not None:
+                    # Images too large are answered as incorrect inputs by the fetcher like the urls
+                    content = part.stream.read(self.fetcher.max_size + 1)
+                    json_input["data"].append(content)
+                    names.append(part.filename)
+                elif part.name == "data":
+                    json_input["data"].append(part.get_text())
+                    names.append(json_input["data"][-1])
+                else:
+                    json_input[part.name] = part.get_text()
+        except falcon.MediaMalformedError:
+            raise falcon.HTTPBadRequest({"code": 400, "name": "Bad request"}, "Multipart seems malformed")
+
+        return json_input, names
+
+    def read_json(self, stream):
+        try:
+            json_input = json.load(stream)
+        except json.decoder.JSONDecodeError:
+            raise falcon.HTTPBadRequest({"code": 400, "name": "Bad request"}, "Json seems malformed")
+        names = json_input.get("data") if isinstance(json_input, dict) else None
+        return json_input, names
+
+    def check_body(self, body):
+        # The whole body is held in memory before being unpacked
+        if len(body) > max_body_size:
+            raise falcon.HTTPPayloadTooLarge({"code": 413, "name": "Payload too large"}, "Body must be at most {} bytes".format(max_body_size))
+        return io.BytesIO(body)
+
+    def body_type(self, req):
+        content_type = (req.content_type or "").split(";")[0].strip()
+        if content_type == "multipart/form-data":
+            return "multipart"
+        if content_type in [falcon.MEDIA_MSGPACK, "application/x-msgpack"]:
+            return "msgpack"
+        return "json"
+
     def validate_json_input(self, req):
+        body_type = self.body_type(req)
+        if body_type == "multipart":
+            json_input, names = self.read_multipart(req)
+        elif body_type == "msgpack":
+            json_input, names = self.read_msgpack(self.check_body(req.bounded_stream.read(max_body_size + 1)))
+        else:
+            json_input, names = self.read_json(self.check_body(req.bounded_stream.read(max_body_size + 1)))
+
+        return self.check_input(json_input, names, binary=body_type != "json")
+
+    def check_input(self, json_input, names, binary=False):
         call_params = {
             "service_name": {
                 "name": "service_name",
-                "type": str,
+                "type": (str, list),
                 "mandatory": True,
-                "messages": {"none": "Please specify a service_name.", "type": "service_name must be a string."}
+                "specific_check": {"services": lambda x: isinstance(x, str) or (len(x) > 0 and all([isinstance(y, str) for y in x]) and len(set(x)) == len(x))},
+                "messages": {"none": "Please specify a service_name.", "type": "service_name must be a string or an array of different strings."}
+            },
+            "ensemble": {
+                "name": "ensemble",
+                "type": bool,
+                "mandatory": False,
+                "messages": {"none": "Please specify if the scores must be averaged.", "type": "ensemble must be a boolean."}
             },
             "data": {
                 "name": "data",
                 "type": list,
                 "mandatory": True,
-                "specific_check": {"array_strings": lambda x: all([isinstance(y, str) for y in x])},
-                "messages": {"none": "Please specify the field data.", "type": "data must be an array of strings."}
+                "specific_check": {"array_strings": lambda x: all([isinstance(y, str) or (binary and isinstance(y, bytes)) for y in x])},
+                "messages": {"none": "Please specify the field data.", "type": "data must be an array of strings (or of raw images for msgpack and multipart bodies)."}
+            },
+            "output": {
+                "name": "output",
+                "type": str,
+                "mandatory": False,
+                "enum": output_formats,
+                "messages": {"none": "Please specify the output format.", "type": "output must be a string between the following {}.".format(output_formats)}
+            },
+            "stream": {
+                "name": "stream",
+                "type": str,
+                "mandatory": False,
+                "enum": stream_modes,
+                "messages": {"none": "Please specify the stream mode.", "type": "stream must be a string between the following {}.".format(stream_modes)}
             }
         }
 
+        if not isinstance(json_input, dict):
+            raise falcon.HTTPBadRequest({"code": 400, "name": "Bad request"}, "Input must be an object")
+
+        success, message = check_json(json_input, call_params)
+        if not success:
+            raise falcon.HTTPBadRequest({"code": 400, "name": "Bad request"}, message)
+
+        fields_needed = set(call_params.keys())
+        if not set(json_input.keys()).issubset(fields_needed):
+            msg = "{} are the only possible inputs.".format(fields_needed)
+            raise falcon.HTTPBadRequest({"code": 400, "name": "Bad request"}, msg)
+
+        if json_input.get("ensemble") and not isinstance(json_input["service_name"], list):
+            raise falcon.HTTPBadRequest({"code": 400, "name": "Bad request"}, "ensemble is only possible with an array of service_name.")
+
+        return json_input, names
+
+    def predict(self, model, input, top_k=-1, observe=None):
+        # Nothing needs to be recorded for autograd
+        with torch.inference_mode():
+            start = time.perf_counter()
+            # create mini batch (images are already resized and cropped by the fetcher)
+            input_batch = model['preprocessing'].batch(input)
+            batched = time.perf_counter()
+
+            # Make prediction (never while a model is traced, see ForwardLock)
+            with forward_lock.forward():
+                output = model['model'](input_batch)
+            forwarded = time.perf_counter()
+
+            # Make postprocessing on the whole batch
+            predictions = model['postprocessing'](output)
+
+            # Sort prediction and get top wanted
+            if top_k == -1:
+                top_k = predictions.shape[1]
+            topk_val, topk_indices = torch.topk(predictions, top_k, dim=1)
+            topk_val, topk_indices = topk_val.tolist(), topk_indices.tolist()
+
+        if observe is not None:
+            observe("batch", batched - start)
+            observe("forward", forwarded - batched)
+            observe("postprocessing", time.perf_counter() - forwarded)
+
+        # Predictions are formatted for each request (and cached) as (indices, scores)
+        return list(zip(topk_indices, topk_val))
+
+    def embed(self, model, input, top_k=-1, observe=None):
+        with torch.inference_mode():
+            start = time.perf_counter()
+            input_batch = model['preprocessing'].batch(input)
+            batched = time.perf_counter()
+
+            with forward_lock.forward():
+                output = model['model'](input_batch)
+            forwarded = time.perf_counter()
+
+            # Flatten, pca and normalization on the whole batch, each vector is copied out of the batch
+            embeddings = [x.clone() for x in model['postprocessing'](output).float()]
+
+        if observe is not None:
+            observe("batch", batched - start)
+            observe("forward", forwarded - batched)
+            observe("postprocessing", time.perf_counter() - forwarded)
+
+        return embeddings
+
+    def cached_image(self, service, img):
+        key = None
+        cache = service.get("cache")
+        if cache is not None:
+            key = cache.image_key(service["model_name"], service.get("top_k", -1), img)
+            return key, cache.get(key)
+        return key, None
+
+    def cached_urls(self, service, scheduler, batch):
+        cache = service.get("cache")
+        if cache is not None and cache.cache_urls:
+            # A miss is counted by the lookup of the image once fetched
+            return [cache.get(cache.url_key(service["model_name"], scheduler.top_k, x), count_miss=False) if isinstance(x, str) else None for _, x in batch]
+        return [None] * len(batch)
+
+    def prepare(self, service, img):
+        # Run by the fetcher: look the decoded image up in the cache before preprocessing it
+        key, prediction = self.cached_image(service, img)
+        if prediction is not None:
+            return key, prediction, None
+
+        return key, None, service["model"]["preprocessing"](img)
+
+    def prepare_targets(self, targets, img):
+        # The decoded image is preprocessed once for all the services with the same resize and crop
+        prepared = {}
+        images = []
+        for _, service, _, _ in targets:
+            key, prediction = self.cached_image(service, img)
+            if prediction is not None:
+                images.append((key, prediction, None))
+                continue
+            preprocessing = service["model"]["preprocessing"]
+            if preprocessing.key not in prepared:
+                prepared[preprocessing.key] = preprocessing(img)
+            images.append((key, None, prepared[preprocessing.key]))
+        return images
+
+    def join_flights(self, service, batch, cached):
+        # (flight, started by this request) of each input missing from the cache, None if it is not coalesced.
+        # A request with a deadline does not start flights: the others would wait for images it may give up.
+        flights = service.get("flights")
+        joined = []
+        for (_, url_image), prediction in zip(batch, cached):
+            if flights is None or prediction is not None or not isinstance(url_image, str):
+                joined.append(None)
+            elif request_deadline.get() is None:
+                joined.append(flights.join(url_image))
+            else:
+                joined.append(flights.find(url_image))
+        return joined
+
+    def start_flights(self, service, scheduler, started, index=None):
+        # started is the (flight, image, url) of the flights started by a batch. Their images are predicted together once
+        # all of them are fetched, as the other images of the batch, whatever becomes of the request which started them
+        if len(started) == 0:
+            return
+        cache = service.get("cache")
+        lock = threading.Lock()
+        pending = [len(started)]
+
+        def resolve(flight, url_image, key, prediction):
+            if cache is not None:
+                if key is not None:
+                    cache.put(key, prediction)
+                if cache.cache_urls:
+                    cache.put(cache.url_key(service["model_name"], scheduler.top_k, url_image), prediction)
+            flight.set_result(prediction)
+
+        def predicted(future, flight, url_image, key):
+            try:
+                prediction = future.result()
+            except Exception as e:
+                flight.set_exception(e)
+                return
+            resolve(flight, url_image, key, prediction)
+
+        def submit():
+            to_submit = []
+            for flight, image, url_image in started:
+                try:
+                    prepared = image.result()
+                    key, prediction, img = prepared[index] if index is not None else prepared
+                except BaseException as e:
+                    # Including the cancellation of the download by the asgi app
+                    flight.set_exception(e)
+                    continue
+                if prediction is not None:
+                    # Same image already predicted under another url
+                    resolve(flight, url_image, None, prediction)
+                else:
+                    to_submit.append((flight, url_image, key, img))
+
+            try:
+                futures = scheduler.submit([x[3] for x in to_submit]) if len(to_submit) > 0 else []
+            except BaseException as e:
+                for flight, _, _, _ in to_submit:
+                    flight.set_exception(e)
+                return
+            for (flight, url_image, key, _), future in zip(to_submit, futures):
+                future.add_done_callback(functools.partial(predicted, flight=flight, url_image=url_image, key=key))
+
+        def fetched(image):
+            with lock:
+                pending[0] -= 1
+                if pending[0] > 0:
+                    return
+            submit()
+
+        for _, image, _ in started:
+            image.add_done_callback(fetched)
+
+    def fetch_batch(self, service, scheduler, batch):
+        # Images are downloaded and preprocessed concurrently, predictions of urls already seen are taken from the cache
+        cached = self.cached_urls(service, scheduler, batch)
+        flights = self.join_flights(service, batch, cached)
+        to_fetch = [x for (_, x), y, z in zip(batch, cached, flights) if y is None and (z is None or z[1])]
+        fetched = iter(self.fetcher.fetch(to_fetch, functools.partial(self.prepare, service), scheduler.model['preprocessing'].draft_size, service["metrics"].observe))
+        images = []
+        started = []
+        for (_, url_image), prediction, flight in zip(batch, cached, flights):
+            image = next(fetched) if prediction is None and (flight is None or flight[1]) else None
+            if flight is not None:
+                if flight[1]:
+                    started.append((flight[0], image, url_image))
+                image = None
+            images.append(image)
+        self.start_flights(service, scheduler, started)
+        return batch, cached, images, flights
+
+    def fetch_targets(self, targets, batch):
+        # Each image is downloaded and decoded once for all the services, unless all of them have it cached
+        # or predicted by another request
+        cached = [self.cached_urls(service, scheduler, batch) for _, service, scheduler, _ in targets]
+        flights = [self.join_flights(service, batch, x) for (_, service, _, _), x in zip(targets, cached)]
+        missing = [any(y is None and (z is None or z[1]) for y, z in zip(x, w)) for x, w in zip(zip(*cached), zip(*flights))]
+        to_fetch = [x for (_, x), y in zip(batch, missing) if y]
+
+        # JPEG images are decoded at the largest size needed by the services
+        draft_sizes = [scheduler.model["preprocessing"].draft_size for _, _, scheduler, _ in targets]
+        draft_size = (max(x[0] for x in draft_sizes), max(x[1] for x in draft_sizes))
+
+        def observe(stage, seconds):
+            for _, service, _, _ in targets:
+                service["metrics"].observe(stage, seconds)
+
+        fetched = iter(self.fetcher.fetch(to_fetch, functools.partial(self.prepare_targets, targets), draft_size, observe))
+        images = []
+        started = [[] for _ in targets]
+        for j, ((_, url_image), fetch) in enumerate(zip(batch, missing)):
+            image = next(fetched) if fetch else None
+            for i in range(len(targets)):
+                if flights[i][j] is not None and flights[i][j][1]:
+                    started[i].append((flights[i][j][0], image, url_image))
+            # Only waited for by this request if a service predicts it outside of a flight
+            if not any(cached[i][j] is None and flights[i][j] is None for i in range(len(targets))):
+                image = None
+            images.append(image)
+        for i, (_, service, scheduler, _) in enumerate(targets):
+            self.start_flights(service, scheduler, started[i], index=i)
+        return batch, cached, images, flights
+
+    def wait_images(self, services, images):
+        loaded = []
+        for image in images:
+            try:
+                loaded.append(image.result() if image is not None else None)
+            except Exception as e:
+                # Failed inputs are answered 'Input is not correct' and counted by cause in the metrics
+                logger.exception("Loading an input image failed")
+                for service in services:
+                    service["metrics"].failure(e)
+                loaded.append(None)
+        return loaded
+
+    def submit_batch(self, service, scheduler, format_output, batch, cached, images, flights):
+        return self.submit_images(service, scheduler, format_output, batch, cached, self.wait_images([service], images), flights)
+
+    def submit_targets(self, targets, batch, cached, images, flights):
+        return self.submit_loaded(targets, batch, cached, self.wait_images([x[1] for x in targets], images), flights)
+
+    def submit_loaded(self, targets, batch, cached, images, flights):
+        # The images are queued in the batch scheduler of every service before waiting for any, the models run concurrently
+        submitted = []
+        for i, (_, service, scheduler, _) in enumerate(targets):
+            service_images = [x[i] if x is not None else None for x in images]
+            submitted.append(self.submit_images(service, scheduler, raw_prediction, batch, cached[i], service_images, flights[i]))
+        return submitted
+
+    def submit_images(self, service, scheduler, format_output, batch, cached, images, flights):
+        # Images are (cache key, cached prediction, preprocessed image), or None when they could not be loaded
+        # or when they are predicted by a flight
+        cache = service.get("cache")
+        id_pred_to_res = []
+        imgs = []
+        res = {}
+        waiting = []
+        for j, ((name, url_image), prediction, image, flight) in enumerate(zip(batch, cached, images, flights)):
+            res[j] = {"name": name, "predictions": 'Input is not correct'}
+            if prediction is not None:
+                res[j]['predictions'] = format_output(prediction)
+                continue
+
+            if flight is not None:
+                waiting.append((j, flight[0]))
+                continue
+
+            if image is None:
+                continue
+            key, prediction, img = image
+
+            # Same image already predicted under another url
+            if prediction is not None:
+                res[j]['predictions'] = format_output(prediction)
+                if cache.cache_urls and isinstance(url_image, str):
+                    cache.put(cache.url_key(service["model_name"], scheduler.top_k, url_image), prediction)
+                continue
+
+            imgs.append(img)
+            id_pred_to_res.append((j, key, url_image))
+
+        # Make predictions only for the images missing from the cache
+        try:
+            futures = scheduler.submit(imgs, request_deadline.get())
+        except RuntimeError:
+            raise falcon.HTTPNotFound(description="Service does not seem to exist")
+        return res, id_pred_to_res, futures, waiting
+
+    def wait_flight(self, service, flight):
+        # A failed flight fails the input of every request waiting for it
+        try:
+            return flight.result(timeout=remaining(request_deadline.get()))
+        except Exception as e:
+            if not flight.done():
+                raise falcon.HTTPGatewayTimeout(description="Deadline exceeded before the images were predicted")
+            service["metrics"].failure(e)
+            return None
+
+    def collect_batch(self, service, scheduler, format_output, res, id_pred_to_res, futures, waiting):
+        try:
+            predictions = [x.result() for x in futures]
+        except DeadlineExceeded:
+            raise falcon.HTTPGatewayTimeout(description="Deadline exceeded before the images were predicted")
+        flights = [self.wait_flight(service, x) for _, x in waiting]
+        return self.collect_predictions(service, scheduler, format_output, res, id_pred_to_res, predictions, waiting, flights)
+
+    def collect_predictions(self, service, scheduler, format_output, res, id_pred_to_res, predictions, waiting, flights):
+        # Predictions of the flights are already cached by the request which started them
+        for (j, _), prediction in zip(waiting, flights):
+            if prediction is not None:
+                res[j]['predictions'] = format_output(prediction)
+
+        cache = service.get("cache")
+        for (j, key, url_image), prediction in zip(id_pred_to_res, predictions):
+            res[j]['predictions'] = format_output(prediction)
+            if cache is not None:
+                cache.put(key, prediction)
+                if cache.cache_urls and isinstance(url_image, str):
+                    cache.put(cache.url_key(service["model_name"], scheduler.top_k, url_image), prediction)
+        return res
+
+    def collect_targets(self, targets, ensemble, *submitted):
+        return self.merge_targets(targets, ensemble, [self.collect_batch(service, scheduler, raw_prediction, *x) for (_, service, scheduler, _), x in zip(targets, submitted)])
+
+    def merge_targets(self, targets, ensemble, results):
+        # Predictions of each image by service, formatted once all of them are known
+        res = {}
+        for j in results[0]:
+            predictions = [x[j]["predictions"] for x in results]
+            res[j] = {"name": results[0][j]["name"], "predictions": {}}
+            for (name, _, _, format_output), prediction in zip(targets, predictions):
+                res[j]["predictions"][name] = format_output(prediction) if not isinstance(prediction, str) else prediction
+            if ensemble:
+                predicted = [x for x in predictions if not isinstance(x, str)]
+                res[j]["ensemble"] = targets[0][3](average_predictions(predicted)) if predicted else 'Input is not correct'
+        return res
+
+    def iter_pipeline(self, batches, fetch, submit, collect, lookahead=None):
+        # Each batch goes through fetching, prediction and collection. A batch is queued for prediction
+        # as soon as its images are ready while the next ones are still being fetched. With a lookahead
+        # only that many batches are fetched and predicted ahead of the one yielded, otherwise all of them are.
+        fetching = collections.deque()
+        predicting = collections.deque()
+        for batch in batches:
+            fetching.append(fetch(batch))
+            if lookahead is not None and len(fetching) > lookahead:
+                predicting.append(submit(*fetching.popleft()))
+            if lookahead is not None and len(predicting) > lookahead:
+                yield collect(*predicting.popleft())
+
+        while fetching:
+            predicting.append(submit(*fetching.popleft()))
+        while predicting:
+            yield collect(*predicting.popleft())
+
+    def iter_predictions(self, service, scheduler, format_output, names, urls_image, lookahead=None):
+        return self.iter_pipeline(
+            batchify(list(zip(names, urls_image)), scheduler.batch_size),
+            functools.partial(self.fetch_batch, service, scheduler),
+            functools.partial(self.submit_batch, service, scheduler, format_output),
+            functools.partial(self.collect_batch, service, scheduler, format_output),
+            lookahead
+        )
+
+    def iter_targets(self, targets, ensemble, names, urls_image, lookahead=None):
+        batch_size = max(x[2].batch_size for x in targets)
+        return self.iter_pipeline(
+            batchify(list(zip(names, urls_image)), batch_size),
+            functools.partial(self.fetch_targets, targets),
+            functools.partial(self.submit_targets, targets),
+            functools.partial(self.collect_targets, targets, ensemble),
+            lookahead
+        )
+
+    @contextlib.contextmanager
+    def request(self, services):
+        # Requests in flight and latency of every service of the request
+        with contextlib.ExitStack() as stack:
+            for service in services:
+                stack.enter_context(service["metrics"].request())
+            yield
+
+    def get_deadline(self, req):
+        # The deadline is given by the client as a number of milliseconds from now
+        value = req.get_header(deadline_header)
+        if value is None:
+            return None
+        try:
+            milliseconds = float(value)
+        except ValueError:
+            milliseconds = None
+        # nan and inf would give deadlines never passing
+        if milliseconds is None or not math.isfinite(milliseconds) or milliseconds <= 0:
+            raise falcon.HTTPBadRequest({"code": 400, "name": "Bad request"}, "{} must be a positive number of milliseconds".format(deadline_header))
+        return time.monotonic() + milliseconds / 1000
+
+    def admission_controls(self, targets):
+        # The worker limit first, then the ones of the services (in the order of their names to avoid deadlocks)
+        controls = [(self.services.admission, "worker")]
+        for name, service, _, _ in sorted(targets, key=lambda x: x[0]):
+            if "admission" in service:
+                controls.append((service["admission"], name))
+        return controls
+
+    def check_admission(self, targets):
+        # Streamed requests are only rejected when a queue is already full, their slots are taken by the stream
+        for control, name in self.admission_controls(targets):
+            stats = control.stats()
+            if stats["max_concurrency"] is not None and stats["running"] >= stats["max_concurrency"] and stats["waiting"] >= stats["max_queue"]:
+                self.reject(control, name, Overloaded(control.retry_after()))
+
+    def reject(self, control, name, e):
+        if isinstance(e, DeadlineExceeded):
+            raise falcon.HTTPGatewayTimeout(description="Deadline exceeded while waiting for {}".format("the worker" if name == "worker" else "service {}".format(name)))
+        if name == "worker":
+            raise falcon.HTTPServiceUnavailable(description="The worker is overloaded", retry_after=e.retry_after)
+        raise falcon.HTTPTooManyRequests(description="Too many requests for service {}".format(name), retry_after=e.retry_after)
+
+    @contextlib.contextmanager
+    def admit(self, targets, deadline=None):
+        with contextlib.ExitStack() as stack:
+            for control, name in self.admission_controls(targets):
+                try:
+                    stack.enter_context(control.slot(deadline))
+                except (Overloaded, DeadlineExceeded) as e:
+                    self.reject(control, name, e)
+            yield
+
+    def stream(self, targets, predictions, mode, deadline=None):
+        # One json line per batch or per image, an error stops the stream with a last line describing it
+        with self.request([x[1] for x in targets]):
+            try:
+                with self.admit(targets, deadline):
+                    for i, res in enumerate(predictions):
+                        if mode == "batch":
+                            yield dumps_json({"batch": i, "predictions": res}) + b"\n"
+                        else:
+                            for j, prediction in res.items():
+                                yield dumps_json({"batch": i, "index": j, **prediction}) + b"\n"
+            except falcon.HTTPError as e:
+                yield dumps_json({"title": e.title, "description": e.description}) + b"\n"
+
+    def loading_service(self, service_name):
+        # The service if it is still loading, None if it is ready
+        service = self.services.models_online.get(service_name)
+        if service is None:
+            raise falcon.HTTPNotFound(description="Service does not seem to exist")
+        return None if service["loaded"].done() else service
+
+    def check_ready(self, service_name, deadline=None):
+        service = self.services.models_online.get(service_name)
+        if service is None:
+            raise falcon.HTTPNotFound(description="Service does not seem to exist")
+        if service["state"] == "failed":
+            raise falcon.HTTPServiceUnavailable(description="Service {} failed to load: {}".format(service_name, service["error"]))
+        if service["state"] != "ready":
+            if deadline is not None:
+                raise falcon.HTTPGatewayTimeout(description="Deadline exceeded while service {} is loading".format(service_name))
+            raise falcon.HTTPServiceUnavailable(description="Service {} is loading".format(service_name), retry_after=1)
+
+    def wait_ready(self, service_names, deadline=None, wait=loading_wait):
+        # Services still loading are waited for until the deadline of the request, or for wait seconds without one
+        for service_name in service_names:
+            service = self.loading_service(service_name)
+            if service is not None:
+                try:
+                    service["loaded"].result(timeout=remaining(deadline) if deadline is not None else wait)
+                except TimeoutError:
+                    pass
+            self.check_ready(service_name, deadline)
+
+    def get_service(self, service_name):
+        # Check if service exists
+        self.check_ready(service_name)
+        try:
+            service = self.services.models_online[service_name]
+            predict = self.embed if service.get("mode") == "embedding" else self.predict
+            scheduler = self.services.get_scheduler(service_name, predict)
+        except KeyError:
+            raise falcon.HTTPNotFound(description="Service does not seem to exist")
+        return service, scheduler
+
+    def get_targets(self, service_names, output, ensemble=False):
+        # (name, service, scheduler, formatter of its predictions) of each service of the request
+        targets = []
+        for service_name in service_names:
+            service, scheduler = self.get_service(service_name)
+            formatter = format_embedding if service.get("mode") == "embedding" else format_prediction
+            targets.append((service_name, service, scheduler, functools.partial(formatter, output=output, mapping=scheduler.model["mapping"])))
+
+        if ensemble:
+            if any(x[1].get("mode") == "embedding" for x in targets):
+                raise falcon.HTTPBadRequest({"code": 400, "name": "Bad request"}, "ensemble is only possible with classification services.")
+            if any(x[2].model["mapping"] != targets[0][2].model["mapping"] for x in targets):
+                raise falcon.HTTPBadRequest({"code": 400, "name": "Bad request"}, "ensemble is only possible with services predicting the same classes.")
+        return targets
+
+    def iter_request(self, json_input, names, targets, lookahead=None):
+        # Several services predict the same images with a single download and decoding of each of them
+        if isinstance(json_input["service_name"], list):
+            return self.iter_targets(targets, json_input.get("ensemble", False), names, json_input["data"], lookahead)
+        _, service, scheduler, format_output = targets[0]
+        return self.iter_predictions(service, scheduler, format_output, names, json_input["data"], lookahead)
+
+    def on_post(self, req, resp):
+        deadline = self.get_deadline(req)
+        json_input, names = self.validate_json_input(req)
+        # Parse json (data are urls, local paths or raw images)
+        service_names = json_input["service_name"] if isinstance(json_input["service_name"], list) else [json_input["service_name"]]
+        stream = json_input.get("stream")
+
+        self.wait_ready(service_names, deadline)
+        targets = self.get_targets(service_names, json_input.get("output", "dict"), json_input.get("ensemble", False))
+        services = [x[1] for x in targets]
+        # Images still waiting for their batch when the deadline passes are not predicted
+        request_deadline.set(deadline)
+
+        # Results are sent as soon as they are ready, only a few batches are in memory at the same time
+        if stream is not None:
+            self.check_admission(targets)
+            predictions = self.iter_request(json_input, names, targets, lookahead=stream_lookahead)
+            resp.stream = self.stream(targets, predictions, stream, deadline)
+            resp.content_type = "application/x-ndjson"
+            resp.status = falcon.HTTP_201
+            return
+
+        with self.request(services), self.admit(targets, deadline):
+            predictions = list(self.iter_request(json_input, names, targets))
+            start = time.perf_counter()
+            serialize(req, resp, {"title": {"code": 200, "name": "Success"}, "description": predictions})
+            for service in services:
+                service["metrics"].observe("serialization", time.perf_counter() - start)
+        resp.status = falcon.HTTP_201
+
+
+# Bulk scoring: a job is submitted with its inputs and run in the background, its results are written in a jsonl file
+class SubmitJob(Origin):
+    def __init__(self, services, jobs):
+        Origin.__init__(self)
+        self.services = services
+        self.jobs = jobs
+        self.methods_allowed = ["GET", "POST"]
+
+    def validate_json_input(self, req):
         try:
             json_input = json.load(req.bounded_stream)
         except json.decoder.JSONDecodeError:
             raise falcon.HTTPBadRequest({"code": 400, "name": "Bad request"}, "Json seems malformed")
 
+        return self.check_input(json_input)
+
+    def check_input(self, json_input):
+        call_params = {
+            "service_name": {
+                "name": "service_name",
+                "type": str,
+                "mandatory": True,
+                "messages": {"none": "Please specify a service_name.", "type": "service_name must be a string."}
+            },
+            "data": {
+                "name": "data",
+                "type": list,
+                "mandatory": False,
+                "specific_check": {"array_strings": lambda x: all([isinstance(y, str) for y in x])},
+                "messages": {"none": "Please specify the field data.", "type": "data must be an array of strings."}
+            },
+            "directory": {
+                "name": "directory",
+                "type": str,
+                "mandatory": False,
+                "messages": {"none": "Please specify the directory.", "type": "directory must be the path of a directory of images."}
+            },
+            "glob": {
+                "name": "glob",
+                "type": str,
+                "mandatory": False,
+                "messages": {"none": "Please specify the glob.", "type": "glob must be a pattern of paths of images."}
+            },
+            "output": {
+                "name": "output",
+                "type": str,
+                "mandatory": False,
+                "enum": output_formats,
+                "messages": {"none": "Please specify the output format.", "type": "output must be a string between the following {}.".format(output_formats)}
+            }
+        }
+
+        if not isinstance(json_input, dict):
+            raise falcon.HTTPBadRequest({"code": 400, "name": "Bad request"}, "Input must be an object")
+
         success, message = check_json(json_input, call_params)
         if not success:
             raise falcon.HTTPBadRequest({"code": 400, "name": "Bad request"}, message)
@@ -240,80 +1217,102 @@ class Predict(Origin):
             msg = "{} are the only possible inputs.".format(fields_needed)
             raise falcon.HTTPBadRequest({"code": 400, "name": "Bad request"}, msg)
 
+        if len([x for x in ["data", "directory", "glob"] if x in json_input]) != 1:
+            raise falcon.HTTPBadRequest({"code": 400, "name": "Bad request"}, "Please specify one of data, directory or glob.")
+
         return json_input
 
-    def predict(self, model, input, top_k=-1):
-        # create mini batch
-        input_batch = tuple(model['preprocessing'](x).unsqueeze(0) for x in input)
-        input_batch = torch.cat(input_batch, 0)
-
-        # Make prediction
-        output = model['model'](input_batch)
-
-        # Make postprocessing
-        predictions = [model['postprocessing'](output[x,:]) for x in range(output.shape[0])]
-
-        # Sort prediction and get top wanted
-        res = []
-        if top_k == -1:
-            top_k = predictions[0].shape[0]
-        for pred in predictions:
-            topk_val, topk_indices = torch.topk(pred, top_k)
-            if model["mapping"] is None:
-                res.append({x.item(): y.item() for x, y in zip(topk_indices, topk_val)})
-            else:
-                res.append({
-                    model["mapping"][x.item()]: y.item() for x, y in zip(topk_indices, topk_val)
-                })
+    def list_inputs(self, json_input):
+        # Paths of a directory or a glob are sorted so that the order of the results does not change when resumed
+        if "data" in json_input:
+            inputs = json_input["data"]
+        elif "directory" in json_input:
+            if not os.path.isdir(json_input["directory"]):
+                raise falcon.HTTPBadRequest({"code": 400, "name": "Bad request"}, "{} is not a directory".format(json_input["directory"]))
+            directory = os.path.abspath(json_input["directory"])
+            inputs = sorted(x.path for x in os.scandir(directory) if x.is_file())
+        else:
+            inputs = sorted(os.path.abspath(x) for x in glob(json_input["glob"], recursive=True) if os.path.isfile(x))
 
-        return res
+        if len(inputs) == 0:
+            raise falcon.HTTPBadRequest({"code": 400, "name": "Bad request"}, "No inputs to predict")
+        return inputs
+
+    def submit(self, json_input):
+        if json_input["service_name"] not in self.services.models_online:
+            raise falcon.HTTPNotFound(description="Service does not seem to exist")
+        return self.jobs.submit(json_input["service_name"], self.list_inputs(json_input), json_input.get("output", "dict"))
+
+    def on_get(self, req, resp):
+        resp.body = json.dumps({"title": {"code": 200, "name": "Success"}, "description": self.jobs.list()}, ensure_ascii=False)
+        resp.content_type = falcon.MEDIA_JSON
+        resp.status = falcon.HTTP_200
 
     def on_post(self, req, resp):
-        json_input = self.validate_json_input(req)
-        # Parse json
-        service_name = json_input["service_name"]
-        urls_image = json_input["data"]
+        job = self.submit(self.validate_json_input(req))
+        resp.body = json.dumps({"title": {"code": 202, "name": "Accepted"}, "description": job}, ensure_ascii=False)
+        resp.content_type = falcon.MEDIA_JSON
+        resp.status = falcon.HTTP_202
 
-        # Check if service exists
-        if service_name not in self.services.models_online:
-            raise falcon.HTTPNotFound(description="Service does not seem to exist")
-        else:
-            model = self.services.models_online[service_name]['model']
-            batch_size = self.services.models_online[service_name].get("batch_size", 1)
-            top_k = self.services.models_online[service_name].get("top_k", -1)
-            predictions = []
-            for batch in batchify(urls_image, batch_size):
-                i = 0
-                id_pred_to_res = {}
-                imgs = []
-                res = {}
-                for j, url_image in enumerate(batch):
-                    res[j] = {"name": url_image, "predictions": 'Input is not correct'}
-                    try:
-                        # Local url
-                        if url_image[0] == '/':
-                            img = Image.open(url_image)
-                        # External url
-                        else:
-                            response = requests.get(url_image)
-                            img = Image.open(BytesIO(response.content))
 
-                        imgs.append(img)
-                        id_pred_to_res[i] = j
-                        i += 1
-                    except Exception:
-                        # TODO add logging
-                        pass
+class ManageJob(Origin):
+    def __init__(self, jobs):
+        Origin.__init__(self)
+        self.jobs = jobs
+        self.methods_allowed = ["GET", "PUT", "DELETE"]
 
-                # Make predictions
-                if len(imgs) > 0:
-                    prediction = self.predict(model, imgs, top_k=top_k)
+    def get_job(self, job_id):
+        if not self.jobs.exists(job_id):
+            raise falcon.HTTPNotFound(description="Job does not seem to exist")
+        return self.jobs.read(job_id)
 
-                    # Format output
-                    for j, pred in enumerate(prediction):
-                        res[id_pred_to_res[j]]['predictions'] = pred
+    def resume(self, job_id):
+        job = self.get_job(job_id)
+        if job["state"] in ["running", "done"]:
+            raise falcon.HTTPConflict(description="Job is already {}".format(job["state"]))
+        return self.jobs.resume(job_id)
+
+    # Progress of the job
+    def on_get(self, req, resp, job_id):
+        resp.body = json.dumps({"title": {"code": 200, "name": "Success"}, "description": self.get_job(job_id)}, ensure_ascii=False)
+        resp.content_type = falcon.MEDIA_JSON
+        resp.status = falcon.HTTP_200
 
-                predictions.append(res)
+    # Resume a failed or cancelled job from its checkpoint
+    def on_put(self, req, resp, job_id):
+        resp.body = json.dumps({"title": {"code": 202, "name": "Accepted"}, "description": self.resume(job_id)}, ensure_ascii=False)
+        resp.content_type = falcon.MEDIA_JSON
+        resp.status = falcon.HTTP_202
 
-            resp.body = json.dumps({"title": {"code": 200, "name": "Success"}, "description": predictions}, ensure_ascii=False)
-            resp.status = falcon.HTTP_201
+    def on_delete(self, req, resp, job_id):
+        self.get_job(job_id)
+        resp.body = json.dumps({"title": {"code": 200, "name": "Success"}, "description": self.jobs.cancel(job_id)}, ensure_ascii=False)
+        resp.content_type = falcon.MEDIA_JSON
+        resp.status = falcon.HTTP_200
+
+
+class JobResults(Origin):
+    def __init__(self, jobs):
+        Origin.__init__(self)
+        self.jobs = jobs
+        self.methods_allowed = ["GET"]
+
+    # One json line per input predicted so far, in the order of the inputs
+    def on_get(self, req, resp, job_id):
+        if not self.jobs.exists(job_id):
+            raise falcon.HTTPNotFound(description="Job does not seem to exist")
+        path = self.jobs.path(job_id, "results.jsonl")
+        if os.path.exists(path):
+            resp.set_stream(open(path, "rb"), os.path.getsize(path))
+        else:
+            resp.body = ""
+        resp.content_type = "application/x-ndjson"
+        resp.status = falcon.HTTP_200
+
+
+class StartJobs(object):
+    def __init__(self, jobs):
+        self.jobs = jobs
+
+    def process_request(self, req, resp):
+        self.jobs.start()
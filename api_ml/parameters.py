@@ -1,37 +1,84 @@
-models_available = [
-    "densenet121",
-    "densenet169",
-    "densenet201",
-    "densenet161",
-    "googlenet",
-    "alexnet",
-    "inception_v3",
-    "mnasnet0_5",
-    "mnasnet0_75",
-    "mnasnet1_0",
-    "mnasnet1_3",
-    "mobilenet_v2",
-    'resnet18',
-    'resnet34',
-    'resnet50',
-    'resnet101',
-    'resnet152',
-    'resnext50_32x4d',
-    'resnext101_32x8d',
-    'wide_resnet50_2',
-    'wide_resnet101_2',
-    "shufflenetv2_x2.0",
-    "shufflenetv2_x1.5",
-    "shufflenet_v2_x1_0",
-    "shufflenetv2_x0.5",
-    "squeezenet1_0",
-    "squeezenet1_1",
-    "vgg11",
-    "vgg13",
-    "vgg16",
-    "vgg19",
-    "vgg11_bn",
-    "vgg13_bn",
-    "vgg16_bn",
-    "vgg19_bn"
-]
+from api_ml.models.registry import architectures
+
+models_available = list(architectures)
+
+# Default time (in ms) a batch waits for images from concurrent requests before running
+batching_max_wait_ms = 5
+
+# Download and decoding of the images given to /predict
+fetch_max_workers = 16
+fetch_timeout = 10
+fetch_max_size = 20 * 1024 * 1024
+# Bodies of /predict (holding the raw images given in msgpack) larger than max_body_size bytes are answered 413
+max_body_size = 100 * 1024 * 1024
+# Connections opened at the same time by the asgi app to download images
+fetch_max_connections = 100
+
+# Batches fetched and predicted ahead of the one being sent by a streamed /predict
+stream_lookahead = 2
+
+# Bulk scoring jobs (/jobs) are kept in jobs_dir (API_ML_JOBS_DIR), a directory shared by the workers of a server. It
+# must be set for the jobs to be resumed after a restart and to be shared by workers not forked by gunicorn --preload,
+# by default each server has its own temporary directory.
+# At most jobs_max_workers jobs run at the same time, each one downloading its images with jobs_fetch_workers threads
+# and with jobs_lookahead batches ahead of the one written. Their progress is saved every jobs_checkpoint_interval seconds.
+jobs_dir = None
+jobs_max_workers = 1
+jobs_fetch_workers = 8
+jobs_lookahead = 4
+jobs_checkpoint_interval = 1
+
+# Threads of the asgi app creating and deleting services out of the event loop
+services_max_workers = 2
+
+# Threads of each worker loading (and warming up) the models of the services created by /create. A /predict of a
+# service still loading waits until the deadline of the request, or for loading_wait seconds without deadline (0 to
+# answer 503 at once)
+loader_max_workers = 2
+loading_wait = 0
+
+# Admission control: requests processed at the same time by a worker (API_ML_MAX_REQUESTS, None for no limit),
+# the others are answered 503. The limits of each service are given on /create (max_concurrency, max_queue).
+max_requests = None
+# Forward passes run at the same time by a worker (API_ML_COMPUTE_SLOTS, None for no limit), the waiting ones are
+# ordered by the priority of their service (weighted fair sharing of the time spent computing). Without limit the
+# forward passes of the services share the cpus and a small model is not delayed by the batch of a large one.
+compute_slots = None
+# Header giving the time (in ms) after which the client will not read the response anymore
+deadline_header = "X-Deadline-Ms"
+
+# Threads used by torch, by default the cpus are divided between the gunicorn workers (WEB_CONCURRENCY)
+intra_op_threads = None
+inter_op_threads = 1
+
+# Services give the class probabilities or the embeddings (pooled features before the classification layer)
+modes = ["classification", "embedding"]
+
+# Conversions that can be applied to a model when creating a service
+compile_modes = ["script", "trace+freeze", "optimize_for_inference"]
+
+# Precisions in which a model can be served. The int8-static calibration and the accuracy drift check
+# use the images of calibration_dir (API_ML_CALIBRATION_DIR), or fixed generated images if it is not set
+precisions = ["fp32", "bf16", "int8-dynamic", "int8-static"]
+calibration_dir = None
+calibration_size = 8
+
+# Directory where ready to serve models are saved to speed up the next loads (API_ML_ARTIFACTS_DIR)
+artifacts_dir = None
+
+# Directory shared by the workers of a server (API_ML_SHARED_DIR): the services created or deleted by a worker
+# are applied by the others and the weights are memory mapped from the artifacts (in shared_dir/artifacts by
+# default) so that the workers share one copy of them
+shared_dir = None
+
+# Residency of the models: the services idle for idle_timeout seconds (API_ML_IDLE_TIMEOUT) and the least recently
+# used ones while the weights of a worker are over memory_budget_mb (API_ML_MEMORY_BUDGET_MB) are parked, None for no
+# limit. The weights of a parked service are saved in offload_dir (API_ML_OFFLOAD_DIR, a temporary directory by
+# default, or the artifacts) and reloaded by its next prediction. The services are checked every residency_interval seconds.
+memory_budget_mb = None
+idle_timeout = None
+offload_dir = None
+residency_interval = 5
+
+# Json file listing the services (bodies of /create) restored when the api starts (API_ML_MANIFEST)
+manifest = None
@@ -0,0 +1,73 @@
+import logging
+import os
+import threading
+import time
+from collections import defaultdict
+
+from api_ml.parameters import residency_interval
+
+logger = logging.getLogger(__name__)
+
+
+# Parks the services idle for idle_timeout seconds and, while the weights of the worker are over memory_budget
+# (in bytes), the least recently used ones. The weights are only freed with the last service using them: the
+# services sharing a model are parked together and never while one of them is predicting.
+class ResidencyManager(object):
+    def __init__(self, services, memory_budget=None, idle_timeout=None, interval=residency_interval):
+        self.services = services
+        self.memory_budget = memory_budget
+        self.idle_timeout = idle_timeout
+        self.interval = interval
+        self.event = threading.Event()
+        self.pid = None
+
+    def start(self):
+        # Started again in each worker forked by gunicorn --preload
+        if self.pid != os.getpid():
+            self.pid = os.getpid()
+            threading.Thread(target=self.run, daemon=True).start()
+
+    def wake(self):
+        # Checked at once after a service is created or reloaded
+        self.event.set()
+
+    def run(self):
+        while True:
+            self.event.wait(self.interval)
+            self.event.clear()
+            try:
+                self.check()
+            except Exception:
+                # The services are checked again on the next interval
+                logger.exception("Checking the residency of the services failed")
+
+    def check(self):
+        now = time.monotonic()
+        models = defaultdict(list)
+        for name, service in list(self.services.models_online.items()):
+            if service["state"] == "ready" and service["residency"]["state"] == "resident":
+                models[self.services.model_key(service)].append((self.services.last_used(service), name, service))
+
+        for key, group in list(models.items()):
+            if any(self.services.busy(x[2]) for x in group):
+                del models[key]
+                continue
+            if self.idle_timeout is not None:
+                for last_used, name, _ in group:
+                    if now - last_used > self.idle_timeout:
+                        self.services.park(name)
+
+        if self.memory_budget is None:
+            return
+        for key, group in sorted(models.items(), key=lambda x: max(y[0] for y in x[1])):
+            if self.services.store.resident_memory() <= self.memory_budget:
+                return
+            for _, name, _ in group:
+                self.services.park(name)
+
+    def stats(self):
+        return {
+            "memory_budget": self.memory_budget,
+            "idle_timeout": self.idle_timeout,
+            "resident_memory": self.services.store.resident_memory()
+        }
@@ -0,0 +1,76 @@
+import base64
+import json
+import struct
+
+import falcon
+import msgpack
+
+# orjson (in requirements.txt) encodes the responses faster, the standard json module is used when it is not installed
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Formats of the predictions of an image: a dict {class: score}, parallel indices and scores arrays,
+# or these arrays packed as little endian int32 indices and float32 / float16 scores
+output_formats = ["dict", "columns", "packed_float32", "packed_float16"]
+
+# Streamed /predict responses send one ndjson line per batch or per image
+stream_modes = ["batch", "image"]
+
+
+def format_prediction(prediction, output="dict", mapping=None):
+    indices, scores = prediction
+    if output in ["packed_float32", "packed_float16"]:
+        dtype = "e" if output == "packed_float16" else "f"
+        return {
+            "indices": struct.pack("<{}i".format(len(indices)), *indices),
+            "scores": struct.pack("<{}{}".format(len(scores), dtype), *scores)
+        }
+
+    if mapping is not None:
+        indices = [mapping[x] for x in indices]
+    if output == "columns":
+        return {"indices": indices, "scores": scores}
+    return dict(zip(indices, scores))
+
+
+def format_embedding(embedding, output="dict", mapping=None):
+    # Embeddings are float32 vectors, given as lists or packed as little endian float32 / float16
+    if output == "packed_float16":
+        return embedding.half().numpy().tobytes()
+    if output == "packed_float32":
+        return embedding.numpy().tobytes()
+    return embedding.tolist()
+
+
+def encode_bytes(x):
+    # Packed arrays are sent as base64 strings in json
+    if isinstance(x, bytes):
+        return base64.b64encode(x).decode()
+    raise TypeError("{} is not serializable".format(type(x)))
+
+
+def dumps_json(body):
+    if orjson is not None:
+        return orjson.dumps(body, default=encode_bytes, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(body, default=encode_bytes, ensure_ascii=False).encode()
+
+
+def str_keys(x):
+    # Keys of the maps are strings in msgpack too (classes without mapping are int indices), as in json
+    if isinstance(x, dict):
+        return {str(k): str_keys(v) for k, v in x.items()}
+    if isinstance(x, list):
+        return [str_keys(y) for y in x]
+    return x
+
+
+def serialize(req, resp, body):
+    # Content negotiation on the Accept header, json wins ties (the last preferred type is kept on ties)
+    if req.client_prefers([falcon.MEDIA_MSGPACK, falcon.MEDIA_JSON]) == falcon.MEDIA_MSGPACK:
+        resp.data = msgpack.packb(str_keys(body), use_bin_type=True)
+        resp.content_type = falcon.MEDIA_MSGPACK
+    else:
+        resp.data = dumps_json(body)
+        resp.content_type = falcon.MEDIA_JSON
@@ -1,34 +1,269 @@
-from api_ml.parameters import models_available
+import functools
+import logging
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import nullcontext
+
+from api_ml.admission import AdmissionControl, ComputeGate
+from api_ml.batching import BatchScheduler
+from api_ml.cache import PredictionCache
+from api_ml.coalescing import SingleFlight
+from api_ml.metrics import ServiceMetrics
+from api_ml.shared import SharedServices
+from api_ml import parameters
+from api_ml.parameters import models_available, batching_max_wait_ms, loader_max_workers
+from api_ml.residency import ResidencyManager
+from api_ml.store import ModelStore
+from api_ml.threads import configure_threads
+
+logger = logging.getLogger(__name__)
 
 
 class Services(object):
     def __init__(self):
         self.models_available = models_available
         self.models_online = {}
+        shared_dir = os.environ.get("API_ML_SHARED_DIR", parameters.shared_dir)
+        artifacts_dir = os.environ.get("API_ML_ARTIFACTS_DIR", parameters.artifacts_dir)
+        if artifacts_dir is None and shared_dir is not None:
+            artifacts_dir = os.path.join(shared_dir, "artifacts")
+
+        memory_budget = os.environ.get("API_ML_MEMORY_BUDGET_MB", parameters.memory_budget_mb)
+        idle_timeout = os.environ.get("API_ML_IDLE_TIMEOUT", parameters.idle_timeout)
+        offload_dir = os.environ.get("API_ML_OFFLOAD_DIR", parameters.offload_dir)
+        if offload_dir is None and (memory_budget is not None or idle_timeout is not None):
+            offload_dir = tempfile.mkdtemp(prefix="api_ml_offload_")
+        self.store = ModelStore(artifacts_dir, mmap_weights=shared_dir is not None, offload_dir=offload_dir)
+        self.residency = None
+        if memory_budget is not None or idle_timeout is not None:
+            self.residency = ResidencyManager(
+                self,
+                memory_budget=float(memory_budget) * 1024 * 1024 if memory_budget is not None else None,
+                idle_timeout=float(idle_timeout) if idle_timeout is not None else None
+            )
+        self.shared = SharedServices(shared_dir) if shared_dir is not None else None
+        self.threads = configure_threads()
+        # Every change of models_online is made under the lock
+        self.lock = threading.Lock()
+        self.loader_pool = None
+        self.loader_pid = None
+
+        max_requests = os.environ.get("API_ML_MAX_REQUESTS", parameters.max_requests)
+        self.admission = AdmissionControl(int(max_requests) if max_requests is not None else None)
+        compute_slots = os.environ.get("API_ML_COMPUTE_SLOTS", parameters.compute_slots)
+        self.gate = ComputeGate(int(compute_slots)) if compute_slots is not None else None
+
+        # Keys of a service that are internal objects and must not be displayed
+        self.private_keys = ["model", "scheduler", "cache", "metrics", "admission", "last_used", "loaded", "flights"]
 
-    def create_service(self, model_infos, model):
+    def loader(self):
+        # Threads loading the models of the services created, started again in each worker forked by gunicorn --preload
+        with self.lock:
+            if self.loader_pid != os.getpid():
+                self.loader_pid = os.getpid()
+                self.loader_pool = ThreadPoolExecutor(max_workers=loader_max_workers, thread_name_prefix="loader")
+            return self.loader_pool
+
+    def create_service(self, model_infos):
+        # The service is online at once in the loading state, its model is given by set_state once loaded
         name = model_infos["service_name"]
         type_data = model_infos["type"]
-        if name not in self.models_online:
+        with self.lock:
+            if name in self.models_online:
+                # Service already existing
+                return False
             self.models_online[name] = {
                 "model_name": model_infos["model_name"],
-                "model": model,
-                "type": type_data
+                "model": None,
+                "type": type_data,
+                "state": "loading",
+                "timing": {"load_s": None, "warm_up_s": None},
+                "metrics": ServiceMetrics(),
+                "residency": {"state": "resident", "parks": 0, "reloads": 0, "last_reload_s": None},
+                "last_used": time.monotonic(),
+                # Set when the service is ready or failed
+                "loaded": Future()
             }
 
             if "batch_size" in model_infos:
                 self.models_online[name]['batch_size'] = model_infos['batch_size']
             if "top_k" in model_infos:
                 self.models_online[name]['top_k'] = model_infos['top_k']
-            return True
-        else:
-            # Service already existing
-            return False
+            if "max_wait_ms" in model_infos:
+                self.models_online[name]['max_wait_ms'] = model_infos['max_wait_ms']
+            if "precision" in model_infos:
+                self.models_online[name]['precision'] = model_infos['precision']
+            if "compile" in model_infos:
+                self.models_online[name]['compile'] = model_infos['compile']
+            if "mode" in model_infos:
+                self.models_online[name]['mode'] = model_infos['mode']
+            if "normalize" in model_infos:
+                self.models_online[name]['normalize'] = model_infos['normalize']
+            if "pca" in model_infos:
+                self.models_online[name]['pca'] = model_infos['pca']
+            if "intra_op_threads" in model_infos:
+                self.models_online[name]['intra_op_threads'] = model_infos['intra_op_threads']
+            if "priority" in model_infos:
+                self.models_online[name]['priority'] = model_infos['priority']
+            if "max_concurrency" in model_infos:
+                self.models_online[name]['max_concurrency'] = model_infos['max_concurrency']
+                self.models_online[name]['max_queue'] = model_infos.get('max_queue', 0)
+                self.models_online[name]['admission'] = AdmissionControl(model_infos['max_concurrency'], model_infos.get('max_queue', 0))
+            if "coalesce" in model_infos:
+                self.models_online[name]['coalesce'] = model_infos['coalesce']
+            if model_infos.get("coalesce", True):
+                self.models_online[name]['flights'] = SingleFlight()
+            if "cache_size" in model_infos:
+                self.models_online[name]['cache'] = PredictionCache(
+                    model_infos['cache_size'],
+                    ttl=model_infos.get('cache_ttl'),
+                    cache_urls=model_infos.get('cache_urls', False)
+                )
+            return self.models_online[name]
 
     def delete_service(self, name):
-        if name not in self.models_online:
-            # Service does not exist
-            return False
-        else:
-            del self.models_online[name]
-            return True
+        with self.lock:
+            service = self.models_online.pop(name, None)
+            if service is None:
+                # Service does not exist
+                return False
+            # The model of a service still loading is released by its loader
+            loaded = service["state"] in ["warming", "ready"]
+            if not service["loaded"].done():
+                service["loaded"].set_result(None)
+
+        # Images still queued are predicted (and a parked service reloaded) before its model is released
+        if "scheduler" in service:
+            service["scheduler"].stop()
+        if loaded and service["residency"]["state"] == "resident":
+            self.store.release(service["model_name"], service.get("precision"), service.get("compile"), service.get("mode"))
+        return True
+
+    def set_state(self, name, service, state, model=None, error=None, **timing):
+        # False when the service was deleted meanwhile
+        with self.lock:
+            if self.models_online.get(name) is not service:
+                return False
+            if model is not None:
+                service["model"] = model
+            service["state"] = state
+            service["timing"].update(timing)
+            if error is not None:
+                service["error"] = error
+            if state == "ready":
+                # Idle from now on, not from its creation (the loading can take longer than idle_timeout)
+                service["last_used"] = time.monotonic()
+            if state in ["ready", "failed"]:
+                service["loaded"].set_result(None)
+        if state == "ready" and self.residency is not None:
+            self.residency.start()
+            self.residency.wake()
+        return True
+
+    def get_scheduler(self, name, predict):
+        # Schedulers are started on the first prediction of a service
+        with self.lock:
+            service = self.models_online[name]
+            service["last_used"] = time.monotonic()
+            if "scheduler" not in service:
+                service["scheduler"] = BatchScheduler(
+                    service["model"],
+                    predict,
+                    batch_size=service.get("batch_size", 1),
+                    top_k=service.get("top_k", -1),
+                    max_wait=service.get("max_wait_ms", batching_max_wait_ms) / 1000,
+                    num_threads=service.get("intra_op_threads", self.threads["intra_op_threads"]),
+                    observe=service["metrics"].observe,
+                    gate=functools.partial(self.gate.slot, name, service.get("priority", 1)) if self.gate is not None else None,
+                    loader=functools.partial(self.reload, service)
+                )
+        if self.residency is not None:
+            self.residency.start()
+        return service["scheduler"]
+
+    def model_key(self, service):
+        return self.store.key(service["model_name"], service.get("precision"), service.get("compile"), service.get("mode"))
+
+    def last_used(self, service):
+        scheduler = service.get("scheduler")
+        return max(service["last_used"], scheduler.last_used if scheduler is not None else 0)
+
+    def busy(self, service):
+        scheduler = service.get("scheduler")
+        return service["metrics"].snapshot()["in_flight"] > 0 or (scheduler is not None and scheduler.queue.qsize() > 0)
+
+    def park(self, name):
+        # The weights of the service are saved on disk and released, it keeps its preprocessing and mapping
+        # (model["model"] is None) and its scheduler reloads them for its next batch
+        with self.lock:
+            service = self.models_online.get(name)
+            if service is None or service["state"] != "ready" or service["residency"]["state"] != "resident":
+                return False
+            scheduler = service.get("scheduler")
+
+        with scheduler.model_lock if scheduler is not None else nullcontext():
+            try:
+                self.store.offload(service["model_name"], service.get("precision"), service.get("compile"), service.get("mode"))
+            except Exception as e:
+                # The service stays resident
+                logger.exception("Offloading the model of %s failed", name)
+                with self.lock:
+                    service["residency"]["error"] = "{}: {}".format(type(e).__name__, e)
+                return False
+            with self.lock:
+                # Deleted, or given a scheduler, meanwhile
+                if self.models_online.get(name) is not service or service.get("scheduler") is not scheduler:
+                    return False
+                service["model"] = dict(service["model"], model=None)
+                if scheduler is not None:
+                    scheduler.model = service["model"]
+                service["residency"]["state"] = "parked"
+                service["residency"]["parks"] += 1
+                service["residency"].pop("error", None)
+        self.store.release(service["model_name"], service.get("precision"), service.get("compile"), service.get("mode"))
+        return True
+
+    def reload(self, service):
+        # Run by the scheduler of a parked service before its next batch
+        start = time.perf_counter()
+        model = self.store.acquire(service["model_name"], service.get("precision"), service.get("compile"), service.get("batch_size", 1), service.get("mode"))
+        if model is False:
+            raise RuntimeError("The model {} cannot be reloaded".format(service["model_name"]))
+        seconds = time.perf_counter() - start
+
+        with self.lock:
+            # Preprocessing and postprocessing of the service (embedding services have their own) are kept
+            service["model"] = dict(service["model"], model=model["model"])
+            service["residency"]["state"] = "resident"
+            service["residency"]["reloads"] += 1
+            service["residency"]["last_reload_s"] = seconds
+        service["metrics"].observe("reload", seconds)
+        if self.residency is not None:
+            self.residency.wake()
+        return service["model"]
+
+    def describe_services(self):
+        with self.lock:
+            return [{x: self.describe_service(x)} for x in self.models_online]
+
+    def describe_service(self, name):
+        service = self.models_online[name]
+        infos = {x: service[x] for x in service if x not in self.private_keys}
+        infos["residency"] = dict(service["residency"], idle_s=round(time.monotonic() - self.last_used(service), 3))
+        if "scheduler" in service:
+            infos["batching"] = service["scheduler"].stats()
+        if "cache" in service:
+            infos["cache"] = service["cache"].stats()
+        if "admission" in service:
+            infos["admission"] = service["admission"].stats()
+        if "flights" in service:
+            infos["coalescing"] = service["flights"].stats()
+        return infos
+
+    def residency_stats(self):
+        if self.residency is None:
+            return {"memory_budget": None, "idle_timeout": None, "resident_memory": self.store.resident_memory()}
+        return self.residency.stats()
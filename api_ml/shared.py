@@ -0,0 +1,59 @@
+import fcntl
+import json
+import os
+import tempfile
+from contextlib import contextmanager
+
+
+# Services online in every worker of a server, kept in a json file of a directory shared by the workers.
+# The file is replaced atomically: it is read without lock, only the writers take a lock between processes.
+class SharedServices(object):
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self.path = os.path.join(directory, "services.json")
+        self.lock_path = os.path.join(directory, "services.lock")
+        # Version of the file last applied by this worker
+        self.version = None
+
+    def current_version(self):
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+    def changed(self):
+        # A stat per request, the file is only read when another worker changed it
+        return self.current_version() != self.version
+
+    def read(self):
+        version = self.current_version()
+        try:
+            with open(self.path) as f:
+                services = json.load(f)
+        except FileNotFoundError:
+            services = {}
+        return version, services
+
+    def write(self, services):
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory)
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump(services, f)
+            os.replace(tmp_path, self.path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    @contextmanager
+    def edit(self):
+        # The services are written back only if the block succeeds
+        with open(self.lock_path, "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                _, services = self.read()
+                yield services
+                self.write(services)
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
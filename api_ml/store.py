@@ -0,0 +1,179 @@
+import logging
+import threading
+import time
+from collections import defaultdict
+
+import torch
+
+from api_ml.artifacts import ArtifactCache
+from api_ml.models.registry import postprocessings
+from api_ml.models.utils import load_model, compile_model, quantize_model, compare_models, embedding_model, model_memory, warm_up
+from api_ml.parameters import models_available
+
+logger = logging.getLogger(__name__)
+
+
+# Reference counted store giving one shared copy of the weights per architecture to every service
+class ModelStore(object):
+    def __init__(self, artifacts_dir=None, mmap_weights=False, offload_dir=None):
+        self.models = {}
+        # Built models are reloaded from their artifact so that processes share the mapped weights
+        self.mmap_weights = mmap_weights
+        self.lock = threading.Lock()
+        self.loading_locks = defaultdict(threading.Lock)
+        self.artifacts = ArtifactCache(artifacts_dir) if artifacts_dir is not None else None
+        # Models of the parked services, saved when their last service is parked (see offload)
+        self.offloaded = ArtifactCache(offload_dir) if offload_dir is not None else None
+
+    @staticmethod
+    def key(model_name, precision=None, compile=None, mode=None):
+        # Quantized, compiled and embedding variants of an architecture are stored apart from the eager fp32 one
+        if precision == "fp32":
+            precision = None
+        if mode == "classification":
+            mode = None
+        return ":".join(x for x in [model_name, precision, compile, mode] if x is not None)
+
+    def load(self, key, model_name, mode=None):
+        # Ready to serve module saved on disk by a previous load (or by the parking of its services)
+        module, infos = None, None
+        for cache in [self.artifacts, self.offloaded]:
+            if cache is not None and module is None:
+                module, infos = cache.load(key)
+        if module is None:
+            return None, None
+        model = load_model(model_name, module)
+        if mode == "embedding":
+            model["postprocessing"] = postprocessings["flatten"]
+        return model, infos
+
+    def build(self, model_name, precision=None, compile=None, batch_size=1, mode=None):
+        start = time.perf_counter()
+        key = self.key(model_name, precision, compile, mode)
+        model, infos = self.load(key, model_name, mode)
+        if model is not None:
+            if isinstance(model["model"], torch.jit.ScriptModule):
+                warm_up(model, batch_size)
+            infos.update({"load_time": time.perf_counter() - start, "from_artifacts": True})
+            return model, infos
+
+        infos = {}
+        with self.lock:
+            eager = self.models.get(model_name)
+        if eager is not None:
+            model = eager["model"]
+        else:
+            model, _ = self.load(model_name, model_name)
+            if model is None:
+                model = load_model(model_name)
+        if model is False:
+            return model, infos
+
+        if mode == "embedding":
+            model = embedding_model(model_name, model)
+
+        # Fallback on the fp32 model if the quantization fails
+        if precision not in [None, "fp32"]:
+            try:
+                quantized = quantize_model(model, precision)
+                infos["precision"] = compare_models(model, quantized)
+                infos["quantized"] = True
+                model = quantized
+            except Exception as e:
+                logger.exception("Quantizing %s in %s failed, serving the fp32 model", model_name, precision)
+                infos["quantized"] = False
+                infos["quantize_error"] = "{}: {}".format(type(e).__name__, e)
+
+        # Compiling does not change the size of the weights but can hide them in opaque objects
+        infos["memory"] = model_memory(model["model"])
+
+        # Fallback on the eager model if the conversion fails
+        if compile is not None:
+            try:
+                model = compile_model(model, compile, batch_size)
+                infos["compiled"] = True
+            except Exception as e:
+                logger.exception("Compiling %s with %s failed, serving the eager model", key, compile)
+                infos["compiled"] = False
+                infos["compile_error"] = "{}: {}".format(type(e).__name__, e)
+
+        # A fallback model is not saved under the key of its variant, the next loads try the conversions again
+        if self.artifacts is not None and self.savable(infos):
+            try:
+                self.artifacts.save(key, model["model"], infos)
+                if self.mmap_weights and not isinstance(model["model"], torch.jit.ScriptModule):
+                    mapped, _ = self.load(key, model_name, mode)
+                    if mapped is not None:
+                        model = mapped
+            except Exception as e:
+                logger.exception("Saving the artifact of %s failed", key)
+                infos["artifact_error"] = "{}: {}".format(type(e).__name__, e)
+
+        infos.update({"load_time": time.perf_counter() - start, "from_artifacts": False})
+        return model, infos
+
+    @staticmethod
+    def savable(infos):
+        return infos.get("quantized") is not False and infos.get("compiled") is not False
+
+    def acquire(self, model_name, precision=None, compile=None, batch_size=1, mode=None):
+        if model_name not in models_available:
+            return False
+
+        key = self.key(model_name, precision, compile, mode)
+        with self.lock:
+            loading_lock = self.loading_locks[key]
+
+        # Only one thread builds a given model, the others wait and share it
+        with loading_lock:
+            with self.lock:
+                if key in self.models:
+                    self.models[key]["references"] += 1
+                    return self.models[key]["model"]
+
+            model, infos = self.build(model_name, precision, compile, batch_size, mode)
+            if model is False:
+                return False
+
+            with self.lock:
+                self.models[key] = {
+                    "model": model,
+                    "references": 1,
+                    "infos": infos
+                }
+            return model
+
+    def release(self, model_name, precision=None, compile=None, mode=None):
+        key = self.key(model_name, precision, compile, mode)
+        with self.lock:
+            if key not in self.models:
+                return
+            self.models[key]["references"] -= 1
+            # Weights are freed with the last service using them
+            if self.models[key]["references"] == 0:
+                del self.models[key]
+
+    def offload(self, model_name, precision=None, compile=None, mode=None):
+        # Called before releasing the model of a parked service: the last service using it saves it on disk
+        # so that it is reloaded from there (weights memory mapped, no quantization nor compilation again)
+        key = self.key(model_name, precision, compile, mode)
+        with self.lock:
+            entry = self.models.get(key)
+        if entry is None or entry["references"] > 1 or self.offloaded is None or not self.savable(entry["infos"]):
+            return
+        if any(x is not None and x.contains(key) for x in [self.artifacts, self.offloaded]):
+            return
+        self.offloaded.save(key, entry["model"]["model"], entry["infos"])
+
+    def resident_memory(self):
+        # Weights shared by the eager and embedding variants of an architecture are counted twice
+        with self.lock:
+            return sum(x["infos"].get("memory", 0) for x in self.models.values())
+
+    def stats(self):
+        with self.lock:
+            stats = {}
+            for key, entry in self.models.items():
+                stats[key] = {"services": entry["references"]}
+                stats[key].update(entry["infos"])
+            return stats
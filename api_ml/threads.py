@@ -0,0 +1,33 @@
+import os
+
+import torch
+
+from api_ml import parameters
+
+
+def available_cpus():
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def configure_threads():
+    # Each gunicorn worker gets its share of the cpus for the intra-op threads of torch
+    cpus = available_cpus()
+    workers = max(1, int(os.environ.get("WEB_CONCURRENCY", 1)))
+    intra_op_threads = int(os.environ.get("API_ML_INTRA_OP_THREADS", parameters.intra_op_threads or max(1, cpus // workers)))
+    inter_op_threads = int(os.environ.get("API_ML_INTER_OP_THREADS", parameters.inter_op_threads))
+
+    torch.set_num_threads(intra_op_threads)
+    try:
+        torch.set_num_interop_threads(inter_op_threads)
+    except RuntimeError:
+        # Inter-op threads can only be set once per process, before any parallel work
+        pass
+
+    return {
+        "cpus": cpus,
+        "workers": workers,
+        "intra_op_threads": torch.get_num_threads(),
+        "inter_op_threads": torch.get_num_interop_threads()
+    }
@@ -10,7 +10,7 @@ def list_routes(roots, parent=''):
             elem = [parent + '/' + root.raw_segment]
 
         if root.children:
-            return elem + list_routes(root.children, parent + '/' + root.raw_segment)
+            elems += elem + list_routes(root.children, parent + '/' + root.raw_segment)
         else:
             elems += elem
     return elems
@@ -24,6 +24,11 @@ class DefaultRoute(object):
         raise falcon.HTTPNotFound(description="Route not found. Possible routes are {}".format(self.list_routes))
 
 
+class AsyncDefaultRoute(DefaultRoute):
+    async def on_get(self, req, resp):
+        DefaultRoute.on_get(self, req, resp)
+
+
 def check_parameter(json_content, param):
     val = json_content.get(param['name'], None)
     if "mandatory" in param and not param["mandatory"] and val is None:
@@ -0,0 +1,46 @@
+# Benchmark of the eager and compiled versions of the models on CPU
+# Usage: python benchmarks/compile.py --models resnet18 mobilenet_v2 --batch_size 8
+import argparse
+import time
+
+import torch
+
+from api_ml.models.utils import load_model, compile_model
+from api_ml.parameters import compile_modes
+
+
+def measure(module, batch, repeat):
+    with torch.inference_mode():
+        module(batch)
+        durations = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            module(batch)
+            durations.append(time.perf_counter() - start)
+    durations.sort()
+    return durations[len(durations) // 2]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--models", nargs="+", default=["resnet18", "resnet50", "mobilenet_v2", "shufflenet_v2_x1_0"])
+    parser.add_argument("--batch_size", type=int, default=8)
+    parser.add_argument("--repeat", type=int, default=10)
+    args = parser.parse_args()
+
+    batch = torch.rand(args.batch_size, 3, 224, 224)
+    print("{:<20} {:<24} {:>12} {:>12}".format("model", "mode", "latency ms", "images/s"))
+    for model_name in args.models:
+        model = load_model(model_name)
+        for mode in ["eager"] + compile_modes:
+            try:
+                module = model["model"] if mode == "eager" else compile_model(model, mode, args.batch_size)["model"]
+            except Exception as e:
+                print("{:<20} {:<24} failed: {}".format(model_name, mode, e))
+                continue
+            latency = measure(module, batch, args.repeat)
+            print("{:<20} {:<24} {:>12.1f} {:>12.1f}".format(model_name, mode, latency * 1000, args.batch_size / latency))
+
+
+if __name__ == "__main__":
+    main()
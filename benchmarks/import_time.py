@@ -0,0 +1,38 @@
+# Time spent importing modules when a worker builds the app (python -X importtime against api_ml.app:get_app)
+# Usage: python benchmarks/import_time.py --top 15
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--top", type=int, default=15)
+    args = parser.parse_args()
+
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([root, os.environ.get("PYTHONPATH", "")]))
+    start = time.perf_counter()
+    process = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "from api_ml.app import get_app; get_app()"],
+        env=env, stderr=subprocess.PIPE, universal_newlines=True, check=True
+    )
+    duration = time.perf_counter() - start
+
+    # Lines are formatted as "import time: self [us] | cumulative | imported package"
+    imports = []
+    for line in process.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        imports.append((int(cumulative), name.strip()))
+
+    print("get_app: {:.2f} s, {} modules imported".format(duration, len(imports)))
+    for cumulative, name in sorted(imports, reverse=True)[:args.top]:
+        print("{:>10.1f} ms  {}".format(cumulative / 1000, name))
+
+
+if __name__ == "__main__":
+    main()
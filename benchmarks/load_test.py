@@ -0,0 +1,313 @@
+# Offline load test of the api: a fixed local image corpus is served by a stub http server and workloads
+# of urls and local paths are replayed against the app (in process or under gunicorn).
+# Usage: python benchmarks/load_test.py --models resnet18 --request_sizes 1 8 --concurrency 1 4 --output results.json
+#        python benchmarks/load_test.py --server gunicorn --workers 2 --baseline results.json
+import argparse
+import itertools
+import json
+import os
+import random
+import resource
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+from PIL import Image
+
+
+def get_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--server", choices=["inprocess", "gunicorn"], default="inprocess")
+    parser.add_argument("--workers", type=int, default=1, help="gunicorn workers")
+    parser.add_argument("--threads", type=int, default=8, help="gunicorn threads per worker")
+    parser.add_argument("--models", nargs="+", default=["resnet18"])
+    parser.add_argument("--batch_size", type=int, default=8)
+    parser.add_argument("--request_sizes", nargs="+", type=int, default=[1, 8])
+    parser.add_argument("--concurrency", nargs="+", type=int, default=[1, 4])
+    parser.add_argument("--url_ratio", type=float, default=0.5, help="share of the images given as urls instead of local paths")
+    parser.add_argument("--url_delay_ms", type=float, default=0, help="latency added by the stub http server")
+    parser.add_argument("--requests", type=int, default=20, help="requests per scenario")
+    parser.add_argument("--corpus", default=None, help="directory of images, a fixed generated corpus by default")
+    parser.add_argument("--corpus_size", type=int, default=32)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default=None, help="json file where the results are written")
+    parser.add_argument("--baseline", default=None, help="json results the new ones are compared to")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="relative change reported as a regression")
+    return parser.parse_args()
+
+
+def generate_corpus(directory, size, seed):
+    # Smooth random images of various sizes, always the same for a given seed
+    paths = []
+    for i in range(size):
+        rng = random.Random(seed * 1000 + i)
+        width, height = rng.choice([(640, 480), (480, 640), (1024, 768), (320, 320)])
+        img = Image.frombytes("RGB", (16, 12), rng.randbytes(16 * 12 * 3)).resize((width, height), Image.BILINEAR)
+        path = os.path.join(directory, "{}.jpg".format(i))
+        img.save(path, quality=90)
+        paths.append(path)
+    return paths
+
+
+def start_image_server(directory, delay_ms):
+    class Handler(SimpleHTTPRequestHandler):
+        def __init__(self, *args, **kwargs):
+            SimpleHTTPRequestHandler.__init__(self, *args, directory=directory, **kwargs)
+
+        def do_GET(self):
+            if delay_ms > 0:
+                time.sleep(delay_ms / 1000)
+            SimpleHTTPRequestHandler.do_GET(self)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, "http://127.0.0.1:{}".format(server.server_address[1])
+
+
+def process_rss(pid):
+    # Resident memory (in bytes) of a process and of its children
+    rss = 0
+    try:
+        with open("/proc/{}/status".format(pid)) as f:
+            rss = int([x for x in f if x.startswith("VmRSS")][0].split()[1]) * 1024
+        for task in os.listdir("/proc/{}/task".format(pid)):
+            with open("/proc/{}/task/{}/children".format(pid, task)) as f:
+                rss += sum(process_rss(int(x)) for x in f.read().split())
+    except (OSError, IndexError):
+        pass
+    return rss
+
+
+class InProcessClient(object):
+    def __init__(self, services):
+        from falcon import testing
+        from api_ml.app import get_app
+
+        self.client = testing.TestClient(get_app())
+        for service in services:
+            response = self.client.simulate_put("/create", json=service)
+            if response.status_code != 202:
+                raise RuntimeError("Service {} cannot be created: {}".format(service["service_name"], response.text))
+        for service in services:
+            self.wait_ready(service["service_name"])
+
+    def wait_ready(self, service_name):
+        # Services are loaded in the background, the predictions are answered 503 until they are ready
+        deadline = time.monotonic() + 600
+        while time.monotonic() < deadline:
+            online = self.client.simulate_get("/online").json["description"]
+            state = [x[service_name] for x in online if service_name in x][0]
+            if state["state"] == "ready":
+                return
+            if state["state"] == "failed":
+                raise RuntimeError("Service {} cannot be created: {}".format(service_name, state["error"]))
+            time.sleep(0.5)
+        raise RuntimeError("Service {} did not load".format(service_name))
+
+    def predict(self, body):
+        response = self.client.simulate_post("/predict", json=body)
+        return response.status_code, response.json
+
+    def peak_rss(self):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+    def close(self):
+        pass
+
+
+class GunicornClient(object):
+    def __init__(self, services, workers, threads):
+        # Every worker restores the services from a manifest, the requests can reach any of them
+        self.manifest = tempfile.NamedTemporaryFile("w", suffix=".json", delete=False)
+        json.dump(services, self.manifest)
+        self.manifest.close()
+
+        with socket.socket() as sock:
+            sock.bind(("127.0.0.1", 0))
+            self.port = sock.getsockname()[1]
+        env = dict(os.environ, API_ML_MANIFEST=self.manifest.name, WEB_CONCURRENCY=str(workers))
+        env["PYTHONPATH"] = os.pathsep.join([os.path.dirname(os.path.dirname(os.path.abspath(__file__))), env.get("PYTHONPATH", "")])
+        self.process = subprocess.Popen(
+            [sys.executable, "-m", "gunicorn", "-w", str(workers), "--threads", str(threads), "-b", "127.0.0.1:{}".format(self.port), "--timeout", "600", "api_ml.app:get_app()"],
+            env=env
+        )
+        self.url = "http://127.0.0.1:{}".format(self.port)
+        self.local = threading.local()
+
+        self.rss = 0
+        self.stopped = threading.Event()
+        try:
+            self.wait_ready()
+        except Exception:
+            self.close()
+            raise
+        threading.Thread(target=self.sample_rss, daemon=True).start()
+
+    def wait_ready(self):
+        deadline = time.monotonic() + 600
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError("gunicorn exited with code {}".format(self.process.returncode))
+            # The socket is bound before the workers have restored the services
+            try:
+                requests.get(self.url + "/available", timeout=1)
+                return
+            except requests.RequestException:
+                time.sleep(0.5)
+        raise RuntimeError("gunicorn did not start")
+
+    def sample_rss(self):
+        while not self.stopped.wait(0.1):
+            self.rss = max(self.rss, process_rss(self.process.pid))
+
+    def predict(self, body):
+        # Keep-alive connections, one session per client thread
+        if not hasattr(self.local, "session"):
+            self.local.session = requests.Session()
+        response = self.local.session.post(self.url + "/predict", json=body)
+        return response.status_code, response.json()
+
+    def peak_rss(self):
+        return self.rss
+
+    def close(self):
+        self.stopped.set()
+        self.process.terminate()
+        self.process.wait()
+        os.remove(self.manifest.name)
+
+
+def percentile(values, p):
+    values = sorted(values)
+    position = (len(values) - 1) * p / 100
+    low = int(position)
+    high = min(low + 1, len(values) - 1)
+    return values[low] + (values[high] - values[low]) * (position - low)
+
+
+def make_bodies(service_name, paths, base_url, size, url_ratio, count, rng):
+    bodies = []
+    for _ in range(count):
+        data = []
+        for _ in range(size):
+            path = rng.choice(paths)
+            data.append("{}/{}".format(base_url, os.path.basename(path)) if rng.random() < url_ratio else path)
+        bodies.append({"service_name": service_name, "data": data})
+    return bodies
+
+
+def timed_predict(client, body):
+    start = time.perf_counter()
+    try:
+        status, content = client.predict(body)
+        ok = status == 201 and all(y["predictions"] != "Input is not correct" for x in content["description"] for y in x.values())
+    except Exception:
+        ok = False
+    return time.perf_counter() - start, ok
+
+
+def run_scenario(client, bodies, concurrency):
+    # One warm-up request, then all the requests with the given number of concurrent clients
+    timed_predict(client, bodies[0])
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(partial(timed_predict, client), bodies))
+    duration = time.perf_counter() - start
+
+    latencies = [x * 1000 for x, _ in results]
+    images = sum(len(x["data"]) for x in bodies)
+    return {
+        "requests": len(bodies),
+        "images": images,
+        "errors": sum(1 for _, ok in results if not ok),
+        "latency_ms": {"p50": percentile(latencies, 50), "p95": percentile(latencies, 95), "p99": percentile(latencies, 99), "mean": sum(latencies) / len(latencies)},
+        "images_per_s": images / duration,
+        "requests_per_s": len(bodies) / duration
+    }
+
+
+def compare(results, baseline, tolerance):
+    # Throughput lower or p95 latency higher than the baseline by more than the tolerance are regressions
+    regressions = []
+    reference = {x["name"]: x for x in baseline["scenarios"]}
+    print("\n{:<48} {:>14} {:>14}".format("scenario", "images/s", "p95 latency"))
+    for scenario in results["scenarios"]:
+        if scenario["name"] not in reference:
+            continue
+        old = reference[scenario["name"]]
+        throughput = scenario["images_per_s"] / old["images_per_s"] - 1
+        latency = scenario["latency_ms"]["p95"] / old["latency_ms"]["p95"] - 1
+        print("{:<48} {:>+13.1%} {:>+13.1%}".format(scenario["name"], throughput, latency))
+        if throughput < -tolerance or latency > tolerance:
+            regressions.append(scenario["name"])
+
+    memory = results["peak_rss_mb"] / baseline["peak_rss_mb"] - 1
+    print("{:<48} {:>+13.1%}".format("peak rss", memory))
+    if memory > tolerance:
+        regressions.append("peak rss")
+    return regressions
+
+
+def main():
+    args = get_args()
+    rng = random.Random(args.seed)
+
+    with tempfile.TemporaryDirectory() as directory:
+        corpus = args.corpus if args.corpus is not None else directory
+        paths = sorted(os.path.join(corpus, x) for x in os.listdir(corpus)) if args.corpus is not None else generate_corpus(directory, args.corpus_size, args.seed)
+        image_server, base_url = start_image_server(corpus, args.url_delay_ms)
+
+        services = [{"model_name": x, "service_name": x, "type": "image", "batch_size": args.batch_size} for x in args.models]
+        if args.server == "gunicorn":
+            client = GunicornClient(services, args.workers, args.threads)
+        else:
+            client = InProcessClient(services)
+
+        scenarios = []
+        try:
+            print("{:<48} {:>8} {:>8} {:>8} {:>10} {:>7}".format("scenario", "p50 ms", "p95 ms", "p99 ms", "images/s", "errors"))
+            for model_name, size, concurrency in itertools.product(args.models, args.request_sizes, args.concurrency):
+                bodies = make_bodies(model_name, paths, base_url, size, args.url_ratio, args.requests, rng)
+                scenario = {"name": "{}/size={}/concurrency={}".format(model_name, size, concurrency), "model": model_name, "request_size": size, "concurrency": concurrency}
+                scenario.update(run_scenario(client, bodies, concurrency))
+                scenarios.append(scenario)
+                latency = scenario["latency_ms"]
+                print("{:<48} {:>8.1f} {:>8.1f} {:>8.1f} {:>10.1f} {:>7}".format(scenario["name"], latency["p50"], latency["p95"], latency["p99"], scenario["images_per_s"], scenario["errors"]))
+            peak_rss = client.peak_rss()
+        finally:
+            client.close()
+            image_server.shutdown()
+
+    results = {
+        "config": vars(args),
+        "cpus": os.cpu_count(),
+        "scenarios": scenarios,
+        "peak_rss_mb": peak_rss / 1024 ** 2
+    }
+    print("peak rss: {:.0f} MB".format(results["peak_rss_mb"]))
+
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        if regressions:
+            print("regressions: {}".format(", ".join(regressions)))
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+# Micro-benchmark of the postprocessing of Predict.predict (softmax + top-k + conversion to python)
+# Usage: python benchmarks/postprocessing.py --batch_size 32 --top_k -1
+import argparse
+import timeit
+
+import torch
+
+from api_ml.models_utils import Predict
+from api_ml.serialization import format_prediction
+
+
+class Stack(object):
+    def batch(self, input):
+        return torch.stack(input, 0)
+
+
+def legacy_predict(model, input, top_k=-1):
+    # Per row postprocessing as it was done before the batched version
+    output = model['model'](torch.stack(input, 0))
+    predictions = [torch.nn.functional.softmax(output[x, :], dim=0) for x in range(output.shape[0])]
+
+    res = []
+    if top_k == -1:
+        top_k = predictions[0].shape[0]
+    for pred in predictions:
+        topk_val, topk_indices = torch.topk(pred, top_k)
+        res.append({x.item(): y.item() for x, y in zip(topk_indices, topk_val)})
+    return res
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--batch_size", type=int, default=32)
+    parser.add_argument("--nb_classes", type=int, default=1000)
+    parser.add_argument("--top_k", type=int, default=-1)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    # Identity model: only the postprocessing is measured
+    model = {
+        "model": lambda x: x,
+        "preprocessing": Stack(),
+        "postprocessing": lambda x: torch.nn.functional.softmax(x, dim=1),
+        "mapping": None
+    }
+    input = list(torch.randn(args.batch_size, args.nb_classes))
+    predictor = Predict(None)
+
+    def predict(model, input, top_k=-1):
+        return [format_prediction(x) for x in predictor.predict(model, input, top_k=top_k)]
+
+    for name, function in [("per row", legacy_predict), ("batched", predict)]:
+        duration = min(timeit.repeat(lambda: function(model, input, top_k=args.top_k), number=1, repeat=args.repeat))
+        print("{:>8}: {:.1f} us per image".format(name, duration / args.batch_size * 1e6))
+
+
+if __name__ == "__main__":
+    main()
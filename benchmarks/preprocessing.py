@@ -0,0 +1,75 @@
+# Benchmark of the preprocessing of the images (decoding included) in images/s on one core
+# Usage: python benchmarks/preprocessing.py --images /path/to/jpegs --batch_size 32
+import argparse
+import random
+import time
+from glob import glob
+from io import BytesIO
+from PIL import Image
+
+import torch
+from torchvision import transforms
+
+from api_ml.models.utils import build_preprocessing
+
+
+def synthetic_jpegs(nb_images, width, height):
+    jpegs = []
+    for x in range(nb_images):
+        # Smooth images compress like photos, unlike random noise
+        noise = Image.frombytes("RGB", (32, 24), random.Random(x).randbytes(32 * 24 * 3))
+        buffer = BytesIO()
+        noise.resize((width, height), Image.BICUBIC).save(buffer, format="JPEG", quality=90)
+        jpegs.append(buffer.getvalue())
+    return jpegs
+
+
+def legacy(jpegs, batch_size):
+    # Full decoding then per image transforms, as it was done before the batched preprocessing
+    preprocessing = transforms.Compose([
+        transforms.Resize(256),
+        transforms.CenterCrop(224),
+        transforms.ToTensor(),
+        transforms.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225]),
+    ])
+    for ndx in range(0, len(jpegs), batch_size):
+        input_batch = tuple(preprocessing(Image.open(BytesIO(x)).convert("RGB")).unsqueeze(0) for x in jpegs[ndx:ndx + batch_size])
+        torch.cat(input_batch, 0)
+
+
+def batched(jpegs, batch_size):
+    preprocessing = build_preprocessing("imagenet")
+    for ndx in range(0, len(jpegs), batch_size):
+        images = []
+        for x in jpegs[ndx:ndx + batch_size]:
+            img = Image.open(BytesIO(x))
+            img.draft("RGB", preprocessing.draft_size)
+            images.append(preprocessing(img))
+        preprocessing.batch(images)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--images", default=None, help="directory of jpeg images, synthetic images are used if not set")
+    parser.add_argument("--nb_images", type=int, default=128)
+    parser.add_argument("--width", type=int, default=1280)
+    parser.add_argument("--height", type=int, default=960)
+    parser.add_argument("--batch_size", type=int, default=32)
+    args = parser.parse_args()
+
+    torch.set_num_threads(1)
+    if args.images is not None:
+        jpegs = [open(x, "rb").read() for x in sorted(glob(args.images + "/*"))[:args.nb_images]]
+    else:
+        jpegs = synthetic_jpegs(args.nb_images, args.width, args.height)
+
+    for name, function in [("legacy", legacy), ("batched", batched)]:
+        function(jpegs[:args.batch_size], args.batch_size)
+        start = time.perf_counter()
+        function(jpegs, args.batch_size)
+        duration = time.perf_counter() - start
+        print("{:>8}: {:.1f} images/s per core".format(name, len(jpegs) / duration))
+
+
+if __name__ == "__main__":
+    main()
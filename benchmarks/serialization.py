@@ -0,0 +1,50 @@
+# Cost per image of formatting and serializing the predictions of a batch in each output format
+# Usage: python benchmarks/serialization.py --nb_images 64 --top_k -1
+import argparse
+import json
+import time
+
+import msgpack
+import torch
+
+from api_ml.serialization import dumps_json, encode_bytes, format_prediction, output_formats, str_keys
+
+
+def get_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--nb_images", type=int, default=64)
+    parser.add_argument("--nb_classes", type=int, default=1000)
+    parser.add_argument("--top_k", type=int, default=-1)
+    parser.add_argument("--repeat", type=int, default=10)
+    return parser.parse_args()
+
+
+def measure(predictions, output, dumps, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        body = {"description": [{j: {"name": "image_{}".format(j), "predictions": format_prediction(x, output=output)} for j, x in enumerate(predictions)}]}
+        data = dumps(body)
+    return (time.perf_counter() - start) / (repeat * len(predictions)), len(data) / len(predictions)
+
+
+def main():
+    args = get_args()
+    scores = torch.softmax(torch.rand(args.nb_images, args.nb_classes), dim=1)
+    top_k = args.top_k if args.top_k != -1 else args.nb_classes
+    values, indices = torch.topk(scores, top_k, dim=1)
+    predictions = list(zip(indices.tolist(), values.tolist()))
+
+    encoders = {
+        "msgpack": lambda x: msgpack.packb(str_keys(x), use_bin_type=True),
+        "json": dumps_json,
+        "json (stdlib)": lambda x: json.dumps(x, default=encode_bytes, ensure_ascii=False).encode()
+    }
+
+    for output in output_formats:
+        for name, dumps in encoders.items():
+            duration, size = measure(predictions, output, dumps, args.repeat)
+            print("{:>15} {:>14}: {:8.1f} us per image, {:8.0f} bytes per image".format(output, name, duration * 1e6, size))
+
+
+if __name__ == "__main__":
+    main()
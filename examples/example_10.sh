@@ -0,0 +1,14 @@
+# Fit a pca reducing the 512 pooled features of resnet18 to 64 dimensions on a directory of images
+python -m api_ml.embeddings --model resnet18 --images images/ --dim 64 --output pca.pt
+
+# Create an embedding service, it shares the weights of the resnet18 classification services
+curl -X PUT "localhost:8000/create" -d '{"model_name": "resnet18", "service_name": "e1", "type":"image", "batch_size": 8, "mode": "embedding", "pca": "pca.pt", "normalize": true}'
+
+# Wait until the service is loaded, /create answers 202 at once and loads the model in the background
+while curl -s "localhost:8000/online" | grep -qE '"e1": \{[^}]*"state": "(loading|warming)"'; do sleep 1; done
+
+# Get the embeddings as lists of floats
+curl -X POST "localhost:8000/predict" -d '{"service_name": "e1", "data": ["https://images.pexels.com/photos/45201/kitty-cat-kitten-pet-45201.jpeg"]}'
+
+# Get the embeddings in msgpack, each one packed as little endian float16
+curl -X POST "localhost:8000/predict" -H "Accept: application/msgpack" -d '{"service_name": "e1", "data": ["https://images.pexels.com/photos/45201/kitty-cat-kitten-pet-45201.jpeg"], "output": "packed_float16"}' --output embeddings.msgpack
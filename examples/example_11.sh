@@ -0,0 +1,21 @@
+# Start the api keeping its jobs in a directory of the user, the jobs not finished are resumed when it restarts
+API_ML_JOBS_DIR=$HOME/api_ml_jobs gunicorn -b 0.0.0.0:8000 "api_ml.app:get_app()" &
+
+# Create service
+curl -X PUT "localhost:8000/create" -d '{"model_name": "resnet18", "service_name": "s1", "type":"image", "batch_size": 16, "top_k": 5}'
+
+# Wait until the service is loaded, /create answers 202 at once and loads the model in the background
+while curl -s "localhost:8000/online" | grep -qE '"s1": \{[^}]*"state": "(loading|warming)"'; do sleep 1; done
+
+# Submit a job scoring every image of a directory (or a list of urls with "data", or the paths matching a "glob"), its id is answered right away
+curl -X POST "localhost:8000/jobs" -d '{"service_name": "s1", "directory": "/data/catalog"}'
+
+# Progress of the job (state, images done and failed)
+curl "localhost:8000/jobs/<job_id>"
+
+# Results predicted so far, one json line per image in the order of the inputs
+curl "localhost:8000/jobs/<job_id>/results"
+
+# Cancel the job, then resume it from its checkpoint
+curl -X DELETE "localhost:8000/jobs/<job_id>"
+curl -X PUT "localhost:8000/jobs/<job_id>"
@@ -0,0 +1,13 @@
+# Create services
+curl -X PUT "localhost:8000/create" -d '{"model_name": "resnet18", "service_name": "s1", "type":"image"}'
+curl -X PUT "localhost:8000/create" -d '{"model_name": "wide_resnet101_2", "service_name": "s2", "type":"image"}'
+
+# Wait until the services are loaded, /create answers 202 at once and loads the models in the background
+while curl -s "localhost:8000/online" | grep -qE '"s1": \{[^}]*"state": "(loading|warming)"'; do sleep 1; done
+while curl -s "localhost:8000/online" | grep -qE '"s2": \{[^}]*"state": "(loading|warming)"'; do sleep 1; done
+
+# Make prediction with both services, each image is downloaded and decoded once and the models run concurrently
+curl -X POST "localhost:8000/predict" -d '{"service_name": ["s1", "s2"], "data": ["https://images.pexels.com/photos/45201/kitty-cat-kitten-pet-45201.jpeg"]}'
+
+# Same prediction with the scores averaged over the services in "ensemble"
+curl -X POST "localhost:8000/predict" -d '{"service_name": ["s1", "s2"], "data": ["https://images.pexels.com/photos/45201/kitty-cat-kitten-pet-45201.jpeg"], "ensemble": true}'
@@ -0,0 +1,15 @@
+# Start the api (one worker, the services created by /create are only known by the worker handling it) answering 503 when it already processes 32 requests
+API_ML_MAX_REQUESTS=32 gunicorn -w 1 --threads 16 -b 0.0.0.0:8000 "api_ml.app:get_app()" &
+
+# Create a heavy service processing 2 requests at the same time with 4 more waiting, the next ones are answered 429 with Retry-After
+curl -X PUT "localhost:8000/create" -d '{"model_name": "wide_resnet101_2", "service_name": "s1", "type":"image", "batch_size": 8, "max_concurrency": 2, "max_queue": 4}'
+
+# Create a latency critical service, its batches go first when the forward passes are limited (API_ML_COMPUTE_SLOTS)
+curl -X PUT "localhost:8000/create" -d '{"model_name": "mobilenet_v2", "service_name": "s2", "type":"image", "priority": 10}'
+
+# Wait until the services are loaded, /create answers 202 at once and loads the models in the background
+while curl -s "localhost:8000/online" | grep -qE '"s1": \{[^}]*"state": "(loading|warming)"'; do sleep 1; done
+while curl -s "localhost:8000/online" | grep -qE '"s2": \{[^}]*"state": "(loading|warming)"'; do sleep 1; done
+
+# Make prediction the client stops waiting for after 500 ms, it is answered 504 and its images are not predicted once the deadline has passed
+curl -X POST "localhost:8000/predict" -H "X-Deadline-Ms: 500" -d '{"service_name": "s2", "data": ["https://images.pexels.com/photos/45201/kitty-cat-kitten-pet-45201.jpeg"]}'
@@ -0,0 +1,21 @@
+# Start the api (one worker, the services created by /create are only known by the worker handling it) keeping at most 200 MB of weights, the services idle for 10 minutes are parked
+API_ML_MEMORY_BUDGET_MB=200 API_ML_IDLE_TIMEOUT=600 API_ML_OFFLOAD_DIR=$HOME/.cache/api_ml gunicorn -w 1 --threads 16 -b 0.0.0.0:8000 "api_ml.app:get_app()" &
+
+# Create more services than the budget holds, the least recently used ones are parked (their weights saved in API_ML_OFFLOAD_DIR)
+curl -X PUT "localhost:8000/create" -d '{"model_name": "resnet50", "service_name": "s1", "type":"image"}'
+curl -X PUT "localhost:8000/create" -d '{"model_name": "densenet161", "service_name": "s2", "type":"image"}'
+curl -X PUT "localhost:8000/create" -d '{"model_name": "vgg16", "service_name": "s3", "type":"image"}'
+
+# Wait until the services are loaded, /create answers 202 at once and loads the models in the background
+while curl -s "localhost:8000/online" | grep -qE '"s1": \{[^}]*"state": "(loading|warming)"'; do sleep 1; done
+while curl -s "localhost:8000/online" | grep -qE '"s2": \{[^}]*"state": "(loading|warming)"'; do sleep 1; done
+while curl -s "localhost:8000/online" | grep -qE '"s3": \{[^}]*"state": "(loading|warming)"'; do sleep 1; done
+
+# Parked services stay online, their residency gives their state, the times they were parked and reloaded and the last reload latency
+curl -X GET "localhost:8000/online"
+
+# A prediction of a parked service reloads it first
+curl -X POST "localhost:8000/predict" -d '{"service_name": "s1", "data": ["https://images.pexels.com/photos/45201/kitty-cat-kitten-pet-45201.jpeg"]}'
+
+# Reload latencies are in the reload stage of api_ml_stage_seconds
+curl -X GET "localhost:8000/metrics"
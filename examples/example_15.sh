@@ -0,0 +1,11 @@
+# Create a service, the api answers 202 at once and loads the model in the background (warmed up with a first forward pass)
+curl -X PUT "localhost:8000/create" -d '{"model_name": "wide_resnet101_2", "service_name": "s1", "type":"image", "batch_size": 8, "warm_up": true}'
+
+# The state of the service is loading, warming, ready or failed (with its error), its timing gives the load and warm-up times
+curl -X GET "localhost:8000/online"
+
+# Make prediction while the service is loading: answered 503 with Retry-After at once...
+curl -X POST "localhost:8000/predict" -d '{"service_name": "s1", "data": ["https://images.pexels.com/photos/45201/kitty-cat-kitten-pet-45201.jpeg"]}'
+
+# ... or waiting for the service until the deadline of the request (504 if it is still loading then)
+curl -X POST "localhost:8000/predict" -H "X-Deadline-Ms: 30000" -d '{"service_name": "s1", "data": ["https://images.pexels.com/photos/45201/kitty-cat-kitten-pet-45201.jpeg"]}'
@@ -0,0 +1,15 @@
+# Create a service, concurrent predictions of the same urls or paths are coalesced (one download and one forward pass)
+curl -X PUT "localhost:8000/create" -d '{"model_name": "resnet18", "service_name": "s1", "type":"image"}'
+
+# Create a service predicting every input of every request again
+curl -X PUT "localhost:8000/create" -d '{"model_name": "resnet18", "service_name": "s2", "type":"image", "coalesce": false}'
+
+# Wait until the services are loaded, /create answers 202 at once and loads the models in the background
+while curl -s "localhost:8000/online" | grep -qE '"s1": \{[^}]*"state": "(loading|warming)"'; do sleep 1; done
+while curl -s "localhost:8000/online" | grep -qE '"s2": \{[^}]*"state": "(loading|warming)"'; do sleep 1; done
+
+# The duplicate of the request is predicted once, as the ones of concurrent requests
+curl -X POST "localhost:8000/predict" -d '{"service_name": "s1", "data": ["https://images.pexels.com/photos/45201/kitty-cat-kitten-pet-45201.jpeg", "https://images.pexels.com/photos/45201/kitty-cat-kitten-pet-45201.jpeg"]}'
+
+# Inputs coalesced are counted in the coalescing of the service and in api_ml_coalesced_inputs_total
+curl -X GET "localhost:8000/online"
@@ -4,6 +4,10 @@ curl -X PUT "localhost:8000/create" -d '{"model_name": "resnet18", "service_name
 # Create service 2
 curl -X PUT "localhost:8000/create" -d '{"model_name": "wide_resnet101_2", "service_name": "s2", "type":"image"}'
 
+# Wait until the services are loaded, /create answers 202 at once and loads the models in the background
+while curl -s "localhost:8000/online" | grep -qE '"s1": \{[^}]*"state": "(loading|warming)"'; do sleep 1; done
+while curl -s "localhost:8000/online" | grep -qE '"s2": \{[^}]*"state": "(loading|warming)"'; do sleep 1; done
+
 # Make prediction using model 1
 curl -X POST "localhost:8000/predict" -d '{"service_name": "s1", "data":["https://images.daznservices.com/di/library/GOAL/99/e4/cristiano-ronaldo-juventus-2019-20_16jgivl5d7ean1cw4aymindbiy.jpg", "https://images.pexels.com/photos/45201/kitty-cat-kitten-pet-45201.jpeg"]}'
 
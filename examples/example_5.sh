@@ -0,0 +1,11 @@
+# Create service
+curl -X PUT "localhost:8000/create" -d '{"model_name": "resnet18", "service_name": "s1", "type":"image", "top_k": 5}'
+
+# Wait until the service is loaded, /create answers 202 at once and loads the model in the background
+while curl -s "localhost:8000/online" | grep -qE '"s1": \{[^}]*"state": "(loading|warming)"'; do sleep 1; done
+
+# Make prediction with the scores as parallel arrays of class indices and scores
+curl -X POST "localhost:8000/predict" -d '{"service_name": "s1", "data": ["https://images.pexels.com/photos/45201/kitty-cat-kitten-pet-45201.jpeg"], "output": "columns"}'
+
+# Make prediction answered in msgpack, the arrays being packed as little endian int32 indices and float16 scores
+curl -X POST "localhost:8000/predict" -H "Accept: application/msgpack" -d '{"service_name": "s1", "data": ["https://images.pexels.com/photos/45201/kitty-cat-kitten-pet-45201.jpeg"], "output": "packed_float16"}' --output predictions.msgpack
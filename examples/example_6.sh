@@ -0,0 +1,8 @@
+# Create service
+curl -X PUT "localhost:8000/create" -d '{"model_name": "resnet18", "service_name": "s1", "type":"image", "batch_size": 8}'
+
+# Wait until the service is loaded, /create answers 202 at once and loads the model in the background
+while curl -s "localhost:8000/online" | grep -qE '"s1": \{[^}]*"state": "(loading|warming)"'; do sleep 1; done
+
+# Make prediction streamed as one json line per image as soon as its batch is predicted
+curl -N -X POST "localhost:8000/predict" -d '{"service_name": "s1", "data": ["https://images.pexels.com/photos/45201/kitty-cat-kitten-pet-45201.jpeg", "https://images.pexels.com/photos/45201/kitty-cat-kitten-pet-45201.jpeg"], "stream": "image"}'
@@ -0,0 +1,12 @@
+# Start 4 workers sharing their services and the weights of the models: the models of the manifest are
+# loaded once by the master (--preload) and the workers memory map the ones created later
+API_ML_SHARED_DIR=/tmp/api_ml API_ML_MANIFEST=manifest.json gunicorn --preload -w 4 -b 0.0.0.0:8000 "api_ml.app:get_app()" &
+
+# Create service (every worker serves it, whichever worker handled the creation)
+curl -X PUT "localhost:8000/create" -d '{"model_name": "resnet18", "service_name": "s1", "type":"image"}'
+
+# Wait until the service is loaded, /create answers 202 at once and loads the model in the background
+while curl -s "localhost:8000/online" | grep -qE '"s1": \{[^}]*"state": "(loading|warming)"'; do sleep 1; done
+
+# Make prediction
+curl -X POST "localhost:8000/predict" -d '{"service_name": "s1", "data": ["https://images.pexels.com/photos/45201/kitty-cat-kitten-pet-45201.jpeg"]}'
@@ -0,0 +1,77 @@
+import time
+import unittest
+
+import falcon
+from falcon import testing
+
+from api_ml.admission import AdmissionControl, DeadlineExceeded, Overloaded
+from api_ml.models_utils import Predict
+from api_ml.services import Services
+
+
+class TestAdmissionControl(unittest.TestCase):
+    def test_queue(self):
+        control = AdmissionControl(1, max_queue=1)
+        self.assertIsNone(control.try_acquire())
+        waiter = control.try_acquire()
+        self.assertIsNotNone(waiter)
+        with self.assertRaises(Overloaded) as e:
+            control.try_acquire()
+        self.assertGreaterEqual(e.exception.retry_after, 1)
+
+        # The slot is handed over to the waiting request
+        control.release()
+        self.assertIsNone(waiter.result(timeout=1))
+        self.assertEqual(control.stats()["running"], 1)
+        self.assertEqual(control.stats()["rejected"], {"overloaded": 1})
+
+    def test_deadline(self):
+        control = AdmissionControl(1, max_queue=1)
+        control.try_acquire()
+        with self.assertRaises(DeadlineExceeded):
+            with control.slot(deadline=time.monotonic() + 0.05):
+                pass
+        self.assertEqual(control.stats(), {"max_concurrency": 1, "max_queue": 1, "running": 1, "waiting": 0, "rejected": {"deadline": 1}})
+
+
+class TestRejections(unittest.TestCase):
+    def setUp(self):
+        self.services = Services()
+        self.services.admission = AdmissionControl(1)
+        app = falcon.App()
+        app.add_route("/predict", Predict(self.services))
+        self.client = testing.TestClient(app)
+
+        # Ready service with a stub model, the requests are rejected before anything is predicted
+        service = self.services.create_service({"service_name": "s1", "model_name": "resnet18", "type": "image", "max_concurrency": 1, "max_queue": 0})
+        self.services.set_state("s1", service, "ready", model={"model": object(), "mapping": None})
+        self.service = service
+
+    def tearDown(self):
+        for name in list(self.services.models_online):
+            self.services.delete_service(name)
+
+    def post(self, service_name="s1"):
+        return self.client.simulate_post("/predict", json={"service_name": service_name, "data": ["/missing.jpg"]})
+
+    def test_service_overloaded(self):
+        self.service["admission"].try_acquire()
+        response = self.post()
+        self.assertEqual(response.status_code, 429)
+        self.assertGreaterEqual(int(response.headers["Retry-After"]), 1)
+
+    def test_worker_overloaded(self):
+        self.services.admission.try_acquire()
+        response = self.post()
+        self.assertEqual(response.status_code, 503)
+        self.assertGreaterEqual(int(response.headers["Retry-After"]), 1)
+
+    def test_service_loading(self):
+        self.services.create_service({"service_name": "s2", "model_name": "resnet18", "type": "image"})
+        response = self.post("s2")
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.headers["Retry-After"], "1")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,89 @@
+import threading
+import time
+import unittest
+
+from api_ml.admission import DeadlineExceeded
+from api_ml.batching import BatchScheduler
+
+
+class StubModel(object):
+    # Predictions are the images, the sizes of the batches are recorded
+    def __init__(self):
+        self.batches = []
+        self.release = threading.Event()
+        self.release.set()
+
+    def __call__(self, model, imgs, top_k=-1, observe=None):
+        self.release.wait()
+        self.batches.append(len(imgs))
+        return list(imgs)
+
+
+class TestBatchScheduler(unittest.TestCase):
+    def setUp(self):
+        self.predict = StubModel()
+        self.schedulers = []
+
+    def tearDown(self):
+        self.predict.release.set()
+        for scheduler in self.schedulers:
+            scheduler.stop()
+
+    def scheduler(self, batch_size, max_wait):
+        scheduler = BatchScheduler({"model": object()}, self.predict, batch_size=batch_size, max_wait=max_wait)
+        self.schedulers.append(scheduler)
+        return scheduler
+
+    def test_batch_fill(self):
+        # A full batch runs at once, the rest of the images once max_wait has passed
+        scheduler = self.scheduler(4, 0.2)
+        futures = scheduler.submit(list(range(6)))
+        self.assertEqual([x.result(timeout=5) for x in futures], list(range(6)))
+        self.assertEqual(self.predict.batches, [4, 2])
+
+        stats = scheduler.stats()
+        self.assertEqual((stats["batches"], stats["images"]), (2, 6))
+        self.assertEqual(stats["batch_sizes"], {"2": 1, "4": 1})
+        self.assertAlmostEqual(stats["mean_batch_fill"], 0.75)
+
+    def test_concurrent_requests(self):
+        # Images submitted by concurrent requests within max_wait share a batch
+        scheduler = self.scheduler(8, 0.2)
+        futures = []
+        threads = [threading.Thread(target=lambda x: futures.extend(scheduler.submit([x, x])), args=(i,)) for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        [x.result(timeout=5) for x in futures]
+        self.assertEqual(self.predict.batches, [8])
+
+    def test_deadline_expired(self):
+        # Images still queued when their deadline passes are not predicted
+        scheduler = self.scheduler(1, 0)
+        self.predict.release.clear()
+        first = scheduler.submit(["first"])[0]
+        expired = scheduler.submit(["expired"], deadline=time.monotonic() + 0.05)[0]
+        kept = scheduler.submit(["kept"], deadline=time.monotonic() + 60)[0]
+        time.sleep(0.1)
+        self.predict.release.set()
+
+        self.assertEqual(first.result(timeout=5), "first")
+        with self.assertRaises(DeadlineExceeded):
+            expired.result(timeout=5)
+        self.assertEqual(kept.result(timeout=5), "kept")
+        self.assertEqual(scheduler.stats()["expired"], 1)
+        self.assertEqual(self.predict.batches, [1, 1])
+
+    def test_stop(self):
+        # Images already queued are predicted, the next ones are refused
+        scheduler = self.scheduler(4, 0.2)
+        futures = scheduler.submit([1, 2])
+        scheduler.stop()
+        self.assertEqual([x.result(timeout=5) for x in futures], [1, 2])
+        with self.assertRaises(RuntimeError):
+            scheduler.submit([3])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,57 @@
+import time
+import unittest
+
+from PIL import Image
+
+from api_ml.cache import PredictionCache
+
+
+class TestPredictionCache(unittest.TestCase):
+    def test_lru_eviction(self):
+        cache = PredictionCache(2)
+        cache.put("a", 1)
+        cache.put("b", 2)
+        # a is used again, b is now the least recently used
+        self.assertEqual(cache.get("a"), 1)
+        cache.put("c", 3)
+
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get("a"), 1)
+        self.assertEqual(cache.get("c"), 3)
+        stats = cache.stats()
+        self.assertEqual((stats["size"], stats["evictions"], stats["hits"], stats["misses"]), (2, 1, 3, 1))
+
+    def test_put_existing(self):
+        cache = PredictionCache(2)
+        cache.put("a", 1)
+        cache.put("b", 2)
+        cache.put("a", 3)
+        cache.put("c", 4)
+        self.assertEqual(cache.get("a"), 3)
+        self.assertIsNone(cache.get("b"))
+
+    def test_ttl(self):
+        cache = PredictionCache(2, ttl=0.05)
+        cache.put("a", 1)
+        self.assertEqual(cache.get("a"), 1)
+        time.sleep(0.1)
+        self.assertIsNone(cache.get("a"))
+        stats = cache.stats()
+        self.assertEqual((stats["size"], stats["expirations"], stats["misses"]), (0, 1, 1))
+
+    def test_count_miss(self):
+        # The url lookup before the one of the image does not count a second miss for the same input
+        cache = PredictionCache(2, cache_urls=True)
+        self.assertIsNone(cache.get(cache.url_key("resnet18", -1, "http://x/a.jpg"), count_miss=False))
+        self.assertIsNone(cache.get("image"))
+        self.assertEqual(cache.stats()["misses"], 1)
+
+    def test_image_key(self):
+        red, blue = Image.new("RGB", (8, 8), (255, 0, 0)), Image.new("RGB", (8, 8), (0, 0, 255))
+        self.assertEqual(PredictionCache.image_key("resnet18", 5, red), PredictionCache.image_key("resnet18", 5, red.copy()))
+        self.assertNotEqual(PredictionCache.image_key("resnet18", 5, red), PredictionCache.image_key("resnet18", 5, blue))
+        self.assertNotEqual(PredictionCache.image_key("resnet18", 5, red), PredictionCache.image_key("resnet18", -1, red))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,102 @@
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from concurrent.futures import Future
+
+from PIL import Image
+
+from api_ml.coalescing import SingleFlight
+from api_ml.fetching import ImageFetcher
+from api_ml.metrics import ServiceMetrics
+from api_ml.models.utils import build_preprocessing
+from api_ml.models_utils import Predict
+
+
+class StubScheduler(object):
+    # Predictions are the sizes of the preprocessed images, the submitted batches are recorded
+    top_k = -1
+
+    def __init__(self):
+        self.model = {"preprocessing": build_preprocessing("imagenet"), "mapping": None}
+        self.lock = threading.Lock()
+        self.batches = []
+
+    def submit(self, imgs, deadline=None):
+        with self.lock:
+            if len(imgs) > 0:
+                self.batches.append(len(imgs))
+        futures = []
+        for img in imgs:
+            future = Future()
+            future.set_result(tuple(img.shape))
+            futures.append(future)
+        return futures
+
+
+class TestSingleFlight(unittest.TestCase):
+    def test_join(self):
+        flights = SingleFlight()
+        future, started = flights.join("a")
+        self.assertTrue(started)
+        self.assertEqual(flights.join("a"), (future, False))
+        self.assertEqual(flights.find("a"), (future, False))
+        self.assertIsNone(flights.find("b"))
+
+        # The flight is forgotten once done, the next request starts another one
+        future.set_result(1)
+        self.assertIsNone(flights.find("a"))
+        self.assertTrue(flights.join("a")[1])
+        self.assertEqual(flights.stats(), {"in_flight": 1, "started": 2, "coalesced": 2})
+
+    def test_failure(self):
+        flights = SingleFlight()
+        future, _ = flights.join("a")
+        joined, _ = flights.join("a")
+        future.set_exception(OSError("download failed"))
+        with self.assertRaises(OSError):
+            joined.result()
+        self.assertEqual(flights.stats()["in_flight"], 0)
+
+
+class TestCoalescedInputs(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.paths = []
+        for i, color in enumerate([(255, 0, 0), (0, 255, 0), (0, 0, 255)]):
+            self.paths.append(os.path.join(self.directory, "{}.jpg".format(i)))
+            Image.new("RGB", (64, 48), color).save(self.paths[-1])
+        self.fetcher = ImageFetcher(max_workers=4)
+        self.predict = Predict(None, self.fetcher)
+        self.scheduler = StubScheduler()
+        self.service = {"model_name": "resnet18", "model": self.scheduler.model, "metrics": ServiceMetrics(), "flights": SingleFlight()}
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def run_batch(self, inputs):
+        batch = [(x, x) for x in inputs]
+        fetched = self.predict.fetch_batch(self.service, self.scheduler, batch)
+        submitted = self.predict.submit_batch(self.service, self.scheduler, list, *fetched)
+        res = self.predict.collect_batch(self.service, self.scheduler, list, *submitted)
+        return [res[j]["predictions"] for j in range(len(inputs))]
+
+    def test_duplicates(self):
+        # Duplicates of a request are predicted once, the images started by the batch are submitted together
+        inputs = self.paths + self.paths[:2] + ["/missing.jpg", "/missing.jpg"]
+        predictions = self.run_batch(inputs)
+
+        self.assertEqual(predictions, [[224, 224, 3]] * 5 + ["Input is not correct"] * 2)
+        self.assertEqual(self.scheduler.batches, [3])
+        self.assertEqual(self.service["flights"].stats(), {"in_flight": 0, "started": 4, "coalesced": 3})
+
+    def test_without_coalescing(self):
+        del self.service["flights"]
+        predictions = self.run_batch(self.paths + self.paths[:2])
+        self.assertEqual(predictions, [[224, 224, 3]] * 5)
+        self.assertEqual(self.scheduler.batches, [5])
+
+
+if __name__ == "__main__":
+    unittest.main()
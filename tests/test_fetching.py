@@ -0,0 +1,152 @@
+import threading
+import time
+import unittest
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO
+
+import requests
+from PIL import Image
+
+from api_ml.fetching import ImageFetcher, ImageTooLarge
+from api_ml.metrics import ServiceMetrics
+from api_ml.models_utils import Predict
+
+
+def jpeg():
+    buffer = BytesIO()
+    Image.new("RGB", (32, 32), (255, 0, 0)).save(buffer, format="JPEG")
+    return buffer.getvalue()
+
+
+# Stub of the servers the images are downloaded from
+class StubHandler(BaseHTTPRequestHandler):
+    image = jpeg()
+
+    def send(self, body, length=True):
+        self.send_response(200)
+        self.send_header("Content-Type", "image/jpeg")
+        if length:
+            self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == "/image.jpg":
+            self.send(self.image)
+        elif self.path == "/redirect":
+            self.send_response(302)
+            self.send_header("Location", "/image.jpg")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+        elif self.path == "/redirect_large":
+            self.send_response(302)
+            self.send_header("Location", "/large")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+        elif self.path == "/large":
+            self.send(b"\0" * 4096)
+        elif self.path == "/large_chunked":
+            # No Content-Length, the size is only known while reading
+            self.send(b"\0" * 4096, length=False)
+        elif self.path == "/slow":
+            time.sleep(1)
+            self.send(self.image)
+        elif self.path == "/drip":
+            # Headers at once, then the body too slowly
+            self.send_response(200)
+            self.end_headers()
+            for _ in range(10):
+                self.wfile.write(b"\0" * 64)
+                self.wfile.flush()
+                time.sleep(0.1)
+        elif self.path == "/text":
+            self.send(b"not an image")
+        else:
+            self.send_error(404)
+
+    def log_message(self, *args):
+        pass
+
+
+class StubScheduler(object):
+    top_k = -1
+
+    def submit(self, imgs, deadline=None):
+        futures = []
+        for img in imgs:
+            future = Future()
+            future.set_result(img.size)
+            futures.append(future)
+        return futures
+
+
+class TestImageFetcher(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+        cls.server.daemon_threads = True
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.base = "http://127.0.0.1:{}".format(cls.server.server_port)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        self.fetcher = ImageFetcher(max_workers=4, timeout=0.5, max_size=1024)
+
+    def url(self, path):
+        return self.base + path
+
+    def test_download(self):
+        img = self.fetcher.load(self.url("/image.jpg"))
+        self.assertEqual(img.size, (32, 32))
+
+    def test_redirect(self):
+        img = self.fetcher.load(self.url("/redirect"))
+        self.assertEqual(img.size, (32, 32))
+        with self.assertRaises(ImageTooLarge):
+            self.fetcher.load(self.url("/redirect_large"))
+
+    def test_size_limit(self):
+        with self.assertRaises(ImageTooLarge):
+            self.fetcher.load(self.url("/large"))
+        with self.assertRaises(ImageTooLarge):
+            self.fetcher.load(self.url("/large_chunked"))
+        # Raw images given in the body of the request
+        with self.assertRaises(ImageTooLarge):
+            self.fetcher.load(b"\0" * 4096)
+
+    def test_timeout(self):
+        with self.assertRaises(requests.Timeout):
+            self.fetcher.load(self.url("/slow"))
+        with self.assertRaises(TimeoutError):
+            self.fetcher.load(self.url("/drip"))
+
+    def test_errors(self):
+        with self.assertRaises(requests.HTTPError):
+            self.fetcher.load(self.url("/missing"))
+        with self.assertRaises(OSError):
+            self.fetcher.load(self.url("/text"))
+
+    def test_failed_inputs(self):
+        # Each input failing is answered 'Input is not correct', the others are predicted
+        predict = Predict(None, self.fetcher)
+        service, scheduler = {"metrics": ServiceMetrics()}, StubScheduler()
+        paths = ["/image.jpg", "/missing", "/large", "/slow", "/text", "/redirect"]
+        batch = [(x, self.url(x)) for x in paths]
+
+        with self.assertLogs("api_ml.models_utils", level="ERROR") as logs:
+            images = predict.wait_images([service], self.fetcher.fetch([x[1] for x in batch], lambda img: (None, None, img)))
+        self.assertEqual(len(logs.records), 4)
+        submitted = predict.submit_images(service, scheduler, list, batch, [None] * len(batch), images, [None] * len(batch))
+        res = predict.collect_batch(service, scheduler, list, *submitted)
+
+        self.assertEqual([res[j]["predictions"] for j in range(len(paths))], [[32, 32], "Input is not correct", "Input is not correct", "Input is not correct", "Input is not correct", [32, 32]])
+        self.assertEqual(service["metrics"].snapshot()["failures"], {"download": 1, "too_large": 1, "timeout": 1, "decode": 1})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,103 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from api_ml.jobs import JobManager
+
+
+class StubScheduler(object):
+    model = {"mapping": None}
+
+
+class StubPredict(object):
+    # Predictions are the lengths of the inputs, in batches of 2, the inputs predicted are recorded
+    def __init__(self):
+        self.inputs = []
+
+    def wait_ready(self, service_names, deadline=None, wait=None):
+        pass
+
+    def get_service(self, service_name):
+        return {}, StubScheduler()
+
+    def iter_predictions(self, service, scheduler, format_output, inputs, names, lookahead=None):
+        for i in range(0, len(inputs), 2):
+            self.inputs.extend(inputs[i:i + 2])
+            yield {j: {"name": x, "predictions": "Input is not correct" if x == "bad" else format_output(([0], [float(len(x))]))} for j, x in enumerate(inputs[i:i + 2])}
+
+
+class TestJobManager(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def results(self, manager, job_id):
+        with open(manager.path(job_id, "results.jsonl")) as f:
+            return [json.loads(x) for x in f]
+
+    def test_run(self):
+        manager = JobManager(StubPredict(), self.directory)
+        job = manager.submit("s1", ["a", "bb", "bad"])
+        manager.executor.shutdown(wait=True)
+
+        job = manager.read(job["job_id"])
+        self.assertEqual((job["state"], job["done"], job["failed"]), ("done", 3, 1))
+        self.assertEqual([x["index"] for x in self.results(manager, job["job_id"])], [0, 1, 2])
+
+    def test_resume_after_restart(self):
+        # A worker crashed after writing 2 results and a part of the third one
+        crashed = JobManager(StubPredict(), self.directory)
+        crashed.executor.submit = lambda *args: None
+        job = crashed.submit("s1", ["a", "bb", "ccc", "dddd", "bad"])
+        job.update({"state": "running", "done": 2})
+        crashed.write(job)
+        with open(crashed.path(job["job_id"], "results.jsonl"), "w") as f:
+            f.write(json.dumps({"index": 0, "name": "a", "predictions": {"0": 1.}}) + "\n")
+            f.write(json.dumps({"index": 1, "name": "bb", "predictions": {"0": 2.}}) + "\n")
+            f.write('{"index": 2, "na')
+
+        # The next worker resumes it after the last complete line
+        predict = StubPredict()
+        manager = JobManager(predict, self.directory)
+        manager.start()
+        manager.executor.shutdown(wait=True)
+
+        self.assertEqual(predict.inputs, ["ccc", "dddd", "bad"])
+        results = self.results(manager, job["job_id"])
+        self.assertEqual([x["index"] for x in results], [0, 1, 2, 3, 4])
+        self.assertEqual([x["name"] for x in results], ["a", "bb", "ccc", "dddd", "bad"])
+        job = manager.read(job["job_id"])
+        self.assertEqual((job["state"], job["done"], job["failed"]), ("done", 5, 1))
+
+    def test_finished_not_resumed(self):
+        manager = JobManager(StubPredict(), self.directory)
+        job = manager.submit("s1", ["a"])
+        manager.executor.shutdown(wait=True)
+
+        predict = StubPredict()
+        restarted = JobManager(predict, self.directory)
+        restarted.start()
+        restarted.executor.shutdown(wait=True)
+        self.assertEqual(predict.inputs, [])
+        self.assertEqual(restarted.read(job["job_id"])["state"], "done")
+
+    def test_cancel(self):
+        manager = JobManager(StubPredict(), self.directory)
+        manager.executor.submit = lambda *args: None
+        job = manager.submit("s1", ["a", "bb"])
+        self.assertEqual(manager.cancel(job["job_id"])["state"], "cancelled")
+        self.assertTrue(os.path.exists(manager.path(job["job_id"], "cancel")))
+
+        # Resuming a cancelled job runs it again from its checkpoint
+        manager = JobManager(StubPredict(), self.directory)
+        manager.resume(job["job_id"])
+        manager.executor.shutdown(wait=True)
+        self.assertEqual(manager.read(job["job_id"])["state"], "done")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,75 @@
+import threading
+import time
+import unittest
+
+from api_ml.store import ModelStore
+
+
+class StubStore(ModelStore):
+    # Models are built without any weights, the builds are counted
+    def __init__(self, *args, **kwargs):
+        ModelStore.__init__(self, *args, **kwargs)
+        self.builds = []
+
+    def build(self, model_name, precision=None, compile=None, batch_size=1, mode=None):
+        time.sleep(0.05)
+        self.builds.append(self.key(model_name, precision, compile, mode))
+        return {"model": object()}, {"memory": 10}
+
+
+class TestModelStore(unittest.TestCase):
+    def test_refcount(self):
+        store = StubStore()
+        model = store.acquire("resnet18")
+        self.assertIs(store.acquire("resnet18"), model)
+        self.assertEqual(store.stats()["resnet18"]["services"], 2)
+
+        # The model is freed with the last service using it
+        store.release("resnet18")
+        self.assertEqual(store.stats()["resnet18"]["services"], 1)
+        store.release("resnet18")
+        self.assertEqual(store.stats(), {})
+        self.assertEqual(store.resident_memory(), 0)
+
+        # Released again, or never acquired, nothing happens
+        store.release("resnet18")
+        self.assertIsNot(store.acquire("resnet18"), model)
+        self.assertEqual(store.builds, ["resnet18", "resnet18"])
+
+    def test_variants(self):
+        store = StubStore()
+        store.acquire("resnet18")
+        store.acquire("resnet18", precision="fp32")
+        store.acquire("resnet18", precision="int8-dynamic")
+        store.acquire("resnet18", mode="embedding")
+        self.assertEqual(store.builds, ["resnet18", "resnet18:int8-dynamic", "resnet18:embedding"])
+        self.assertEqual(store.resident_memory(), 30)
+
+    def test_concurrent_acquire(self):
+        # One thread builds the model, the others wait for it and share it
+        store = StubStore()
+        models = []
+        threads = [threading.Thread(target=lambda: models.append(store.acquire("resnet18"))) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(store.builds, ["resnet18"])
+        self.assertTrue(all(x is models[0] for x in models))
+        self.assertEqual(store.stats()["resnet18"]["services"], 4)
+
+    def test_unknown_model(self):
+        store = StubStore()
+        self.assertFalse(store.acquire("unknown"))
+        self.assertEqual(store.builds, [])
+
+    def test_fallback_not_saved(self):
+        # Models served after a failed conversion are not saved under the key of their variant
+        self.assertTrue(ModelStore.savable({"quantized": True, "compiled": True}))
+        self.assertTrue(ModelStore.savable({}))
+        self.assertFalse(ModelStore.savable({"quantized": False}))
+        self.assertFalse(ModelStore.savable({"compiled": False}))
+
+
+if __name__ == "__main__":
+    unittest.main()